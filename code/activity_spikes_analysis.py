@@ -1,70 +1,100 @@
 import pandas as pd
-import numpy as np
 import glob
-import matplotlib.pyplot as plt
-from scipy.signal import argrelextrema
 import os
-from google.colab import drive
-
-
-def analyze_data(dataset_path, schedule_file):
+from bot_labels import label_rules
+from checkpoint import Checkpoint
+from data_loader import iter_data_files
+from timestamps import DATA_TZ, TIME_CACHE_VERSION, floor_ms, to_datetime
+from baseline_detector import detect_baseline_spikes
+from epg import Epg, local_to_ms
+from kernels import local_maxima
+from render_backend import ChartRenderer, plot_line
+
+# Сколько файлов читать наперед, пока обрабатывается текущий
+PREFETCH_DEPTH = 2
+OUTPUT_DIR = '/content/drive/MyDrive/output_data'
+
+
+def draw_activity_spikes(fig, ts, requests, peak_ts, peak_requests):
+    """Рисует поминутную активность (с прореживанием) и отмечает всплески"""
+    ax = fig.add_subplot(1, 1, 1)
+    plot_line(ax, ts, requests, label='Все запросы', color='blue', alpha=0.7)
+    ax.scatter(peak_ts, peak_requests, color='red', label='Топ-10 всплесков', zorder=3)
+    ax.set_xlabel('Время')
+    ax.set_ylabel('Количество запросов')
+    ax.set_title('Всплески активности и их соответствие передачам')
+    ax.legend()
+    ax.tick_params(axis='x', labelrotation=45)
+    ax.grid()
+
+
+def analyze_data(dataset_path, schedule_file, detector='top', checkpoint_dir=None, output_dir=OUTPUT_DIR):
+    """
+    detector: 'top' - десять крупнейших минут, 'baseline' - отклонения от сезонной базы.
+    checkpoint_dir: папка чекпоинтов поминутного ряда; с ней повторный запуск дочитывает
+    только новые или изменившиеся файлы (None - без чекпоинта, в папку данных ничего не пишется).
+    output_dir: папка для CSV и графика.
+    """
 
     # 1. Загружаем все паркет-файлы и объединяем
-    all_files = glob.glob(dataset_path)
+    all_files = sorted(glob.glob(dataset_path))
     if not all_files:
         raise FileNotFoundError(f"Не найдены файлы по указанному пути: {dataset_path}")
-    # Чтение файлов (только нужные столбцы) с фильтрацией (только `page_view`)
-    chunks = []
-    for f in all_files:
-        chunk = pd.read_parquet(f, columns=['event', 'ts'])
-        chunk = chunk[chunk['event'] == 'page_view']
-        chunks.append(chunk)
-
-    data = pd.concat(chunks)
-    del chunks  # Освобождаем память
-
-    # 2. Преобразуем `ts` в datetime и группируем по минутам
-    data['ts'] = pd.to_datetime(data['ts'])
-    activity = data.groupby(data['ts'].dt.floor('min')).size().reset_index(name='requests')
+    checkpoint, parts = None, None
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(checkpoint_dir, 'activity_spikes', params={
+            'event': 'page_view', 'time_cache': TIME_CACHE_VERSION, 'data_tz': DATA_TZ,
+            'bot_rules': label_rules()})
+        parts = checkpoint.restore(all_files)
+        all_files = checkpoint.pending(all_files)
+    # Чтение файлов (только нужные столбцы) с фильтрацией (только `page_view`),
+    # следующие файлы читаются заранее, пока фильтруется текущий.
+    # 2. Каждый блок сразу сворачивается в поминутные счетчики (ts уже в int64 мс),
+    # поэтому в памяти держатся только минуты, а не все события
+    counts = [] if parts is None else [parts['minutes']]
+
+    def commit(file_path):
+        # Поминутный ряд сворачивается и сохраняется после каждого файла
+        counts[:] = [pd.concat(counts).groupby(level=0).sum()]
+        if checkpoint is not None:
+            checkpoint.commit(file_path, {'minutes': counts[0]})
+
+    current = None
+    for f, chunk in iter_data_files(all_files, columns=['event', 'ts'],
+                                    prefetch=PREFETCH_DEPTH, row_groups='auto', derive_time=True):
+        if current is not None and f != current:
+            commit(current)
+        current = f
+        ts_ms = chunk.loc[chunk['event'] == 'page_view', 'ts_ms'].to_numpy()
+        counts.append(pd.Series(ts_ms).groupby(floor_ms(ts_ms, 1)).size())
+    if current is not None:
+        commit(current)
+    if not counts:
+        raise ValueError("Не удалось загрузить ни одного файла")
+
+    activity = pd.concat(counts).groupby(level=0).sum().rename_axis('ts_ms').reset_index(name='requests')
+    activity.insert(0, 'ts', to_datetime(activity.pop('ts_ms').to_numpy()))
 
     # 3. Ищем локальные максимумы (топ-10 всплесков)
-    activity['local_max'] = activity.iloc[argrelextrema(activity['requests'].values, np.greater, order=10)[0]]['requests']
-    peaks = activity.nlargest(10, 'requests')
-
-    # 4. Загружаем телепрограмму и рассчитываем `end_ts`
-    if not os.path.exists(schedule_file):
-        raise FileNotFoundError(f"Файл телепрограммы не найден: {schedule_file}")
-    schedule_df = pd.read_csv(schedule_file)
-    schedule_df['start_ts'] = pd.to_datetime(schedule_df['start_ts'])
-    schedule_df['end_ts'] = schedule_df['start_ts'] + pd.to_timedelta(schedule_df['dur'], unit='s')
-
-    # 5. Сопоставляем всплески с передачами
-    def find_show(timestamp):
-        show = schedule_df[(schedule_df['start_ts'] <= timestamp) & (schedule_df['end_ts'] >= timestamp)]
-        return show[['title', 'event_type', 'channel_id']].to_dict(orient='records')
-
-    peaks['matched_shows'] = peaks['ts'].apply(find_show)
-
-    def rating_programs(schedule_file, top_k=10):
-      # Загружаем телепрограмму, нам понадобится только одно поле 'event_type'
-      if not os.path.exists(schedule_file):
-          raise FileNotFoundError(f"Файл телепрограммы не найден: {schedule_file}")
-      cols = ['event_type']
-      schedule_df = pd.read_csv(schedule_file, usecols = cols)
-
-      # Считаем количество повторений типов передач. Каких передач было больше всего-те самые популярные.
-      counts = schedule_df[schedule_df['event_type'] != 'Прочее']['event_type'].value_counts()
-
-      # Получаем топ-k
-      top = counts.head(top_k)
-      print("\nТоп-10 самых популярных программ:\n")
-      print(top.to_string())
-      return top
-
-    top_k = 10; # сколько мест в рейтинге
-    top = rating_programs(schedule_file, top_k)
+    activity['local_max'] = activity.iloc[local_maxima(activity['requests'].values, order=10)]['requests']
+    if detector == 'baseline':
+        # Всплески относительно профиля времени суток: ночная аномалия не теряется
+        # на фоне регулярного прайм-тайма
+        peaks = detect_baseline_spikes(activity, top_n=10)
+    else:
+        peaks = activity.nlargest(10, 'requests')
+
+    # 4. Загружаем телепрограмму (разобранная версия кэшируется рядом с CSV)
+    epg = Epg(schedule_file, top_k=10)
+    print("\nТоп-10 самых популярных программ:\n")
+    print(epg.top.to_string())
+
+    # 5. Сопоставляем всплески с передачами (все всплески за один проход по индексу)
+    peak_ms = local_to_ms(peaks['ts'])
+    peaks['matched_shows'] = epg.find_shows(peak_ms)
+    justified = epg.popular_on_air(peak_ms)
+
  # 5.1. Сохраняем датафреймы в CSV
-    output_dir = '/content/drive/MyDrive/output_data'
     os.makedirs(output_dir, exist_ok=True)
 
     activity.to_csv(os.path.join(output_dir, 'activity_by_minute.csv'), index=False)
@@ -74,34 +104,28 @@ def analyze_data(dataset_path, schedule_file):
     peaks_copy.to_csv(os.path.join(output_dir, 'top10_peaks_with_matches.csv'), index=False)
 
     print(f"\n✅ Данные успешно выгружены в папку: {output_dir}")
-    # 6. Визуализация
-    plt.figure(figsize=(14, 6))
-    plt.plot(activity['ts'], activity['requests'], label='Все запросы', color='blue', alpha=0.7)
-    plt.scatter(peaks['ts'], peaks['requests'], color='red', label='Топ-10 всплесков', zorder=3)
-    plt.xlabel('Время')
-    plt.ylabel('Количество запросов')
-    plt.title('Всплески активности и их соответствие передачам')
-    plt.legend()
-    plt.xticks(rotation=45)
-    plt.grid()
-    plt.show()
+    # 6. Визуализация (в фоне, график пишется в PNG, пока печатаются результаты)
+    renderer = ChartRenderer()
+    renderer.submit(
+        draw_activity_spikes,
+        os.path.join(output_dir, 'activity_spikes.png'),
+        activity['ts'].values, activity['requests'].values,
+        peaks['ts'].values, peaks['requests'].values
+    )
 
     # 7. Улучшенный вывод
     print("\n=== Всплески активности и соответствующие передачи ===\n")
-    for index, row in peaks.iterrows():
+    for (index, row), is_justified in zip(peaks.iterrows(), justified):
         print(f"📌 Время всплеска: {row['ts']}")
         print(f"   🔺 Запросов: {row['requests']}")
+        if 'score' in row:
+            print(f"   📊 Обычно в это время: {row['baseline']:.0f} (отклонение {row['score']:.1f} σ"
+                  f"{', точка изменения' if row['is_change_point'] else ''})")
         if row['matched_shows']:
-
-            found_top_show = False  # Флаг для отслеживания найденных популярных передач
-
-            for show in row['matched_shows']:
-                if show['event_type'] in top:
-                    print(f"   ✅ Оправданный всплеск. Шла популярная передача: {show['title']} (Тип: {show['event_type']}, Канал: {show['channel_id']})")
-                    found_top_show = True
-                    break
-
-            if not found_top_show:
+            if is_justified:
+                show = next(show for show in row['matched_shows'] if show['event_type'] in epg.top.index)
+                print(f"   ✅ Оправданный всплеск. Шла популярная передача: {show['title']} (Тип: {show['event_type']}, Канал: {show['channel_id']})")
+            else:
                 print("   ⚠️ ATTENTION: Всплеск активности, но не совпадает с топовыми передачами")
                 print("   Передачи в это время:")
                 for show in row['matched_shows']:
@@ -110,14 +134,21 @@ def analyze_data(dataset_path, schedule_file):
             print("   ❌ Нет совпадений с телепрограммой.")
         print("-" * 50)
 
+    for path in renderer.close():
+        print(f"\n📈 График сохранен: {path}")
+
+
 
+if __name__ == "__main__":
+    from google.colab import drive
 
-# Монтируем Google Drive и загружаем данные
-drive.mount('/content/drive')
+    # Монтируем Google Drive и загружаем данные
+    drive.mount('/content/drive')
 
-# Запрос путей у пользователя (для Colab)
-dataset_path = input("Введите путь к паркет-файлам (например, /content/drive/MyDrive/dataset/*.parquet): ").strip()
-schedule_file = input("Введите путь к файлу телепрограммы (например, /content/drive/MyDrive/aggrs_tv_program_epg_plan.csv): ").strip()
+    # Запрос путей у пользователя (для Colab)
+    dataset_path = input("Введите путь к паркет-файлам (например, /content/drive/MyDrive/dataset/*.parquet): ").strip()
+    schedule_file = input("Введите путь к файлу телепрограммы (например, /content/drive/MyDrive/aggrs_tv_program_epg_plan.csv): ").strip()
+    detector = input("Метод поиска всплесков: top или baseline (по умолчанию top): ").strip() or 'top'
 
-# Запуск анализа
-analyze_data(dataset_path, schedule_file)
+    # Запуск анализа
+    analyze_data(dataset_path, schedule_file, detector)
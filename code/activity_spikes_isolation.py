@@ -1,12 +1,18 @@
-from google.colab import drive
 import pandas as pd
-import matplotlib.pyplot as plt
 import numpy as np
+import matplotlib.pyplot as plt
 from sklearn.ensemble import IsolationForest
-from IPython.display import display, HTML
-import glob
+from IPython.display import display
 import os
 from datetime import datetime
+from data_loader import iter_data_files, list_data_files
+from isolation_sweep import load_base_aggregates, reduce_to_interval
+from memory_budget import estimate_bytes, fits_in_memory, format_size, memory_budget
+from timestamps import floor_ms, hour_of_day, to_datetime
+from render_backend import ChartRenderer, plot_line, plot_density
+
+# Сколько файлов читать наперед, пока обрабатывается текущий
+PREFETCH_DEPTH = 2
 
 def get_user_input():
     """Функция для получения пользовательского ввода с валидацией"""
@@ -38,31 +44,12 @@ def get_user_input():
     
     return path, interval, contamination
 
-def load_all_data(folder_path):
-    """Загрузка и предобработка данных"""
-    all_files = sorted(glob.glob(f"{folder_path}/data_2024-10-*.parquet"))
-    if not all_files:  # Альтернативный вариант поиска
-        all_files = sorted(glob.glob(f"{folder_path}/*.parquet"))
-    
+def load_all_data(folder_path, prefetch=PREFETCH_DEPTH):
+    """Загрузка и предобработка данных (следующие prefetch файлов читаются заранее)"""
     dfs = []
-    for file in all_files:
-        try:
-            df = pd.read_parquet(file)
-            df['ts'] = pd.to_datetime(df['ts'])
-            df['date'] = df['ts'].dt.date
-            df['hour'] = df['ts'].dt.hour
-            df['minute'] = df['ts'].dt.minute
-            
-            # Помечаем ботов (включая скрытых)
-            if 'ua_is_bot' in df.columns:
-                df['is_bot'] = np.where(pd.to_numeric(df['ua_is_bot'], errors='coerce') > 0, True, False)
-            else:
-                df['is_bot'] = False
-                
-            dfs.append(df)
-            print(f"Успешно загружен: {file.split('/')[-1]}")
-        except Exception as e:
-            print(f"Ошибка при загрузке {file}: {e}")
+    # ts, date, hour, minute и метки ботов считаются при загрузке (и кэшируются)
+    for file, df in iter_data_files(folder_path, prefetch=prefetch, derive_time=True, derive_bots=True):
+        dfs.append(df)
     
     if not dfs:
         raise ValueError("Не удалось загрузить ни одного файла")
@@ -71,15 +58,20 @@ def load_all_data(folder_path):
 def detect_anomalies(df, interval_minutes=5, contamination=0.05):
     """Поиск аномалий во временных рядах"""
     # Агрегация по заданным интервалам
-    interval_str = f"{interval_minutes}min"
-    df['time_interval'] = df['ts'].dt.floor(interval_str)
+    if 'ts_ms' in df.columns:
+        df['time_interval'] = to_datetime(floor_ms(df['ts_ms'].to_numpy(), interval_minutes))
+    else:
+        df['time_interval'] = df['ts'].dt.floor(f"{interval_minutes}min")
     activity = df.groupby('time_interval').agg(
         requests=('ip', 'count'),
         unique_ips=('ip', 'nunique'),
         bot_ratio=('is_bot', 'mean'),
         bot_count=('is_bot', 'sum'),
-        human_count=('is_bot', lambda x: len(x) - sum(x))
-    ).reset_index()
+        human_count=('is_bot', 'size')
+    )
+    # Без поэлементной lambda: люди - все строки интервала минус боты
+    activity['human_count'] -= activity['bot_count']
+    activity = activity.reset_index()
     
     # Метод Isolation Forest для выявления аномалий
     model = IsolationForest(contamination=contamination, random_state=42)
@@ -88,9 +80,30 @@ def detect_anomalies(df, interval_minutes=5, contamination=0.05):
     
     return activity
 
-def analyze_anomalies(activity):
-    """Расширенный анализ аномалий"""
-    anomaly_data = activity[activity['is_anomaly']]
+def detect_anomalies_streaming(folder_path, interval_minutes=5, contamination=0.05, prefetch=PREFETCH_DEPTH,
+                               checkpoint_dir=None):
+    """
+    То же, что detect_anomalies, но без загрузки всех данных в память:
+    файлы сворачиваются в минутные агрегаты, уникальные IP считаются по
+    парам (минута, IP), которые при нехватке памяти сбрасываются на диск.
+    Агрегаты уже учтенных файлов берутся из чекпоинта (checkpoint_dir).
+    """
+    minutes, pairs = load_base_aggregates(folder_path, prefetch, checkpoint_dir)
+    with pairs:
+        activity = reduce_to_interval(minutes, pairs, interval_minutes).drop(columns='interval_ms')
+
+    model = IsolationForest(contamination=contamination, random_state=42)
+    anomalies = model.fit_predict(activity[['requests', 'unique_ips']])
+    activity['is_anomaly'] = anomalies == -1
+
+    return activity
+
+def analyze_anomalies(activity, plot_path=None, renderer=None):
+    """
+    Расширенный анализ аномалий; графики отрисовываются в фоне в plot_path,
+    а без plot_path - как раньше, сразу в ноутбуке (plt.show).
+    """
+    anomaly_data = activity[activity['is_anomaly']].copy()
     if anomaly_data.empty:
         print("\nАномалий не обнаружено")
         return
@@ -111,75 +124,92 @@ def analyze_anomalies(activity):
     display(top_anomalies)
     
     # 3. Распределение по часам
-    anomaly_data['hour'] = anomaly_data['time_interval'].dt.hour
+    # time_interval уже в местном времени, поэтому час берется без сдвига пояса
+    interval_ms = anomaly_data['time_interval'].to_numpy('datetime64[ms]').astype(np.int64)
+    anomaly_data['hour'] = hour_of_day(interval_ms, tz='UTC')
     hour_dist = anomaly_data.groupby('hour').size()
     
-    # 4. Визуализация
-    plt.figure(figsize=(15, 10))
-    
+    # 4. Визуализация (в фоне: выводы выше уже напечатаны, график пишется в PNG)
+    if plot_path is None:
+        fig = plt.figure(figsize=(15, 10))
+        draw_anomaly_panels(fig, activity, anomaly_data, hour_dist)
+        fig.tight_layout()
+        plt.show()
+        return None
+    own_renderer = renderer is None
+    if own_renderer:
+        renderer = ChartRenderer()
+    future = renderer.submit(
+        draw_anomaly_panels, plot_path,
+        activity, anomaly_data, hour_dist,
+        figsize=(15, 10)
+    )
+    if own_renderer:
+        renderer.close()
+    return future
+
+def draw_anomaly_panels(fig, activity, anomaly_data, hour_dist):
+    """Строит четыре панели анализа аномалий на переданной фигуре"""
     # График 1: Распределение аномалий по часам
-    plt.subplot(2, 2, 1)
-    hour_dist.plot(kind='bar', color='orange')
-    plt.title('Распределение аномалий по часам дня')
-    plt.xlabel('Час')
-    plt.ylabel('Количество аномалий')
+    ax1 = fig.add_subplot(2, 2, 1)
+    hour_dist.plot(kind='bar', color='orange', ax=ax1)
+    ax1.set_title('Распределение аномалий по часам дня')
+    ax1.set_xlabel('Час')
+    ax1.set_ylabel('Количество аномалий')
     
     # График 2: Соотношение ботов/людей в аномалиях
-    plt.subplot(2, 2, 2)
-    plt.pie(
+    ax2 = fig.add_subplot(2, 2, 2)
+    ax2.pie(
         [anomaly_data['bot_count'].sum(), anomaly_data['human_count'].sum()],
         labels=['Боты', 'Люди'],
         colors=['red', 'green'],
         autopct='%1.1f%%'
     )
-    plt.title('Соотношение ботов и людей в аномалиях')
+    ax2.set_title('Соотношение ботов и людей в аномалиях')
     
-    # График 3: Запросы vs Уникальные IP
-    plt.subplot(2, 2, 3)
-    plt.scatter(
+    # График 3: Запросы vs Уникальные IP (плотность вместо сотен тысяч точек)
+    ax3 = fig.add_subplot(2, 2, 3)
+    plot_density(
+        ax3,
         activity['requests'],
         activity['unique_ips'],
-        c=activity['is_anomaly'].map({True: 'red', False: 'blue'}),
-        alpha=0.5
+        highlight=activity['is_anomaly']
     )
-    plt.xlabel('Количество запросов')
-    plt.ylabel('Уникальные IP')
-    plt.title('Запросы vs Уникальные IP (красные - аномалии)')
+    ax3.set_xlabel('Количество запросов')
+    ax3.set_ylabel('Уникальные IP')
+    ax3.set_title('Запросы vs Уникальные IP (красные - аномалии)')
     
     # График 4: Временной ряд с аномалиями
-    plt.subplot(2, 2, 4)
-    plt.plot(activity['time_interval'], activity['requests'], label='Запросы', color='blue')
-    plt.scatter(
+    ax4 = fig.add_subplot(2, 2, 4)
+    plot_line(ax4, activity['time_interval'].values, activity['requests'].values,
+              label='Запросы', color='blue')
+    ax4.scatter(
         anomaly_data['time_interval'],
         anomaly_data['requests'],
         color='red', label='Аномалии'
     )
-    plt.title('Временной ряд с аномалиями')
-    plt.xlabel('Время')
-    plt.ylabel('Запросы')
-    plt.legend()
-    
-    plt.tight_layout()
-    plt.show()
+    ax4.set_title('Временной ряд с аномалиями')
+    ax4.set_xlabel('Время')
+    ax4.set_ylabel('Запросы')
+    ax4.legend()
 
-def save_results(activity, anomaly_data, folder_path):
-    """Сохранение результатов анализа"""
+def save_results(activity, anomaly_data, folder_path, timestamp=None):
+    """Сохранение результатов анализа (timestamp - суффикс имен файлов, по умолчанию текущее время)"""
     if not os.path.exists(folder_path):
         os.makedirs(folder_path)
     
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
     
     # Сохранение данных
     activity.to_csv(f"{folder_path}/activity_data_{timestamp}.csv", index=False)
     if not anomaly_data.empty:
         anomaly_data.to_csv(f"{folder_path}/anomalies_{timestamp}.csv", index=False)
-    
-    # Сохранение графиков
-    plt.savefig(f"{folder_path}/anomaly_analysis_{timestamp}.png")
     print(f"\nРезультаты сохранены в папку: {folder_path}")
 
 # Основной анализ
 def main():
+    from google.colab import drive
+
     print("Анализ аномалий в данных активности")
     drive.mount('/content/drive', force_remount=True)
     
@@ -187,18 +217,28 @@ def main():
         # Получаем пользовательский ввод
         folder_path, interval, contamination = get_user_input()
         
-        # Загрузка данных
-        df = load_all_data(folder_path)
-        
-        # Поиск аномалий
-        activity = detect_anomalies(df, interval, contamination)
+        # Загрузка данных и поиск аномалий (по файлам, если данные не помещаются в бюджет памяти)
+        files = list_data_files(folder_path)
+        if fits_in_memory(files):
+            df = load_all_data(folder_path)
+            activity = detect_anomalies(df, interval, contamination)
+        else:
+            print(f"Данные (~{format_size(estimate_bytes(files))}) больше бюджета памяти "
+                  f"({format_size(memory_budget())}), агрегация по файлам")
+            activity = detect_anomalies_streaming(folder_path, interval, contamination)
         
-        # Анализ и визуализация
-        analyze_anomalies(activity)
-        
-        # Сохранение результатов
+        # Анализ и визуализация (графики строятся в фоне)
         output_folder = os.path.join(os.path.dirname(folder_path), "anomaly_results")
-        save_results(activity, activity[activity['is_anomaly']], output_folder)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+        with ChartRenderer() as renderer:
+            analyze_anomalies(
+                activity,
+                plot_path=f"{output_folder}/anomaly_analysis_{timestamp}.png",
+                renderer=renderer
+            )
+            
+            # Сохранение результатов
+            save_results(activity, activity[activity['is_anomaly']], output_folder, timestamp=timestamp)
         
     except Exception as e:
         print(f"\nОшибка при анализе: {e}")
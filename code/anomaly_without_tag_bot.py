@@ -1,14 +1,17 @@
-from google.colab import drive
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from IPython.display import display
-import glob
 import os
 from datetime import datetime
+from data_loader import iter_data_files, list_data_files
+from dataset_catalog import catalog_overview, format_unique_ips, load_catalog, print_profile
+from memory_budget import estimate_bytes, fits_in_memory, format_size, memory_budget
+from sharding import DEFAULT_SHARDS, ShardWriter, bot_ip_summary, map_frame, map_shards
+from bot_labels import HIDDEN, UA_MATCH
 
-# Монтирование Google Drive
-drive.mount('/content/drive', force_remount=True)
+# Сколько файлов читать наперед, пока обрабатывается текущий
+PREFETCH_DEPTH = 2
 
 def get_user_path():
     """Запрашивает путь у пользователя с проверкой существования"""
@@ -18,32 +21,13 @@ def get_user_path():
             return path
         print(f"Ошибка: путь '{path}' не существует. Попробуйте снова.")
 
-def load_all_data(folder_path):
-    """Загрузка всех файлов данных с безопасной обработкой"""
-    all_files = sorted(glob.glob(f"{folder_path}/data_2024-10-*.parquet"))
-    if not all_files:
-        all_files = sorted(glob.glob(f"{folder_path}/*.parquet"))  # Альтернативный вариант поиска
-    
+def load_all_data(folder_path, prefetch=PREFETCH_DEPTH):
+    """Загрузка всех файлов данных с безопасной обработкой (с упреждающим чтением)"""
     dfs = []
     
-    for file in all_files:
-        try:
-            df = pd.read_parquet(file)
-            # Обязательные преобразования
-            df['ts'] = pd.to_datetime(df['ts'])
-            df['date'] = df['ts'].dt.date
-            df['hour'] = df['ts'].dt.hour
-            
-            # Определение ботов (включая скрытых)
-            if 'ua_is_bot' in df.columns:
-                df['is_bot'] = np.where(pd.to_numeric(df['ua_is_bot'], errors='coerce') > 0, True, False)
-            else:
-                df['is_bot'] = False
-                
-            dfs.append(df)
-            print(f"Успешно загружен: {file.split('/')[-1]}")
-        except Exception as e:
-            print(f"Ошибка при загрузке {file}: {e}")
+    # Обязательные преобразования (ts, date, hour) и метки ботов выполняются при загрузке
+    for file, df in iter_data_files(folder_path, prefetch=prefetch, derive_time=True, derive_bots=True):
+        dfs.append(df)
     
     if not dfs:
         raise ValueError("Не удалось загрузить ни одного файла")
@@ -51,33 +35,40 @@ def load_all_data(folder_path):
 
 def detect_hidden_bots(df):
     """Выявление скрытых ботов по поведенческим признакам"""
-    # Признаки ботов:
-    # 1. Слишком много запросов с одного IP
-    ip_request_counts = df['ip'].value_counts().rename('request_count')
-    df = df.merge(ip_request_counts.to_frame(), left_on='ip', right_index=True)
-    
-    # 2. Отсутствие User-Agent или подозрительные UA
-    if 'ua_header' in df.columns:
-        df['suspicious_ua'] = df['ua_header'].str.contains('bot|spider|crawl', case=False, na=False)
-    
-    # 3. Слишком высокая частота запросов
-    df['is_hidden_bot'] = (df['is_bot'] == False) & (
-        (df['request_count'] > 100) |
-        (df.get('suspicious_ua', False))
-    )
-    
+    # Признаки (подозрительный UA, > BEHAVIOR_THRESHOLD запросов с IP за файл)
+    # уже посчитаны при загрузке в bot_flags - см. bot_labels
+    df['suspicious_ua'] = (df['bot_flags'] & UA_MATCH) != 0
+    df['is_hidden_bot'] = (df['bot_flags'] & HIDDEN) != 0
     df['is_bot'] = df['is_bot'] | df['is_hidden_bot']
     return df
 
-def print_top_bots(df, top_n=10):
-    """Вывод топ-N самых активных ботов"""
-    bot_activity = df[df['is_bot']].groupby('ip').agg(
-        total_requests=('request_count', 'max'),
+def top_bot_activity(df, top_n=10, n_workers=1):
+    """
+    Топ-N самых активных ботов: число запросов, период активности, тип.
+
+    Как и в исходной версии, total_requests - все запросы IP (request_count),
+    а не только его строки ботов; в топ попадают IP, у которых есть строки ботов.
+    Данные уже в памяти, поэтому счетчики точные (value_counts), без скетча.
+    При n_workers > 1 строки делятся по хэшу IP (map_frame) и топы частей
+    считаются в процессах, как в потоковом режиме.
+    """
+    if n_workers > 1:
+        results = map_frame(bot_ip_summary, df[['ip', 'ts', 'is_bot', 'is_hidden_bot']], 'ip', n_workers,
+                            top_n=top_n)
+        return pd.concat([top for _, top in results]).sort_index().nlargest(top_n, 'total_requests')
+    bots = df[df['is_bot']]
+    request_count = df['ip'].value_counts()
+    # При равенстве - по IP, как при объединении топов шардов
+    top_ips = request_count[request_count.index.isin(bots['ip'].unique())].sort_index().nlargest(top_n)
+    bot_activity = bots[bots['ip'].isin(top_ips.index)].groupby('ip').agg(
         first_seen=('ts', 'min'),
         last_seen=('ts', 'max'),
         is_hidden=('is_hidden_bot', 'any')
-    ).sort_values('total_requests', ascending=False).head(top_n)
-    
+    ).reindex(top_ips.index)
+    bot_activity.insert(0, 'total_requests', top_ips.to_numpy())
+    return bot_activity
+
+def print_bot_table(bot_activity, top_n=10):
     print(f"\n{'='*50}\nТоп-{top_n} самых активных ботов\n{'='*50}")
     for i, (ip, row) in enumerate(bot_activity.iterrows(), 1):
         print(f"{i}. IP: {ip}")
@@ -86,33 +77,54 @@ def print_top_bots(df, top_n=10):
         print(f"   Тип: {'скрытый' if row['is_hidden'] else 'явный'}")
         print("-"*60)
 
-def analyze_activity(df):
-    """Расширенный анализ активности с визуализацией"""
+def print_top_bots(df, top_n=10):
+    """Вывод топ-N самых активных ботов"""
+    print_bot_table(top_bot_activity(df, top_n), top_n)
+
+def activity_summary(df, catalog_summary=None):
+    """
+    Общая статистика для отчета (в потоковом режиме собирается по файлам).
+    Объем, период и уникальные IP берутся из сводки каталога catalog_summary,
+    по данным считаются только боты и часы (и то, чего каталог не знает).
+    """
+    summary = catalog_overview(catalog_summary)
+    if 'rows' not in summary:
+        summary['rows'] = len(df)
+    if 'date_min' not in summary:
+        summary['date_min'], summary['date_max'] = df['date'].min(), df['date'].max()
+    if 'unique_ips' not in summary:
+        summary['unique_ips'] = df['ip'].nunique()
+    summary.update(bots=int(df['is_bot'].sum()), hidden_bots=int(df['is_hidden_bot'].sum()),
+                   hourly=df.groupby('hour').size())
+    return summary
+
+def report_activity(summary, bot_activity, top_n=10):
+    """Печать статистики, графики и топ ботов по готовой сводке"""
+    rows = summary['rows']
     print(f"\n{'='*50}\nОбщая статистика\n{'='*50}")
-    print(f"Всего записей: {len(df):,}")
-    print(f"Период данных: {df['date'].min()} — {df['date'].max()}")
-    print(f"Уникальных IP: {df['ip'].nunique():,}")
+    print(f"Всего записей: {rows:,}")
+    print(f"Период данных: {summary['date_min']:%Y-%m-%d} — {summary['date_max']:%Y-%m-%d}")
+    print(f"Уникальных IP: {format_unique_ips(summary['unique_ips'])}")
     
     # Статистика по ботам
-    total_bots = df['is_bot'].sum()
-    hidden_bots = df['is_hidden_bot'].sum()
+    total_bots = summary['bots']
+    hidden_bots = summary['hidden_bots']
     
-    print(f"\nОбнаружено ботов: {total_bots:,} ({total_bots/len(df):.1%})")
-    print(f"Из них скрытых: {hidden_bots:,} ({hidden_bots/len(df):.1%})")
+    print(f"\nОбнаружено ботов: {total_bots:,} ({total_bots/rows:.1%})")
+    print(f"Из них скрытых: {hidden_bots:,} ({hidden_bots/rows:.1%})")
     
     # Визуализация
     fig, (ax1, ax2) = plt.subplots(1, 2, figsize=(15, 5))
     
     # График распределения
     ax1.bar(['Люди', 'Боты (явные)', 'Боты (скрытые)'],
-            [len(df) - total_bots, total_bots - hidden_bots, hidden_bots],
+            [rows - total_bots, total_bots - hidden_bots, hidden_bots],
             color=['green', 'red', 'orange'])
     ax1.set_title('Распределение запросов')
     ax1.set_ylabel('Количество запросов')
     
     # График активности по часам
-    hourly_activity = df.groupby('hour').size()
-    hourly_activity.plot(kind='bar', ax=ax2, color='blue', alpha=0.7)
+    summary['hourly'].plot(kind='bar', ax=ax2, color='blue', alpha=0.7)
     ax2.set_title('Активность по часам')
     ax2.set_xlabel('Час дня')
     ax2.set_ylabel('Запросов')
@@ -121,7 +133,62 @@ def analyze_activity(df):
     plt.show()
     
     # Вывод топ ботов
-    print_top_bots(df)
+    print_bot_table(bot_activity, top_n)
+
+def analyze_activity(df, top_n=10, catalog_summary=None, n_workers=1):
+    """Расширенный анализ активности с визуализацией (объем и период - из сводки каталога)"""
+    report_activity(activity_summary(df, catalog_summary), top_bot_activity(df, top_n, n_workers), top_n)
+
+def analyze_activity_streaming(folder_path, output_folder, top_n=10, prefetch=PREFETCH_DEPTH,
+                               n_shards=DEFAULT_SHARDS, n_workers=None, catalog_summary=None):
+    """
+    Тот же анализ по файлам, когда данные не помещаются в бюджет памяти.
+
+    Строки раскладываются по шардам на диске по хэшу IP (все события IP - в
+    одном шарде), шарды обрабатываются параллельно в n_workers процессах, а
+    их небольшие сводки объединяются. Строки ботов дописываются в CSV по мере
+    чтения файлов. Объем, период и уникальные IP в отчете - из сводки каталога.
+    """
+    shards = ShardWriter('ip', n_shards)
+    summary = {'rows': 0, 'date_min': None, 'date_max': None, 'bots': 0, 'hidden_bots': 0,
+               'hourly': pd.Series(dtype=np.int64)}
+    os.makedirs(output_folder, exist_ok=True)
+    anomalies_path = f"{output_folder}/anomalies_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    columns = None
+
+    for file, df in iter_data_files(folder_path, prefetch=prefetch, row_groups='auto',
+                                    derive_time=True, derive_bots=True):
+        df = detect_hidden_bots(df)
+        summary['rows'] += len(df)
+        summary['bots'] += int(df['is_bot'].sum())
+        summary['hidden_bots'] += int(df['is_hidden_bot'].sum())
+        summary['hourly'] = summary['hourly'].add(df.groupby('hour').size(), fill_value=0).astype(np.int64)
+        date_min, date_max = df['date'].min(), df['date'].max()
+        summary['date_min'] = date_min if summary['date_min'] is None else min(summary['date_min'], date_min)
+        summary['date_max'] = date_max if summary['date_max'] is None else max(summary['date_max'], date_max)
+
+        shards.write(df[['ip', 'ts', 'is_bot', 'is_hidden_bot']])
+
+        bots = df[df['is_bot']]
+        if not bots.empty:
+            columns = columns or list(bots.columns)
+            bots.reindex(columns=columns).to_csv(anomalies_path, mode='a', index=False,
+                                                 header=not os.path.exists(anomalies_path))
+
+    if not summary['rows']:
+        shards.cleanup()
+        raise ValueError("Не удалось загрузить ни одного файла")
+
+    # IP разных шардов не пересекаются: уникальные IP складываются, топ - из топов шардов
+    with shards:
+        results = map_shards(bot_ip_summary, shards.close(), n_workers, top_n=top_n)
+    summary['unique_ips'] = sum(unique for unique, _ in results)
+    summary.update(catalog_overview(catalog_summary))
+    bot_activity = pd.concat([top for _, top in results]) \
+        .sort_index().nlargest(top_n, 'total_requests')
+    report_activity(summary, bot_activity, top_n)
+    if os.path.exists(anomalies_path):
+        print(f"Аномалии сохранены в: {anomalies_path}")
 
 def save_results(df, folder_path):
     """Сохранение результатов анализа"""
@@ -138,18 +205,35 @@ def save_results(df, folder_path):
         print(f"Аномалии сохранены в: {folder_path}/anomalies_{timestamp}.csv")
 
 # Основной процесс анализа
-try:
-    print("Анализ активности и обнаружение ботов")
-    folder_path = get_user_path()
-    df = load_all_data(folder_path)
-    df = detect_hidden_bots(df)
-    analyze_activity(df)
-    
-    # Сохранение результатов в указанную папку
-    output_folder = os.path.join(os.path.dirname(folder_path), "anomaly_results")
-    save_results(df, output_folder)
-
-except Exception as e:
-    print(f"\nОшибка при анализе: {e}")
-finally:
-    print("\nАнализ завершен")
+def main():
+    from google.colab import drive
+
+    # Монтирование Google Drive
+    drive.mount('/content/drive', force_remount=True)
+
+    try:
+        print("Анализ активности и обнаружение ботов")
+        folder_path = get_user_path()
+        output_folder = os.path.join(os.path.dirname(folder_path), "anomaly_results")
+        files = list_data_files(folder_path)
+        # Объем, период и уникальные IP - по футерам parquet, до загрузки данных
+        catalog_summary = print_profile(load_catalog(files, sketches=True), ['ts', 'ip', 'ua_is_bot', 'ua_header'])
+        if fits_in_memory(files):
+            df = load_all_data(folder_path)
+            df = detect_hidden_bots(df)
+            analyze_activity(df, catalog_summary=catalog_summary)
+        
+            # Сохранение результатов в указанную папку
+            save_results(df, output_folder)
+        else:
+            print(f"Данные (~{format_size(estimate_bytes(files))}) больше бюджета памяти "
+                  f"({format_size(memory_budget())}), анализ по файлам")
+            analyze_activity_streaming(folder_path, output_folder, catalog_summary=catalog_summary)
+
+    except Exception as e:
+        print(f"\nОшибка при анализе: {e}")
+    finally:
+        print("\nАнализ завершен")
+
+if __name__ == "__main__":
+    main()
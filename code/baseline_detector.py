@@ -0,0 +1,215 @@
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+from timestamps import MS_PER_MINUTE
+
+MINUTES_PER_DAY = 1440
+# Коэффициент, приводящий MAD к стандартному отклонению нормального распределения
+MAD_SCALE = 1.4826
+
+
+def _season_length(weekly):
+    return 7 * MINUTES_PER_DAY if weekly else MINUTES_PER_DAY
+
+
+def _robust_scale(median, mad):
+    """Масштаб остатков: MAD, но не меньше пуассоновского шума sqrt(median)"""
+    return np.maximum(MAD_SCALE * mad, np.sqrt(np.maximum(median, 0)) + 1.0)
+
+
+def seasonal_baseline(activity, window=7, weekly=False):
+    """
+    Сезонный профиль по времени суток (или неделе): скользящая медиана и MAD.
+
+    Для каждой минуты базой служат значения той же минуты суток за предыдущие
+    window дней (при weekly=True - та же минута недели за window недель).
+    Пропущенные минуты считаются нулевыми.
+
+    Параметры:
+    activity (pd.DataFrame): Поминутный ряд со столбцами ts, requests
+    window (int): Число предыдущих сезонов в окне
+    weekly (bool): Профиль по дню недели и времени суток
+
+    Возвращает:
+    pd.DataFrame: ts, requests, baseline, scale, score (робастный z-score)
+    """
+    season = _season_length(weekly)
+    ts_ms = activity['ts'].to_numpy('datetime64[ms]').astype(np.int64)
+    minute = ts_ms // MS_PER_MINUTE
+    # Сезоны выровнены по полуночи (для weekly - по понедельнику; 1970-01-01 - четверг)
+    origin = (minute.min() // MINUTES_PER_DAY) * MINUTES_PER_DAY
+    if weekly:
+        origin -= ((origin // MINUTES_PER_DAY + 3) % 7) * MINUTES_PER_DAY
+    position = minute - origin
+
+    n_seasons = int(position.max() // season) + 1
+    grid = np.zeros(n_seasons * season, dtype=np.float64)
+    np.add.at(grid, position, activity['requests'].to_numpy(dtype=np.float64))
+    grid = grid.reshape(n_seasons, season)
+
+    # У первого сезона истории нет - база для него не определена
+    median = np.full_like(grid, np.nan)
+    mad = np.full_like(grid, np.nan)
+    if n_seasons > 1:
+        # windows[i] - сезоны i-window..i-1 (в начале ряда окно дополнено NaN)
+        padded = np.vstack([np.full((window, season), np.nan), grid])
+        history = sliding_window_view(padded, window, axis=0)[1:n_seasons]
+        median[1:] = np.nanmedian(history, axis=2)
+        mad[1:] = np.nanmedian(np.abs(history - median[1:, :, None]), axis=2)
+
+    result = activity[['ts', 'requests']].copy()
+    season_idx, slot = position // season, position % season
+    result['baseline'] = median[season_idx, slot]
+    result['scale'] = _robust_scale(result['baseline'].to_numpy(), np.nan_to_num(mad[season_idx, slot]))
+    result['score'] = (result['requests'] - result['baseline']) / result['scale']
+    return result
+
+
+def fill_missing_minutes(activity):
+    """
+    Дополняет поминутный ряд минутами без запросов (requests = 0).
+
+    Так CUSUM видит затишье так же, как сезонный профиль и OnlineBaseline,
+    а не склеивает соседние непустые минуты.
+    """
+    ts = activity['ts'].to_numpy('datetime64[ms]')
+    full = pd.date_range(ts.min(), ts.max(), freq='min')
+    if len(full) == len(activity):
+        return activity
+    requests = pd.Series(activity['requests'].to_numpy(), index=ts).groupby(level=0).sum()
+    return pd.DataFrame({'ts': full, 'requests': requests.reindex(full, fill_value=0).to_numpy()})
+
+
+def cusum(scores, drift=0.5, threshold=5.0):
+    """
+    Односторонний CUSUM по z-score без циклов: S_t = C_t - min(0, min_{j<=t} C_j),
+    где C - накопленная сумма (z - drift). Точка изменения - момент, когда S
+    впервые превышает threshold.
+
+    Возвращает:
+    tuple: (np.ndarray статистики S, np.ndarray bool меток точек изменения)
+    """
+    steps = np.nan_to_num(np.asarray(scores, dtype=np.float64)) - drift
+    cumulative = np.cumsum(steps)
+    stat = cumulative - np.minimum(0, np.minimum.accumulate(cumulative))
+    above = stat > threshold
+    change = above & ~np.concatenate([[False], above[:-1]])
+    return stat, change
+
+
+def detect_baseline_spikes(activity, top_n=10, window=7, weekly=False,
+                           z_threshold=4.0, drift=0.5, cusum_threshold=5.0):
+    """
+    Всплески относительно сезонной базы вместо абсолютного топа минут.
+
+    Ночной всплеск в 3 часа с небольшим абсолютным числом запросов получает
+    высокий score, а регулярный прайм-тайм - нет.
+
+    Возвращает:
+    pd.DataFrame: top_n минут с score > z_threshold (ts, requests, baseline, score,
+                  cusum, is_change_point), по убыванию score
+    """
+    scored = seasonal_baseline(fill_missing_minutes(activity), window, weekly)
+    scored['cusum'], scored['is_change_point'] = cusum(scored['score'].to_numpy(), drift, cusum_threshold)
+    spikes = scored[scored['score'] > z_threshold]
+    return spikes.nlargest(top_n, 'score')
+
+
+class OnlineBaseline:
+    """
+    Потоковая версия детектора: O(1) на каждую новую минуту.
+
+    Для каждого слота сезона хранится кольцевой буфер последних window
+    значений; медиана и MAD считаются по буферу фиксированной длины,
+    CUSUM обновляется рекуррентно.
+
+    Пропущенные минуты, как и в seasonal_baseline, считаются нулевыми: перед
+    очередной минутой в буферы и CUSUM подаются нули за все минуты с
+    предыдущего вызова (а при первом вызове - с начала сезона). Всплеском
+    или точкой изменения нулевая минута стать не может, поэтому update
+    возвращает оценку только переданной минуты. Нули по одному считаются,
+    только пока CUSUM положителен; остальные лишь дописываются в буферы
+    (не больше window * season записей), поэтому и после простоя в
+    несколько дней update не перебирает все пропущенные минуты.
+    """
+
+    def __init__(self, window=7, weekly=False, z_threshold=4.0, drift=0.5, cusum_threshold=5.0):
+        self.window = window
+        self.weekly = weekly
+        self.season = _season_length(weekly)
+        self.z_threshold = z_threshold
+        self.drift = drift
+        self.cusum_threshold = cusum_threshold
+        self.history = np.full((self.season, window), np.nan)
+        self.filled = np.zeros(self.season, dtype=np.int64)
+        self.cusum = 0.0
+        self.last_minute = None
+
+    def _slot(self, minute):
+        if not self.weekly:
+            return int(minute % MINUTES_PER_DAY)
+        day = minute // MINUTES_PER_DAY
+        return int(((day + 3) % 7) * MINUTES_PER_DAY + minute % MINUTES_PER_DAY)
+
+    def update(self, ts, requests):
+        """
+        Учитывает очередную минуту и возвращает ее оценку.
+
+        Возвращает:
+        dict: ts, requests, baseline, score, cusum, is_change_point, is_spike
+        """
+        minute = pd.Timestamp(ts).value // 1_000_000 // MS_PER_MINUTE
+        # Сезоны выровнены по полуночи (понедельнику), как в seasonal_baseline
+        first = minute - self._slot(minute) if self.last_minute is None else self.last_minute + 1
+        self._skip(first, minute)
+        self.last_minute = minute if self.last_minute is None else max(self.last_minute, minute)
+
+        baseline, score, change = self._score(minute, requests)
+        return {
+            'ts': ts, 'requests': requests, 'baseline': baseline, 'score': score,
+            'cusum': self.cusum, 'is_change_point': change,
+            'is_spike': score > self.z_threshold,
+        }
+
+    def _skip(self, first, end):
+        """Нулевые минуты [first, end)"""
+        minute = first
+        # Нулевая минута не повышает score, поэтому уменьшает CUSUM не меньше чем на drift:
+        # по одной нужно учесть лишь минуты, пока он не обнулится
+        while minute < end and self.cusum > 0:
+            self._score(minute, 0)
+            minute += 1
+        n = end - minute
+        if n <= 0:
+            return
+        # Дальше CUSUM остается нулевым, а нули только записываются в буферы слотов
+        start = self._slot(minute)
+        if n >= self.window * self.season:
+            # Каждый слот получил не меньше window нулей - буфер целиком нулевой
+            self.history[:] = 0
+            self.filled += n // self.season + ((np.arange(self.season) - start) % self.season < n % self.season)
+            return
+        offset = np.arange(n)
+        slots = (start + offset) % self.season
+        self.history[slots, (self.filled[slots] + offset // self.season) % self.window] = 0
+        np.add.at(self.filled, slots, 1)
+
+    def _score(self, minute, requests):
+        """Оценка минуты по буферу ее слота; обновляет буфер и CUSUM"""
+        slot = self._slot(minute)
+        buffer = self.history[slot]
+        if self.filled[slot]:
+            baseline = float(np.nanmedian(buffer))
+            mad = float(np.nanmedian(np.abs(buffer - baseline)))
+            score = (requests - baseline) / float(_robust_scale(baseline, mad))
+        else:
+            baseline, score = np.nan, 0.0
+
+        previous = self.cusum
+        self.cusum = max(0.0, self.cusum + score - self.drift)
+        change = self.cusum > self.cusum_threshold >= previous
+
+        buffer[self.filled[slot] % self.window] = requests
+        self.filled[slot] += 1
+        return baseline, score, change
@@ -0,0 +1,111 @@
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+from ingest_cache import load_cache, save_cache
+
+# Биты столбца bot_flags
+EXPLICIT = 1   # ua_is_bot выставлен в выгрузке
+UA_MATCH = 2   # ua_header похож на робота
+BEHAVIOR = 4   # IP сделал больше BEHAVIOR_THRESHOLD запросов в файле
+HIDDEN = 8     # Не помечен явно, но выдал себя по UA или поведению
+
+BOT_UA_PATTERN = 'bot|spider|crawl'
+BEHAVIOR_THRESHOLD = 100
+# Версия правил разметки: повышается при любом изменении compute_bot_flags
+LABEL_VERSION = 1
+LABEL_COLUMNS = ['ip', 'ua_is_bot', 'ua_header']
+_TRUE_STRINGS = {'true', 'yes', 't', 'y'}
+
+
+def explicit_flag(values):
+    """
+    Единый разбор ua_is_bot: числа > 0, True и строки 'true'/'1'/'yes'.
+
+    Пустые значения, 0, 'False' и '0' - не бот (в отличие от astype(bool),
+    где любая непустая строка считалась ботом).
+    """
+    values = pd.Series(values)
+    if pd.api.types.is_bool_dtype(values):
+        return values.fillna(False).to_numpy(dtype=bool)
+    numeric = pd.to_numeric(values, errors='coerce').to_numpy(dtype=np.float64)
+    flag = np.nan_to_num(numeric) > 0
+    if values.dtype == object:
+        text = values.astype(str).str.strip().str.lower()
+        flag |= text.isin(_TRUE_STRINGS).to_numpy()
+    return flag
+
+
+def compute_bot_flags(df, behavior_threshold=BEHAVIOR_THRESHOLD):
+    """
+    Считает битовые метки ботов для строк одного файла.
+
+    Параметры:
+    df (pd.DataFrame): Данные с ip, ua_is_bot, ua_header (отсутствующие столбцы пропускаются)
+    behavior_threshold (int): Порог запросов с одного IP в файле
+
+    Возвращает:
+    np.ndarray: uint8 - комбинация EXPLICIT, UA_MATCH, BEHAVIOR, HIDDEN
+    """
+    flags = np.zeros(len(df), dtype=np.uint8)
+    if 'ua_is_bot' in df.columns:
+        flags |= np.where(explicit_flag(df['ua_is_bot']), EXPLICIT, 0).astype(np.uint8)
+    if 'ua_header' in df.columns:
+        ua_match = df['ua_header'].str.contains(BOT_UA_PATTERN, case=False, na=False).to_numpy()
+        flags |= np.where(ua_match, UA_MATCH, 0).astype(np.uint8)
+    if 'ip' in df.columns:
+        codes, uniques = pd.factorize(df['ip'])
+        per_ip = np.bincount(codes[codes >= 0], minlength=len(uniques))
+        heavy = np.zeros(len(df), dtype=bool)
+        heavy[codes >= 0] = per_ip[codes[codes >= 0]] > behavior_threshold
+        flags |= np.where(heavy, BEHAVIOR, 0).astype(np.uint8)
+    hidden = ((flags & EXPLICIT) == 0) & ((flags & (UA_MATCH | BEHAVIOR)) != 0)
+    flags |= np.where(hidden, HIDDEN, 0).astype(np.uint8)
+    return flags
+
+
+def label_rules(behavior_threshold=BEHAVIOR_THRESHOLD):
+    """Правила разметки для параметров чекпоинтов: при их смене накопленное состояние не подходит"""
+    return {'version': LABEL_VERSION, 'ua_pattern': BOT_UA_PATTERN, 'behavior_threshold': behavior_threshold}
+
+
+def bot_flags_cached(file_path, df=None, behavior_threshold=BEHAVIOR_THRESHOLD):
+    """
+    Метки ботов файла из кэша .cache/<файл>.bots-<порог>.parquet.
+
+    При промахе метки считаются по всем LABEL_COLUMNS файла: если в df их
+    нет (загружены не все столбцы), недостающие дочитываются из файла,
+    чтобы метки не зависели от того, какой детектор первым открыл файл.
+    """
+    kind = f'bots-{behavior_threshold}'
+    cached = load_cache(file_path, kind)
+    if cached is not None and (df is None or len(cached) == len(df)):
+        return cached['bot_flags'].to_numpy()
+
+    available = [c for c in LABEL_COLUMNS if c in pq.read_schema(file_path).names]
+    if df is None or any(c not in df.columns for c in available):
+        source = pd.read_parquet(file_path, columns=available)
+    else:
+        source = df
+    flags = compute_bot_flags(source, behavior_threshold)
+    save_cache(file_path, kind, pd.DataFrame({'bot_flags': flags}))
+    return flags
+
+
+def add_bot_columns(df, flags=None):
+    """
+    Добавляет bot_flags, is_bot (явный флаг) и is_hidden_bot.
+
+    Если flags не переданы, они считаются по самому df (без кэша).
+    """
+    if flags is None:
+        flags = compute_bot_flags(df)
+    df['bot_flags'] = flags
+    df['is_bot'] = (flags & EXPLICIT) != 0
+    df['is_hidden_bot'] = (flags & HIDDEN) != 0
+    return df
+
+
+def add_bot_columns_cached(df, file_path):
+    """add_bot_columns с метками из кэша рядом с файлом"""
+    return add_bot_columns(df, bot_flags_cached(file_path, df))
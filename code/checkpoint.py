@@ -0,0 +1,228 @@
+import json
+import os
+import pickle
+import shutil
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from ingest_cache import CACHE_DIR_NAME, file_fingerprint
+
+# Версия формата: при ее смене старые чекпоинты не читаются, расчет идет с начала
+CHECKPOINT_VERSION = 2
+MANIFEST_NAME = 'manifest.json'
+# Папка дописываемых частей: они общие для поколений и не копируются в каждое
+APPEND_DIR = 'appended'
+# Сколько последних поколений хранить: при изменении недавно обработанного
+# файла состояние откатывается к поколению до него, а не считается заново
+KEEP_GENERATIONS = 3
+
+
+def default_checkpoint_dir(data_path, name):
+    """<папка с данными>/.cache/checkpoint-<name> (data_path - папка или файл в ней)"""
+    folder = data_path if os.path.isdir(data_path) else os.path.dirname(data_path)
+    return os.path.join(folder, CACHE_DIR_NAME, f'checkpoint-{name}')
+
+
+def _json_default(value):
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Не сериализуется в JSON: {type(value).__name__}")
+
+
+def _write_part(folder, name, value):
+    """Сохраняет часть состояния в самом компактном подходящем формате"""
+    if isinstance(value, pd.DataFrame):
+        table = pa.Table.from_pandas(value, preserve_index=True)
+        pq.write_table(table, os.path.join(folder, f'{name}.parquet'), compression='zstd')
+        return {'kind': 'frame'}
+    if isinstance(value, pd.Series):
+        table = pa.Table.from_pandas(value.to_frame('value'), preserve_index=True)
+        pq.write_table(table, os.path.join(folder, f'{name}.parquet'), compression='zstd')
+        return {'kind': 'series', 'name': value.name}
+    if value is None or isinstance(value, (dict, list, str, int, float, bool)):
+        try:
+            text = json.dumps(value, default=_json_default, ensure_ascii=False)
+        except TypeError:
+            # Словари с таблицами внутри (результаты анализа) сохраняются как объекты
+            text = None
+        if text is not None:
+            with open(os.path.join(folder, f'{name}.json'), 'w', encoding='utf-8') as f:
+                f.write(text)
+            return {'kind': 'json'}
+    # Модели и прочие объекты
+    with open(os.path.join(folder, f'{name}.pkl'), 'wb') as f:
+        pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+    return {'kind': 'pickle'}
+
+
+def _read_part(folder, name, info):
+    if info['kind'] == 'frame':
+        return pq.read_table(os.path.join(folder, f'{name}.parquet')).to_pandas()
+    if info['kind'] == 'series':
+        return pq.read_table(os.path.join(folder, f'{name}.parquet')).to_pandas()['value'].rename(info['name'])
+    if info['kind'] == 'json':
+        with open(os.path.join(folder, f'{name}.json'), encoding='utf-8') as f:
+            return json.load(f)
+    with open(os.path.join(folder, f'{name}.pkl'), 'rb') as f:
+        return pickle.load(f)
+
+
+class Checkpoint:
+    """
+    Версионированные чекпоинты состояния детектора с манифестом входных файлов.
+
+    После каждого обработанного файла состояние записывается новым поколением
+    (gen-NNNNN/: parquet для таблиц, JSON для счетчиков, pickle для моделей),
+    а manifest.json атомарно переключается на него. В поколении записаны
+    отпечатки (размер, mtime) всех учтенных файлов. Следующий запуск берет
+    последнее поколение, все файлы которого не изменились, и обрабатывает
+    только остальные файлы.
+
+    Результаты, которые только растут (аномалии по дням), передаются в
+    append: в поколение записывается лишь новая часть, а поколение ссылается
+    на список всех своих частей. restore возвращает такие части списком.
+
+    Пример:
+        checkpoint = Checkpoint(folder, 'night', params={'threshold': 100})
+        parts = checkpoint.restore(files)
+        for file_path in checkpoint.pending(files):
+            ...
+            checkpoint.commit(file_path, {'ip_counts': ip_counts}, append={'anomalies': day_anomalies})
+    """
+
+    def __init__(self, folder, name, params=None, keep=KEEP_GENERATIONS):
+        self.folder = folder
+        self.name = name
+        self.params = params or {}
+        self.keep = keep
+        self.processed = {}
+        # Дописываемые части восстановленного или последнего записанного поколения
+        self.appended = {}
+
+    def _manifest(self):
+        """Манифест, если он совместим с версией формата, именем и параметрами детектора"""
+        path = os.path.join(self.folder, MANIFEST_NAME)
+        if not os.path.exists(path):
+            return None
+        try:
+            with open(path, encoding='utf-8') as f:
+                manifest = json.load(f)
+        except (OSError, ValueError) as e:
+            print(f"Поврежден манифест чекпоинта {path}: {e}")
+            return None
+        # Параметры сравниваются в виде JSON (кортежи и списки равнозначны)
+        params = json.loads(json.dumps(self.params, default=_json_default))
+        if (manifest.get('version'), manifest.get('name'), manifest.get('params')) != \
+                (CHECKPOINT_VERSION, self.name, params):
+            print(f"Чекпоинт {self.folder} несовместим (версия или параметры), расчет с начала")
+            return None
+        return manifest
+
+    def restore(self, files):
+        """
+        Загружает последнее поколение, согласованное с текущими файлами.
+
+        Поколение подходит, если каждый учтенный в нем файл есть среди files
+        с тем же отпечатком. Изменившийся или удаленный файл откатывает
+        состояние к поколению, записанному до него.
+
+        Возвращает:
+        dict | None: Части состояния (None - начать с пустого состояния),
+                     дописываемые части - списками в порядке записи
+        """
+        self.processed = {}
+        self.appended = {}
+        manifest = self._manifest()
+        if manifest is None:
+            return None
+        current = {file_path: file_fingerprint(file_path) for file_path in files if os.path.exists(file_path)}
+        for generation in reversed(manifest['generations']):
+            if all(current.get(path) == fingerprint for path, fingerprint in generation['files'].items()):
+                folder = os.path.join(self.folder, generation['dir'])
+                append_folder = os.path.join(self.folder, APPEND_DIR)
+                appended = generation.get('appended', {})
+                try:
+                    parts = {name: _read_part(folder, name, info) for name, info in generation['parts'].items()}
+                    for name, entries in appended.items():
+                        parts[name] = [_read_part(append_folder, entry['file'], entry) for entry in entries]
+                except Exception as e:
+                    print(f"Не удалось прочитать чекпоинт {folder}: {e}")
+                    continue
+                self.processed = dict(generation['files'])
+                self.appended = {name: list(entries) for name, entries in appended.items()}
+                print(f"Загружен чекпоинт {self.name}: учтено файлов - {len(self.processed)}")
+                return parts
+        return None
+
+    def pending(self, files):
+        """Файлы, которых нет в восстановленном состоянии или которые изменились"""
+        return [file_path for file_path in files
+                if self.processed.get(file_path) != file_fingerprint(file_path)]
+
+    def commit(self, file_path, parts, fingerprint=None, append=None):
+        """
+        Отмечает файл обработанным и записывает состояние новым поколением.
+
+        parts - состояние целиком, append - новые части дописываемых
+        результатов (записываются только они, прошлые части не копируются).
+        Ошибки записи не прерывают анализ (как и у кэша производных столбцов).
+
+        Возвращает:
+        int | None: Номер поколения
+        """
+        self.processed[file_path] = fingerprint or file_fingerprint(file_path)
+        try:
+            return self._write(parts, append or {})
+        except Exception as e:
+            print(f"Не удалось сохранить чекпоинт {self.folder}: {e}")
+            return None
+
+    def _write(self, parts, append):
+        manifest = self._manifest()
+        if manifest is None:
+            # Несовместимые или поврежденные поколения больше не нужны
+            shutil.rmtree(self.folder, ignore_errors=True)
+            manifest = {'version': CHECKPOINT_VERSION, 'name': self.name,
+                        'params': self.params, 'generations': []}
+            self.appended = {}
+        os.makedirs(self.folder, exist_ok=True)
+        generations = manifest['generations']
+        number = generations[-1]['id'] + 1 if generations else 0
+        name = f'gen-{number:05d}'
+        tmp_folder = os.path.join(self.folder, name + '.tmp')
+        shutil.rmtree(tmp_folder, ignore_errors=True)
+        os.makedirs(tmp_folder)
+        info = {part: _write_part(tmp_folder, part, value) for part, value in parts.items()}
+
+        # Новые части пишутся под номером поколения и не пересекаются с прошлыми
+        append_folder = os.path.join(self.folder, APPEND_DIR)
+        os.makedirs(append_folder, exist_ok=True)
+        appended = {part: list(entries) for part, entries in self.appended.items()}
+        for part, value in append.items():
+            file_name = f'{part}-{number:05d}'
+            entry = _write_part(append_folder, file_name, value)
+            appended.setdefault(part, []).append(dict(entry, file=file_name))
+        os.replace(tmp_folder, os.path.join(self.folder, name))
+
+        generations.append({'id': number, 'dir': name, 'created': datetime.now().isoformat(timespec='seconds'),
+                            'files': dict(self.processed), 'parts': info, 'appended': appended})
+        self.appended = appended
+        stale, manifest['generations'] = generations[:-self.keep], generations[-self.keep:]
+        path = os.path.join(self.folder, MANIFEST_NAME)
+        with open(path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, default=_json_default, ensure_ascii=False, indent=1)
+        os.replace(path + '.tmp', path)
+        # Старые поколения и части, на которые больше никто не ссылается,
+        # удаляются только после переключения манифеста
+        for generation in stale:
+            shutil.rmtree(os.path.join(self.folder, generation['dir']), ignore_errors=True)
+        used = {entry['file'] for generation in manifest['generations']
+                for entries in generation['appended'].values() for entry in entries}
+        for file_name in os.listdir(append_folder):
+            if os.path.splitext(file_name)[0] not in used:
+                os.remove(os.path.join(append_folder, file_name))
+        return number
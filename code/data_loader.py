@@ -0,0 +1,256 @@
+import asyncio
+import glob
+import os
+import queue
+import threading
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+from bot_labels import add_bot_columns, add_bot_columns_cached, bot_flags_cached
+from memory_budget import batch_bytes, estimate_bytes
+from timestamps import add_time_columns, add_time_columns_cached
+
+
+def list_data_files(folder_path):
+    """Список parquet-файлов с данными в папке (по возрастанию даты)"""
+    all_files = sorted(glob.glob(f"{folder_path}/data_2024-10-*.parquet"))
+    if not all_files:  # Альтернативный вариант поиска
+        all_files = sorted(glob.glob(f"{folder_path}/*.parquet"))
+    return all_files
+
+
+def read_data_file(file_path, columns=None):
+    """
+    Читает один parquet-файл.
+
+    Параметры:
+    file_path (str): Путь к файлу
+    columns (list): Нужные столбцы; отсутствующие в файле пропускаются
+
+    Возвращает:
+    pd.DataFrame: Данные файла
+    """
+    if columns is not None:
+        available = set(pq.read_schema(file_path).names)
+        # В части выгрузок столбец сессии называется randPASS_session_id
+        if 'randPAS_session_id' in columns and 'randPAS_session_id' not in available \
+                and 'randPASS_session_id' in available:
+            columns = [c for c in columns if c != 'randPAS_session_id'] + ['randPASS_session_id']
+        columns = [c for c in columns if c in available]
+
+    df = pd.read_parquet(file_path, columns=columns)
+    if 'randPASS_session_id' in df.columns and 'randPAS_session_id' not in df.columns:
+        df = df.rename(columns={'randPASS_session_id': 'randPAS_session_id'})
+    return df
+
+
+def _resolve_files(folder_or_files):
+    if isinstance(folder_or_files, str):
+        return list_data_files(folder_or_files)
+    return list(folder_or_files)
+
+
+def _iter_read_tasks(files, row_groups=False, columns=None):
+    """
+    Единицы чтения: (файл, номер row group или None).
+
+    row_groups='auto' - файл читается по row group, только если целиком
+    он не помещается в пакет бюджета памяти (см. memory_budget).
+    row_groups={файл: [номера]} - читаются только перечисленные row groups
+    (отбор по каталогу, см. dataset_catalog).
+    """
+    for file_path in files:
+        if isinstance(row_groups, dict):
+            for i in row_groups.get(file_path, []):
+                yield file_path, i
+            continue
+        split = row_groups
+        if row_groups == 'auto':
+            try:
+                split = estimate_bytes([file_path], columns) > batch_bytes()
+            except Exception:
+                split = False
+        if not split:
+            yield file_path, None
+            continue
+        try:
+            n_groups = pq.ParquetFile(file_path).num_row_groups
+        except Exception as e:
+            print(f"Ошибка при загрузке {file_path}: {e}")
+            continue
+        for i in range(n_groups):
+            yield file_path, i
+
+
+def _read_task(file_path, row_group, columns, derive_time=False, derive_bots=False):
+    if row_group is None:
+        df = read_data_file(file_path, columns)
+        if derive_bots:
+            add_bot_columns_cached(df, file_path)
+        return add_time_columns_cached(df, file_path) if derive_time else df
+    parquet_file = pq.ParquetFile(file_path)
+    if columns is not None:
+        columns = [c for c in columns if c in parquet_file.schema_arrow.names]
+    df = parquet_file.read_row_group(row_group, columns=columns).to_pandas()
+    if 'randPASS_session_id' in df.columns and 'randPAS_session_id' not in df.columns:
+        df = df.rename(columns={'randPASS_session_id': 'randPAS_session_id'})
+    if derive_bots:
+        # Метки считаются по файлу целиком (порог поведения - на файл), row group - срез
+        start = sum(parquet_file.metadata.row_group(i).num_rows for i in range(row_group))
+        add_bot_columns(df, bot_flags_cached(file_path)[start:start + len(df)])
+    return add_time_columns(df) if derive_time else df
+
+
+async def aiter_data_files(folder_or_files, columns=None, prefetch=2, row_groups=False,
+                           derive_time=False, derive_bots=False, errors='skip'):
+    """
+    Асинхронная загрузка с упреждающим чтением следующих prefetch файлов.
+
+    Чтение идет в пуле потоков, пока потребитель обрабатывает текущий блок
+    (to_datetime, разметка ботов, агрегация). Очередь ограничена prefetch
+    элементами: если обработка отстает, чтение приостанавливается.
+
+    Параметры:
+    folder_or_files (str | list): Папка с данными или список файлов
+    columns (list): Нужные столбцы
+    prefetch (int): Сколько файлов (row group) читать наперед
+    row_groups (bool | str | dict): Выдавать данные по row group, а не по файлам
+                             ('auto' - только для файлов больше пакета бюджета памяти,
+                             dict - только перечисленные row groups каждого файла)
+    derive_time (bool): Добавить ts_ms/date/hour/minute/weekday (см. timestamps)
+    derive_bots (bool): Добавить bot_flags/is_bot/is_hidden_bot (см. bot_labels)
+    errors (str): 'skip' - файл, который не читается, пропускается с сообщением,
+                  'raise' - ошибка чтения прерывает загрузку
+
+    Возвращает:
+    async generator: Пары (путь к файлу, pd.DataFrame)
+    """
+    files = _resolve_files(folder_or_files)
+    pending = asyncio.Queue(maxsize=max(prefetch, 1))
+    done = object()
+
+    async def produce():
+        try:
+            for file_path, row_group in _iter_read_tasks(files, row_groups, columns):
+                task = asyncio.ensure_future(asyncio.to_thread(_read_task, file_path, row_group, columns,
+                                                              derive_time, derive_bots))
+                await pending.put((file_path, task))
+        except Exception as e:
+            # Сбой перечисления файлов передается потребителю, а не обрывает очередь молча
+            await pending.put(e)
+            return
+        await pending.put(done)
+
+    producer = asyncio.ensure_future(produce())
+    try:
+        while True:
+            item = await pending.get()
+            if item is done:
+                break
+            if isinstance(item, Exception):
+                raise item
+            file_path, task = item
+            try:
+                df = await task
+            except Exception as e:
+                if errors == 'raise':
+                    raise
+                print(f"Ошибка при загрузке {file_path}: {e}")
+                continue
+            print(f"Успешно загружен: {os.path.basename(file_path)}")
+            yield file_path, df
+    finally:
+        producer.cancel()
+        while not pending.empty():
+            item = pending.get_nowait()
+            if isinstance(item, tuple):
+                item[1].cancel()
+
+
+def _iter_prefetched(files, columns, prefetch, row_groups, derive_time, derive_bots, errors='skip'):
+    """
+    Синхронная обертка над aiter_data_files: цикл asyncio в фоновом потоке.
+    Исключение фонового потока передается потребителю после последнего блока,
+    а не выглядит как обычный конец данных.
+    """
+    handoff = queue.Queue(maxsize=1)
+    stop = threading.Event()
+    done = object()
+    failure = []
+
+    async def pump():
+        async for item in aiter_data_files(files, columns, prefetch, row_groups, derive_time, derive_bots,
+                                           errors):
+            while not stop.is_set():
+                try:
+                    handoff.put_nowait(item)
+                    break
+                except queue.Full:
+                    # Потребитель занят обработкой - ждем, не блокируя цикл событий
+                    await asyncio.sleep(0.01)
+            if stop.is_set():
+                break
+
+    def run():
+        try:
+            asyncio.run(pump())
+        except BaseException as e:
+            failure.append(e)
+        finally:
+            handoff.put(done)
+
+    worker = threading.Thread(target=run, daemon=True)
+    worker.start()
+    try:
+        while True:
+            item = handoff.get()
+            if item is done:
+                break
+            yield item
+        if failure:
+            raise failure[0]
+    finally:
+        stop.set()
+        while worker.is_alive():
+            try:
+                handoff.get(timeout=0.1)
+            except queue.Empty:
+                pass
+
+
+def iter_data_files(folder_or_files, columns=None, prefetch=0, row_groups=False, derive_time=False,
+                    derive_bots=False, errors='skip'):
+    """
+    Поочередно загружает файлы данных, не объединяя их в один DataFrame.
+
+    Параметры:
+    folder_or_files (str | list): Папка с данными или список файлов
+    columns (list): Нужные столбцы
+    prefetch (int): Глубина упреждающего чтения (0 - читать строго по очереди)
+    row_groups (bool | str | dict): Выдавать данные по row group, а не по файлам
+                             ('auto' - только для файлов больше пакета бюджета памяти,
+                             dict - только перечисленные row groups каждого файла)
+    derive_time (bool): Добавить ts_ms/date/hour/minute/weekday (разбор ts кэшируется)
+    derive_bots (bool): Добавить единые метки ботов bot_flags/is_bot/is_hidden_bot (кэшируются)
+    errors (str): 'skip' - файл, который не читается, пропускается с сообщением (как в
+                  исходных скриптах), 'raise' - ошибка чтения прерывает загрузку
+
+    Возвращает:
+    generator: Пары (путь к файлу, pd.DataFrame)
+    """
+    files = _resolve_files(folder_or_files)
+    if prefetch > 0:
+        yield from _iter_prefetched(files, columns, prefetch, row_groups, derive_time, derive_bots, errors)
+        return
+
+    for file_path, row_group in _iter_read_tasks(files, row_groups, columns):
+        try:
+            df = _read_task(file_path, row_group, columns, derive_time, derive_bots)
+        except Exception as e:
+            if errors == 'raise':
+                raise
+            print(f"Ошибка при загрузке {file_path}: {e}")
+            continue
+        print(f"Успешно загружен: {os.path.basename(file_path)}")
+        yield file_path, df
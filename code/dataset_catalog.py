@@ -0,0 +1,456 @@
+import json
+import os
+import re
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from data_loader import list_data_files
+from ingest_cache import CACHE_DIR_NAME, file_fingerprint
+from timestamps import DATA_TZ, DISPLAY_TZ, parse_ts, to_datetime
+
+# Версия формата: при ее смене индекс строится заново
+CATALOG_VERSION = 2
+CATALOG_DIR_NAME = 'catalog'
+TS_COLUMN = 'ts'
+SKETCH_COLUMN = 'ip'
+# 4096 регистров HyperLogLog: ~4 КБ на файл, погрешность оценки ~1.6%
+SKETCH_PRECISION = 12
+# Строгий ISO без смещения пояса: только у таких строк порядок строк совпадает с хронологическим
+ISO_TS = re.compile(r'\d{4}-\d{2}-\d{2}(?:[ T]\d{2}:\d{2}(?::\d{2}(?:\.\d{1,9})?)?)?')
+
+
+# HyperLogLog: оценка числа уникальных значений, сливается взятием максимума
+
+def hll_registers(values, precision=SKETCH_PRECISION):
+    """Регистры HyperLogLog (uint8, 2**precision) для значений (пропуски не учитываются)"""
+    values = pd.Series(values).dropna()
+    registers = np.zeros(1 << precision, dtype=np.uint8)
+    if values.empty:
+        return registers
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+    # Длина в битах через frexp точна: rest < 2**53 представим в float64 без потерь
+    bit_length = np.frexp(rest.astype(np.float64))[1]
+    rank = (64 - precision + 1 - bit_length).astype(np.uint8)
+    np.maximum.at(registers, index, rank)
+    return registers
+
+
+def hll_estimate(registers):
+    """Оценка числа уникальных значений по регистрам (с поправкой для малых множеств)"""
+    m = len(registers)
+    alpha = 0.7213 / (1 + 1.079 / m)
+    estimate = alpha * m * m / np.sum(np.ldexp(1.0, -registers.astype(np.int64)))
+    zeros = int(np.count_nonzero(registers == 0))
+    if estimate <= 2.5 * m and zeros:
+        estimate = m * np.log(m / zeros)
+    return float(estimate)
+
+
+def catalog_dir(folder):
+    """<папка с данными>/.cache/catalog"""
+    return os.path.join(folder, CACHE_DIR_NAME, CATALOG_DIR_NAME)
+
+
+def _trusted_pair(ts_min, ts_max):
+    """Статистике можно верить: есть оба значения, а строки - в строгом ISO"""
+    if ts_min is None or ts_max is None:
+        return False
+    return all(ISO_TS.fullmatch(value) for value in (ts_min, ts_max) if isinstance(value, str))
+
+
+def _stat_values(values):
+    """
+    Min/max ts из статистики row groups (пары подряд) -> мс UTC.
+
+    None - статистики нет или ей нельзя верить: для строк не в ISO (например,
+    ДД.ММ.ГГГГ) min/max parquet лексикографические, а не хронологические.
+    """
+    result = [None] * len(values)
+    trusted = [i for pair in range(0, len(values), 2) if _trusted_pair(*values[pair:pair + 2])
+               for i in (pair, pair + 1)]
+    if not trusted:
+        return result
+    known = pd.Series([values[i] for i in trusted])
+    try:
+        if known.map(lambda value: isinstance(value, str)).all():
+            known = pd.to_datetime(known, format='ISO8601')
+        parsed = parse_ts(known, DATA_TZ)
+    except (ValueError, TypeError):
+        return result
+    for i, value in zip(trusted, parsed):
+        result[i] = int(value)
+    return result
+
+
+def scan_file(file_path, sketch=False):
+    """
+    Читает футер parquet-файла (данные не загружаются).
+
+    Параметры:
+    file_path (str): Путь к файлу
+    sketch (bool): Дополнительно прочитать столбец ip и построить HyperLogLog
+
+    Возвращает:
+    tuple: (dict сводки файла, pd.DataFrame row groups, pd.DataFrame пропусков)
+    """
+    parquet_file = pq.ParquetFile(file_path)
+    metadata = parquet_file.metadata
+    names = parquet_file.schema_arrow.names
+    groups, nulls, ts_stats = [], [], []
+    for i in range(metadata.num_row_groups):
+        group = metadata.row_group(i)
+        ts_min = ts_max = None
+        for j in range(group.num_columns):
+            column = group.column(j)
+            # Вложенные столбцы (списки) хранятся листьями - их пропуски не учитываются
+            if column.path_in_schema not in names:
+                continue
+            stats = column.statistics
+            null_count = stats.null_count if stats is not None and stats.has_null_count else -1
+            nulls.append((i, column.path_in_schema, null_count))
+            if column.path_in_schema == TS_COLUMN and stats is not None and stats.has_min_max:
+                ts_min, ts_max = stats.min, stats.max
+        groups.append((i, group.num_rows))
+        ts_stats += [ts_min, ts_max]
+
+    ts_ms = _stat_values(ts_stats)
+    row_groups = pd.DataFrame({
+        'row_group': pd.Series([i for i, _ in groups], dtype=np.int64),
+        'rows': pd.Series([rows for _, rows in groups], dtype=np.int64),
+        'ts_min_ms': pd.array(ts_ms[0::2], dtype='Int64'),
+        'ts_max_ms': pd.array(ts_ms[1::2], dtype='Int64'),
+    })
+    nulls = pd.DataFrame(nulls, columns=['row_group', 'column', 'null_count']).astype(
+        {'row_group': np.int64, 'null_count': np.int64})
+
+    registers = None
+    if sketch and SKETCH_COLUMN in names:
+        values = pq.read_table(file_path, columns=[SKETCH_COLUMN]).column(0).to_pandas()
+        registers = hll_registers(values).tobytes()
+    summary = {
+        'rows': metadata.num_rows,
+        'row_groups': metadata.num_row_groups,
+        'schema': json.dumps([[field.name, str(field.type)] for field in parquet_file.schema_arrow],
+                             ensure_ascii=False),
+        'sketch': registers,
+    }
+    return summary, row_groups, nulls
+
+
+def _empty_index():
+    files = pd.DataFrame({'name': pd.Series(dtype=object), 'fingerprint': pd.Series(dtype=object),
+                          'rows': pd.Series(dtype=np.int64), 'row_groups': pd.Series(dtype=np.int64),
+                          'schema': pd.Series(dtype=object), 'sketch': pd.Series(dtype=object)})
+    row_groups = pd.DataFrame({'name': pd.Series(dtype=object), 'fingerprint': pd.Series(dtype=object),
+                               'row_group': pd.Series(dtype=np.int64), 'rows': pd.Series(dtype=np.int64),
+                               'ts_min_ms': pd.Series(dtype='Int64'), 'ts_max_ms': pd.Series(dtype='Int64')})
+    nulls = pd.DataFrame({'name': pd.Series(dtype=object), 'fingerprint': pd.Series(dtype=object),
+                          'row_group': pd.Series(dtype=np.int64), 'column': pd.Series(dtype=object),
+                          'null_count': pd.Series(dtype=np.int64)})
+    return files, row_groups, nulls
+
+
+def _read_index(folder):
+    """
+    Индекс папки: (files, row_groups, nulls) с именами файлов относительно папки.
+
+    Строки row groups и пропусков учитываются, только если их отпечаток совпадает
+    с записанным в files.parquet (он пишется последним и служит отметкой о записи).
+    """
+    path = catalog_dir(folder)
+    if not os.path.exists(os.path.join(path, 'files.parquet')):
+        return _empty_index()
+    try:
+        table = pq.read_table(os.path.join(path, 'files.parquet'))
+        version = (table.schema.metadata or {}).get(b'catalog_version', b'').decode()
+        if version != str(CATALOG_VERSION):
+            return _empty_index()
+        files = table.to_pandas()
+        keys = files[['name', 'fingerprint']]
+        row_groups = pd.read_parquet(os.path.join(path, 'row_groups.parquet')).merge(keys)
+        nulls = pd.read_parquet(os.path.join(path, 'nulls.parquet')).merge(keys)
+    except Exception as e:
+        print(f"Поврежден каталог {path}: {e}")
+        return _empty_index()
+    return files, row_groups, nulls
+
+
+def _write_index(folder, files, row_groups, nulls):
+    """Атомарная запись таблиц индекса (ошибки записи не прерывают анализ)"""
+    path = catalog_dir(folder)
+    try:
+        os.makedirs(path, exist_ok=True)
+        for name, frame in (('row_groups', row_groups), ('nulls', nulls), ('files', files)):
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+            if name == 'files':
+                metadata = dict(table.schema.metadata or {})
+                metadata[b'catalog_version'] = str(CATALOG_VERSION).encode()
+                table = table.replace_schema_metadata(metadata)
+            target = os.path.join(path, f'{name}.parquet')
+            pq.write_table(table, target + '.tmp', compression='zstd')
+            os.replace(target + '.tmp', target)
+    except Exception as e:
+        print(f"Не удалось сохранить каталог {path}: {e}")
+
+
+def _update_folder(folder, file_paths, sketches):
+    """Дополняет индекс папки новыми и изменившимися файлами; возвращает таблицы индекса"""
+    files, row_groups, nulls = _read_index(folder)
+    known = files.set_index('name')
+    new_files, new_groups, new_nulls = [], [], []
+    for file_path in file_paths:
+        name = os.path.basename(file_path)
+        fingerprint = file_fingerprint(file_path)
+        if name in known.index and known.at[name, 'fingerprint'] == fingerprint \
+                and (not sketches or known.at[name, 'sketch'] is not None):
+            continue
+        try:
+            summary, groups, file_nulls = scan_file(file_path, sketch=sketches)
+        except Exception as e:
+            print(f"Ошибка чтения футера {file_path}: {e}")
+            continue
+        new_files.append(dict(summary, name=name, fingerprint=fingerprint))
+        new_groups.append(groups.assign(name=name, fingerprint=fingerprint))
+        new_nulls.append(file_nulls.assign(name=name, fingerprint=fingerprint))
+
+    # Записи удаленных файлов больше не нужны
+    present = files['name'].map(lambda name: os.path.exists(os.path.join(folder, name)))
+    if not new_files and present.all():
+        return files, row_groups, nulls
+
+    replaced = {entry['name'] for entry in new_files}
+    keep = files[present & ~files['name'].isin(replaced)]
+    files = pd.concat([keep, pd.DataFrame(new_files, columns=files.columns)], ignore_index=True)
+    row_groups = pd.concat([row_groups[row_groups['name'].isin(keep['name'])]] + new_groups,
+                           ignore_index=True)[list(row_groups.columns)]
+    nulls = pd.concat([nulls[nulls['name'].isin(keep['name'])]] + new_nulls,
+                      ignore_index=True)[list(nulls.columns)]
+    _write_index(folder, files, row_groups, nulls)
+    print(f"Каталог {catalog_dir(folder)}: прочитано футеров - {len(new_files)}, всего файлов - {len(files)}")
+    return files, row_groups, nulls
+
+
+class DatasetCatalog:
+    """
+    Каталог набора данных по футерам parquet: число строк, min/max ts и число
+    пропусков по каждому row group, схема каждого файла и (по желанию)
+    HyperLogLog-скетч IP файла.
+
+    Индекс хранится в <папка>/.cache/catalog/ и дополняется только новыми или
+    изменившимися файлами (отпечаток - размер и mtime), поэтому сводка по
+    тысячам файлов, отбор row groups по времени и проверка столбцов не читают данных.
+
+    Пример:
+        catalog = DatasetCatalog.build(folder, sketches=True)
+        print_profile(catalog)
+        selection = catalog.row_groups_in_range('2024-10-01 03:00', '2024-10-01 04:00')
+        for file, df in iter_data_files(list(selection), row_groups=selection):
+            ...
+
+    Атрибуты:
+        files (pd.DataFrame): path, rows, row_groups, schema, sketch по файлам
+        row_groups (pd.DataFrame): path, row_group, rows, ts_min_ms, ts_max_ms
+        nulls (pd.DataFrame): path, row_group, column, null_count (-1 - неизвестно)
+    """
+
+    def __init__(self, files, row_groups, nulls):
+        self.files = files
+        self.row_groups = row_groups
+        self.nulls = nulls
+
+    @classmethod
+    def build(cls, folder_or_files, sketches=False):
+        """
+        Каталог папки (файлы list_data_files) или списка файлов.
+
+        sketches=True - для файлов без скетча дочитывается столбец ip.
+        """
+        file_paths = list_data_files(folder_or_files) if isinstance(folder_or_files, str) \
+            else list(folder_or_files)
+        by_folder = {}
+        for file_path in file_paths:
+            by_folder.setdefault(os.path.dirname(os.path.abspath(file_path)), []).append(file_path)
+
+        tables = [[], [], []]
+        for folder, paths in by_folder.items():
+            # В каталог попадают только запрошенные файлы, пути - как в запросе
+            names = {os.path.basename(path): path for path in paths}
+            for table, frame in zip(tables, _update_folder(folder, paths, sketches)):
+                frame = frame[frame['name'].isin(names)]
+                table.append(frame.assign(path=frame['name'].map(names)))
+        files, row_groups, nulls = [
+            pd.concat(table or [empty.assign(path=pd.Series(dtype=object))], ignore_index=True)
+            .drop(columns=['name', 'fingerprint'])
+            for table, empty in zip(tables, _empty_index())]
+        position = {path: i for i, path in enumerate(file_paths)}
+        files = files.sort_values('path', key=lambda paths: paths.map(position), ignore_index=True)
+        return cls(files, row_groups, nulls)
+
+    def _to_ms(self, value, default):
+        if value is None:
+            return default
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        return int(parse_ts(pd.Series([pd.Timestamp(value)]), DISPLAY_TZ)[0])
+
+    def row_groups_in_range(self, start=None, end=None):
+        """
+        Row groups, которые могут содержать события из [start, end) - наивные
+        datetime в поясе вывода или мс UTC. Row groups без статистики ts не отбрасываются.
+
+        Возвращает:
+        dict: Путь к файлу -> список номеров row groups (для iter_data_files(row_groups=...))
+        """
+        start_ms = self._to_ms(start, np.iinfo(np.int64).min)
+        end_ms = self._to_ms(end, np.iinfo(np.int64).max)
+        groups = self.row_groups
+        unknown = groups['ts_min_ms'].isna() | groups['ts_max_ms'].isna()
+        overlaps = (groups['ts_max_ms'] >= start_ms) & (groups['ts_min_ms'] < end_ms)
+        selected = groups[unknown | overlaps.fillna(False)]
+        return {path: part['row_group'].tolist() for path, part in selected.groupby('path', sort=False)}
+
+    def files_in_range(self, start=None, end=None):
+        """Файлы, в которых могут быть события из [start, end)"""
+        return list(self.row_groups_in_range(start, end))
+
+    def columns_by_file(self):
+        """pd.DataFrame: путь к файлу x столбец -> есть ли столбец в файле"""
+        present = [(path, name) for path, schema in zip(self.files['path'], self.files['schema'])
+                   for name, _ in json.loads(schema)]
+        frame = pd.DataFrame(present, columns=['path', 'column'])
+        table = pd.crosstab(frame['path'], frame['column']).reindex(self.files['path'], fill_value=0) > 0
+        return table.rename_axis(index=None, columns=None)
+
+    def missing_columns(self, columns=None):
+        """
+        Столбцы, которых нет хотя бы в одном файле.
+
+        Параметры:
+        columns (list): Проверяемые столбцы (None - все, встречающиеся в наборе)
+
+        Возвращает:
+        dict: Столбец -> список файлов без него
+        """
+        table = self.columns_by_file()
+        if columns is None:
+            columns = list(table.columns)
+        table = table.reindex(columns=columns, fill_value=False)
+        return {column: table.index[~table[column]].tolist() for column in columns if not table[column].all()}
+
+    def null_counts(self):
+        """Пропуски по столбцам во всем наборе (NaN - в части row groups статистики нет)"""
+        counts = self.nulls['null_count']
+        grouped = self.nulls.assign(known=counts >= 0, count=counts.clip(lower=0)).groupby('column', sort=False)
+        return grouped['count'].sum().astype(np.float64).where(grouped['known'].all())
+
+    def row_groups_with_nulls(self, column):
+        """
+        Row groups, где в column есть (или могут быть) пропуски, включая файлы без column.
+
+        Возвращает:
+        dict: Путь к файлу -> список номеров row groups
+        """
+        groups = self.row_groups.merge(self.nulls[self.nulls['column'] == column], how='left',
+                                       on=['path', 'row_group'])
+        selected = groups[groups['null_count'].isna() | (groups['null_count'] != 0)]
+        return {path: part['row_group'].tolist() for path, part in selected.groupby('path', sort=False)}
+
+    def unique_ips(self, files=None):
+        """
+        Оценка числа уникальных IP по скетчам файлов (None - скетчи построены не для всех).
+
+        Параметры:
+        files (list): Подмножество файлов (по умолчанию - все)
+        """
+        sketches = self.files if files is None else self.files[self.files['path'].isin(files)]
+        if sketches.empty or sketches['sketch'].isna().any():
+            return None
+        registers = np.zeros(1 << SKETCH_PRECISION, dtype=np.uint8)
+        for sketch in sketches['sketch']:
+            np.maximum(registers, np.frombuffer(sketch, dtype=np.uint8), out=registers)
+        return hll_estimate(registers)
+
+    def summary(self):
+        """
+        Сводка набора без чтения данных.
+
+        Возвращает:
+        dict: files, row_groups, rows, date_min, date_max (наивное время пояса вывода),
+              unique_ips (оценка или None), missing_columns, null_counts
+        """
+        ts_min = self.row_groups['ts_min_ms'].min()
+        ts_max = self.row_groups['ts_max_ms'].max()
+        return {
+            'files': len(self.files),
+            'row_groups': len(self.row_groups),
+            'rows': int(self.files['rows'].sum()),
+            'date_min': None if pd.isna(ts_min) else to_datetime(np.array([int(ts_min)]))[0],
+            'date_max': None if pd.isna(ts_max) else to_datetime(np.array([int(ts_max)]))[0],
+            'unique_ips': self.unique_ips(),
+            'missing_columns': self.missing_columns(),
+            'null_counts': self.null_counts(),
+        }
+
+
+def catalog_overview(summary):
+    """
+    Объем, период и уникальные IP из сводки каталога (DatasetCatalog.summary())
+    для отчетов детекторов, чтобы те не считали их полным проходом по данным.
+    Неизвестные каталогу значения (нет скетчей, ts не в ISO) не попадают в
+    результат - их отчет считает по данным.
+    """
+    if summary is None:
+        return {}
+    return {key: summary[key] for key in ('rows', 'date_min', 'date_max', 'unique_ips')
+            if summary[key] is not None}
+
+
+def format_unique_ips(value):
+    """Точное число уникальных IP или оценка HyperLogLog из каталога (float)"""
+    return f"≈{value:,.0f} (оценка HyperLogLog)" if isinstance(value, float) else f"{value:,}"
+
+
+def load_catalog(folder_or_files, sketches=False):
+    """Каталог папки или списка файлов (индекс дополняется новыми файлами)"""
+    return DatasetCatalog.build(folder_or_files, sketches)
+
+
+def print_profile(catalog, columns=None):
+    """
+    Печать профиля набора по каталогу: объем, период, оценка уникальных IP,
+    столбцы, отсутствующие в части файлов, и пропуски.
+
+    Параметры:
+    catalog (DatasetCatalog): Каталог
+    columns (list): Столбцы, наличие которых нужно проверить (None - все)
+    """
+    summary = catalog.summary()
+    print("\n" + "="*50)
+    print("Профиль набора данных (по статистике parquet)")
+    print("="*50)
+    print(f"Файлов: {summary['files']:,}, row groups: {summary['row_groups']:,}")
+    print(f"Всего записей: {summary['rows']:,}")
+    if summary['date_min'] is not None:
+        print(f"Период данных: {summary['date_min']:%Y-%m-%d %H:%M} - {summary['date_max']:%Y-%m-%d %H:%M}")
+    if summary['unique_ips'] is not None:
+        print(f"Уникальных IP (оценка HyperLogLog): ≈{summary['unique_ips']:,.0f}")
+
+    missing = catalog.missing_columns(columns)
+    for column, files in missing.items():
+        print(f"⚠️ Столбец {column} отсутствует в {len(files)} из {summary['files']} файлов "
+              f"(например, {os.path.basename(files[0])})")
+
+    null_counts = summary['null_counts'].dropna()
+    null_counts = null_counts[null_counts > 0]
+    if columns is not None:
+        null_counts = null_counts[null_counts.index.isin(columns)]
+    if len(null_counts) and summary['rows']:
+        print("Пропуски:")
+        for column, count in null_counts.items():
+            print(f"   {column}: {int(count):,} ({count / summary['rows']:.1%})")
+    return summary
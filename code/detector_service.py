@@ -0,0 +1,531 @@
+import argparse
+import json
+import os
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+import numpy as np
+import pandas as pd
+from sklearn.ensemble import IsolationForest
+
+from bot_labels import UA_MATCH, add_bot_columns, add_bot_columns_cached
+from checkpoint import Checkpoint, default_checkpoint_dir
+from data_loader import list_data_files, read_data_file
+from dataset_catalog import load_catalog
+from epg import Epg, local_to_ms
+from ingest_cache import file_fingerprint
+from memory_budget import add_memory_argument, apply_memory_argument
+from timestamps import DISPLAY_TZ, add_time_columns, add_time_columns_cached, floor_ms, to_datetime, tz_offset_ms
+from topk_sketch import TopKWindows
+
+NODE_ID_COLUMNS = ['url', 'main_rubric_id', 'content_is_longread',
+                   'content_editor_id', 'content_author_ids', 'title']
+SERVICE_COLUMNS = ['ts', 'ip', 'event', 'ua_is_bot', 'node_id'] + NODE_ID_COLUMNS
+# Версия набора агрегатов: чекпоинт другой версии не восстанавливается
+STATE_VERSION = 3
+IP_COUNT_COLUMNS = ['requests', 'bot_requests', 'hidden_requests', 'ua_requests',
+                    'night_requests', 'night_bot_requests', 'night_hidden_requests']
+
+
+class DetectorState:
+    """
+    Теплое состояние детекторов в памяти процесса.
+
+    Атрибуты:
+        minutes (pd.DataFrame): Поминутные агрегаты (requests, page_views, bots, unique_ips)
+        intervals (pd.DataFrame): Агрегаты по interval_minutes для Isolation Forest
+        ip_pairs (pd.DataFrame): Уникальные пары (minute_ms, ip): по ним unique_ips минут и
+            интервалов, попавших в несколько файлов, пересчитываются, а не складываются
+        ip_counts (pd.DataFrame): Счетчики строк по IP (IP_COUNT_COLUMNS): всех, явных ботов,
+            скрытых ботов и с подозрительным UA (по bot_flags), то же ночью
+        night_hours (pd.DataFrame): Ночная статистика по часам 0-7
+        node_id_misses (dict): Счетчики строк без node_id
+        ip_windows (TopKWindows): Скетчи топ-IP по минутам, часам и суткам
+        is_anomaly (pd.Series): Метки модели для intervals
+        model (IsolationForest): Модель, обученная на intervals
+        files (dict): Обработанные файлы и их отпечатки (размер-mtime)
+
+    Агрегаты меняются под lock заменой таблиц (не на месте), поэтому ссылка
+    на таблицу - готовый снимок. Модель обучается на снимке intervals вне lock
+    и подменяется целиком: запросы не ждут обучения.
+    """
+
+    def __init__(self, interval_minutes=5, contamination=0.05, bot_threshold=100):
+        self.interval_minutes = interval_minutes
+        self.contamination = contamination
+        self.bot_threshold = bot_threshold
+        self.minutes = pd.DataFrame(columns=['requests', 'page_views', 'bots', 'unique_ips'], dtype=np.int64)
+        self.intervals = pd.DataFrame(columns=['requests', 'unique_ips', 'bot_count'], dtype=np.int64)
+        self.ip_pairs = pd.DataFrame({'minute_ms': pd.Series(dtype=np.int64), 'ip': pd.Series(dtype=object)})
+        self.ip_counts = pd.DataFrame(columns=IP_COUNT_COLUMNS, dtype=np.int64)
+        self.night_hours = pd.DataFrame(0, index=pd.RangeIndex(8, name='hour'),
+                                        columns=['requests', 'bots'], dtype=np.int64)
+        self.node_id_misses = {'rows': 0, 'columns': {}, 'urls': {}}
+        self.ip_windows = TopKWindows()
+        self.is_anomaly = pd.Series(dtype=bool)
+        self.model = None
+        self.files = {}
+        self.lock = threading.RLock()
+        # Номер снимка intervals и номер снимка, на котором обучена текущая модель
+        self._generation = 0
+        self._model_generation = 0
+
+    @staticmethod
+    def _add(total, part):
+        """Складывает агрегаты по индексу (новые ключи добавляются)"""
+        if total.empty:
+            return part.astype(np.int64)
+        return total.add(part, fill_value=0).astype(np.int64)
+
+    def _merge_pairs(self, pairs):
+        """
+        Добавляет пары (minute_ms, ip) файла к загруженным.
+
+        Уникальные IP не складываются между файлами: минута или интервал,
+        попавшие в два файла (пересекающиеся выгрузки, повторная доставка),
+        пересчитываются по всем своим парам, как в isolation_sweep.
+
+        Возвращает:
+        tuple: (все пары; pd.Series unique_ips затронутых минут;
+                pd.Series unique_ips затронутых интервалов)
+        """
+        known = self.ip_pairs
+        touched = np.unique(floor_ms(pairs['minute_ms'].to_numpy(), self.interval_minutes))
+        overlap = known[np.isin(floor_ms(known['minute_ms'].to_numpy(), self.interval_minutes), touched)]
+        fresh = pairs.merge(overlap, how='left', indicator=True)
+        fresh = fresh.loc[fresh['_merge'] == 'left_only', ['minute_ms', 'ip']]
+        merged = pd.concat([overlap, fresh], ignore_index=True)
+
+        minute_ms = merged['minute_ms'].to_numpy()
+        minute_ips = merged.groupby(to_datetime(minute_ms)).size()
+        interval = pd.DataFrame({'interval_ms': floor_ms(minute_ms, self.interval_minutes),
+                                 'ip': merged['ip'].to_numpy()}).drop_duplicates()
+        interval_ips = interval.groupby(to_datetime(interval['interval_ms'].to_numpy())).size()
+        return pd.concat([known, fresh], ignore_index=True), minute_ips, interval_ips
+
+    @staticmethod
+    def _set_unique(total, unique_ips):
+        """Подставляет пересчитанные unique_ips (таблица total - уже новая, не снимок)"""
+        total.loc[unique_ips.index, 'unique_ips'] = unique_ips.to_numpy()
+        return total
+
+    def ingest(self, df):
+        """Добавляет данные одного файла во все агрегаты и переобучает модель (вне lock)"""
+        df = df.copy()
+        if 'ts_ms' not in df.columns:
+            df = add_time_columns(df)
+        ts_ms = df['ts_ms'].to_numpy()
+        if 'bot_flags' not in df.columns:
+            add_bot_columns(df)
+        minute = to_datetime(floor_ms(ts_ms, 1))
+        hour = df['hour']
+
+        page_view = df['event'] == 'page_view' if 'event' in df.columns else pd.Series(True, index=df.index)
+        minutes = df.groupby(minute).agg(
+            requests=('ip', 'size'),
+            bots=('is_bot', 'sum'),
+        )
+        minutes['page_views'] = page_view.groupby(minute).sum()
+        minutes['unique_ips'] = 0
+
+        intervals = df.groupby(to_datetime(floor_ms(ts_ms, self.interval_minutes))).agg(
+            requests=('ip', 'size'),
+            bot_count=('is_bot', 'sum'),
+        )
+        intervals.insert(1, 'unique_ips', 0)
+        pairs = pd.DataFrame({'minute_ms': floor_ms(ts_ms, 1), 'ip': df['ip'].to_numpy()}) \
+            .dropna().drop_duplicates(ignore_index=True)
+        # Пары пишет только поток загрузки, поэтому их можно объединить до lock
+        ip_pairs, minute_ips, interval_ips = self._merge_pairs(pairs)
+
+        # Метки ботов - только из bot_flags, как у скриптов детекторов
+        night = hour < 8
+        is_bot, is_hidden = df['is_bot'], df['is_hidden_bot']
+        ua_match = pd.Series((df['bot_flags'].to_numpy() & UA_MATCH) != 0, index=df.index)
+        ip = df['ip']
+        ip_counts = pd.DataFrame({
+            'requests': df.groupby('ip').size(),
+            'bot_requests': is_bot.groupby(ip).sum(),
+            'hidden_requests': is_hidden.groupby(ip).sum(),
+            'ua_requests': ua_match.groupby(ip).sum(),
+            'night_requests': night.groupby(ip).sum(),
+            'night_bot_requests': (night & is_bot).groupby(ip).sum(),
+            'night_hidden_requests': (night & is_hidden).groupby(ip).sum(),
+        })
+        night_hours = df[night].groupby(hour[night]).agg(requests=('ip', 'size'), bots=('is_bot', 'sum'))
+
+        with self.lock:
+            self.minutes = self._set_unique(self._add(self.minutes, minutes), minute_ips).sort_index()
+            self.intervals = self._set_unique(self._add(self.intervals, intervals), interval_ips).sort_index()
+            self.ip_pairs = ip_pairs
+            self.ip_counts = self._add(self.ip_counts, ip_counts)
+            self.night_hours = self._add(self.night_hours, night_hours.reindex(range(8), fill_value=0))
+            self.ip_windows.add(ts_ms, df['ip'])
+            self._ingest_node_ids(df)
+            self._generation += 1
+            snapshot, generation = self.intervals, self._generation
+        self._fit_model(snapshot, generation)
+
+    def _ingest_node_ids(self, df):
+        if 'node_id' not in df.columns:
+            return
+        columns = [col for col in NODE_ID_COLUMNS if col in df.columns]
+        mask = df['node_id'].isnull() & df[columns].notnull().any(axis=1)
+        missing = df[mask]
+        stats = self.node_id_misses
+        stats['rows'] += int(mask.sum())
+        for col in columns:
+            stats['columns'][col] = stats['columns'].get(col, 0) + int(missing[col].notnull().sum())
+        if 'url' in missing.columns:
+            for url, count in missing['url'].value_counts().items():
+                stats['urls'][url] = stats['urls'].get(url, 0) + int(count)
+
+    def settings(self):
+        """Параметры, при смене которых чекпоинт состояния не подходит"""
+        return {'state_version': STATE_VERSION,
+                'interval_minutes': self.interval_minutes, 'contamination': self.contamination,
+                'bot_threshold': self.bot_threshold, 'topk_capacity': self.ip_windows.capacity}
+
+    def checkpoint_parts(self):
+        """
+        Снимок состояния для checkpoint.Checkpoint (вызывать под lock).
+        Таблицы не меняются на месте, поэтому записывать снимок можно уже без lock.
+        """
+        parts = {
+            'minutes': self.minutes,
+            'intervals': self.intervals,
+            'ip_pairs': self.ip_pairs,
+            'ip_counts': self.ip_counts,
+            'night_hours': self.night_hours,
+            'node_id_misses': {'rows': self.node_id_misses['rows'],
+                               'columns': dict(self.node_id_misses['columns']),
+                               'urls': dict(self.node_id_misses['urls'])},
+            'is_anomaly': self.is_anomaly,
+            'model': self.model,
+        }
+        parts.update(self.ip_windows.checkpoint_parts())
+        return parts
+
+    def restore(self, parts):
+        """Восстанавливает агрегаты и модель из checkpoint_parts"""
+        with self.lock:
+            for name in ('minutes', 'intervals', 'ip_counts', 'night_hours'):
+                setattr(self, name, parts[name].astype(np.int64))
+            self.ip_pairs = parts['ip_pairs']
+            self.node_id_misses = parts['node_id_misses']
+            self.is_anomaly = parts['is_anomaly'].astype(bool)
+            self.model = parts['model']
+            self.ip_windows.restore(parts)
+        return self
+
+    def _fit_model(self, intervals, generation):
+        """
+        Обучает Isolation Forest на снимке intervals без блокировки и подменяет
+        модель, если за время обучения не подменили модель по более новому снимку.
+        """
+        if len(intervals) < 2:
+            return
+        model = IsolationForest(contamination=self.contamination, random_state=42)
+        labels = model.fit_predict(intervals[['requests', 'unique_ips']])
+        is_anomaly = pd.Series(labels == -1, index=intervals.index)
+        with self.lock:
+            if generation > self._model_generation:
+                self.model, self.is_anomaly = model, is_anomaly
+                self._model_generation = generation
+
+
+class DetectorService:
+    """
+    Резидентный сервис: следит за папкой с данными и держит состояние теплым.
+
+    Новые parquet-файлы в папке подхватываются фоновым потоком; запросы
+    отвечают из памяти без перечитывания данных. Если задан checkpoint_dir,
+    состояние сохраняется после каждого файла, а новый запуск продолжает
+    с чекпоинта и загружает только новые или изменившиеся файлы.
+    """
+
+    def __init__(self, data_folder, schedule_file=None, poll_interval=30, checkpoint_dir=None, **state_kwargs):
+        self.data_folder = data_folder
+        self.poll_interval = poll_interval
+        self.state_kwargs = state_kwargs
+        self.state = DetectorState(**state_kwargs)
+        self.checkpoint = Checkpoint(checkpoint_dir, 'detector_service', self.state.settings()) \
+            if checkpoint_dir else None
+        self._restored = False
+        self.epg = Epg(schedule_file) if schedule_file else None
+        self._stop = threading.Event()
+        self._watcher = None
+
+    def restore_checkpoint(self, files):
+        """Заменяет состояние последним чекпоинтом, согласованным с файлами в папке"""
+        state = DetectorState(**self.state_kwargs)
+        parts = self.checkpoint.restore(files)
+        if parts is not None:
+            state.restore(parts)
+            state.files = dict(self.checkpoint.processed)
+        self.state = state
+        self._restored = True
+
+    def ingest_new_files(self):
+        """Загружает файлы, появившиеся в папке с прошлой проверки; возвращает их список"""
+        ingested = []
+        files = list_data_files(self.data_folder)
+        fingerprints = {file_path: file_fingerprint(file_path) for file_path in files}
+        if self.checkpoint is not None:
+            changed = any(fingerprints.get(path) != fingerprint for path, fingerprint in self.state.files.items())
+            if not self._restored or changed:
+                # Изменившийся файл нельзя вычесть из агрегатов - откат к поколению до него
+                self.restore_checkpoint(files)
+        for file_path in files:
+            fingerprint = fingerprints[file_path]
+            known = self.state.files.get(file_path)
+            if known == fingerprint:
+                continue
+            if known is not None:
+                # Агрегаты аддитивны, поэтому повторная загрузка удвоила бы счетчики
+                print(f"Файл изменился после загрузки, пропускаем: {file_path}")
+                continue
+            try:
+                df = read_data_file(file_path, SERVICE_COLUMNS)
+                add_bot_columns_cached(df, file_path)
+                df = add_time_columns_cached(df, file_path)
+                self.state.ingest(df)
+            except Exception as e:
+                print(f"Ошибка при загрузке {file_path}: {e}")
+                continue
+            self.state.files[file_path] = fingerprint
+            if self.checkpoint is not None:
+                with self.state.lock:
+                    parts = self.state.checkpoint_parts()
+                # Запись чекпоинта тоже не блокирует запросы
+                self.checkpoint.commit(file_path, parts, fingerprint)
+            ingested.append(file_path)
+            print(f"Успешно загружен: {os.path.basename(file_path)}")
+        return ingested
+
+    def _watch(self):
+        while not self._stop.is_set():
+            self.ingest_new_files()
+            self._stop.wait(self.poll_interval)
+
+    def start_watching(self):
+        self._watcher = threading.Thread(target=self._watch, daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join()
+
+    # Запросы
+
+    def status(self):
+        state = self.state
+        with state.lock:
+            return {
+                'files': len(state.files),
+                'minutes': len(state.minutes),
+                'first_minute': state.minutes.index.min() if len(state.minutes) else None,
+                'last_minute': state.minutes.index.max() if len(state.minutes) else None,
+                'unique_ips': len(state.ip_counts),
+                'model_fitted': state.model is not None,
+            }
+
+    def spikes(self, start=None, end=None, top=10):
+        """Топ минут по запросам в диапазоне + интервалы, помеченные моделью"""
+        start, end = parse_time(start), parse_time(end)
+        state = self.state
+        with state.lock:
+            minutes = state.minutes.loc[start:end]
+            intervals = state.intervals.loc[start:end]
+            peaks = minutes.nlargest(top, 'requests')
+            anomalies = intervals[state.is_anomaly.reindex(intervals.index, fill_value=False)]
+
+        result = [{'ts': ts, 'requests': int(row['requests']), 'bots': int(row['bots'])}
+                  for ts, row in peaks.iterrows()]
+        if self.epg is not None and result:
+            peak_ms = local_to_ms(peaks.index)
+            matched = self.epg.find_shows(peak_ms, with_popularity=True)
+            for item, shows, justified in zip(result, matched, self.epg.popular_on_air(peak_ms)):
+                item['matched_shows'] = shows
+                item['justified'] = bool(justified)
+        return {
+            'peaks': result,
+            'anomalies': [{'time_interval': ts, 'requests': int(row['requests']),
+                           'unique_ips': int(row['unique_ips'])} for ts, row in anomalies.iterrows()],
+        }
+
+    def top_bots(self, n=10):
+        """
+        Самые активные IP-боты, как top_bot_activity: IP со строками явных
+        (EXPLICIT) или скрытых (HIDDEN) ботов по числу всех своих запросов.
+        Тип - скрытый, если у IP есть строки с HIDDEN; ua_match - есть строки с UA_MATCH.
+        """
+        state = self.state
+        with state.lock:
+            counts = state.ip_counts
+        bots = counts[(counts['bot_requests'] > 0) | (counts['hidden_requests'] > 0)]
+        bots = bots.sort_index().nlargest(n, 'requests')
+        return [{'ip': ip, 'requests': int(row['requests']),
+                 'bot_requests': int(row['bot_requests'] + row['hidden_requests']),
+                 'type': 'скрытый' if row['hidden_requests'] > 0 else 'явный',
+                 'ua_match': bool(row['ua_requests'] > 0)}
+                for ip, row in bots.iterrows()]
+
+    def top_ips(self, start=None, end=None, n=10):
+        """Топ IP за диапазон [start, end) по скетчам с границами ошибки"""
+        start, end = parse_time(start), parse_time(end)
+        state = self.state
+        with state.lock:
+            top = state.ip_windows.top(n, start, end)
+        return [{'ip': ip, 'requests': int(row['count']), 'error': int(row['error']),
+                 'guaranteed': bool(row['guaranteed'])} for ip, row in top.iterrows()]
+
+    def night(self):
+        """
+        Ночная статистика (00:00-07:59).
+
+        heavy_ips - IP с > bot_threshold ночными запросами отдельно для строк
+        ботов и людей (как find_anomalies в night_activity_analysis), hidden_bot_ips -
+        IP с ночными строками скрытых ботов (HIDDEN в bot_flags).
+        """
+        state = self.state
+        with state.lock:
+            hours, counts = state.night_hours, state.ip_counts
+        night_bots = counts['night_bot_requests']
+        heavy = (night_bots > state.bot_threshold).sum() + \
+            ((counts['night_requests'] - night_bots) > state.bot_threshold).sum()
+        return {
+            'hours': {int(h): {'requests': int(r['requests']), 'bots': int(r['bots'])}
+                      for h, r in hours.iterrows()},
+            'requests': int(hours['requests'].sum()),
+            'heavy_ips': int(heavy),
+            'hidden_bot_ips': int((counts['night_hidden_requests'] > 0).sum()),
+        }
+
+    def node_id_misses(self, top=5):
+        state = self.state
+        with state.lock:
+            stats = state.node_id_misses
+            urls = sorted(stats['urls'].items(), key=lambda item: item[1], reverse=True)[:top]
+            return {'rows': stats['rows'], 'columns': dict(stats['columns']), 'top_urls': urls}
+
+    def catalog(self):
+        """Профиль папки данных по футерам parquet (индекс каталога, без чтения данных)"""
+        summary = load_catalog(self.data_folder, sketches=True).summary()
+        summary['missing_columns'] = {column: [os.path.basename(path) for path in paths]
+                                      for column, paths in summary['missing_columns'].items()}
+        summary['null_counts'] = {column: None if pd.isna(count) else int(count)
+                                  for column, count in summary['null_counts'].items()}
+        return summary
+
+
+def parse_time(value):
+    """
+    Параметр start/end запроса -> наивный pd.Timestamp в поясе вывода (None - без ограничения).
+    Время с поясом (2024-10-01T18:00+03:00, ...Z) переводится в пояс вывода.
+    """
+    if value is None or value == '':
+        return None
+    try:
+        ts = pd.Timestamp(value)
+    except (ValueError, TypeError, OverflowError):
+        ts = pd.NaT
+    if pd.isna(ts):
+        raise ValueError(f"Некорректное время: {value!r}")
+    if ts.tzinfo is not None:
+        ts = ts.tz_convert('UTC').tz_localize(None) + pd.Timedelta(milliseconds=tz_offset_ms(DISPLAY_TZ))
+    return ts
+
+
+def _json_default(value):
+    if isinstance(value, (pd.Timestamp, np.datetime64)):
+        return pd.Timestamp(value).isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, float) and np.isnan(value):
+        return None
+    return str(value)
+
+
+def make_handler(service):
+    """Создает обработчик HTTP-запросов, привязанный к сервису"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            params = {key: values[0] for key, values in parse_qs(url.query).items()}
+            try:
+                # Время разбирается до запроса: ошибка формата - 400, а не обрыв соединения
+                start, end = parse_time(params.get('start')), parse_time(params.get('end'))
+            except ValueError as e:
+                self._send(400, {'error': str(e)})
+                return
+            routes = {
+                '/status': lambda: service.status(),
+                '/spikes': lambda: service.spikes(start, end, int(params.get('top', 10))),
+                '/top_bots': lambda: service.top_bots(int(params.get('n', 10))),
+                '/top_ips': lambda: service.top_ips(start, end, int(params.get('n', 10))),
+                '/night': lambda: service.night(),
+                '/node_id_misses': lambda: service.node_id_misses(int(params.get('top', 5))),
+                '/catalog': lambda: service.catalog(),
+            }
+            if url.path not in routes:
+                self._send(404, {'error': f"Неизвестный запрос: {url.path}"})
+                return
+            try:
+                self._send(200, routes[url.path]())
+            except (ValueError, KeyError) as e:
+                self._send(400, {'error': str(e)})
+            except Exception as e:
+                self._send(500, {'error': f"{type(e).__name__}: {e}"})
+
+        def _send(self, code, payload):
+            body = json.dumps(payload, default=_json_default, ensure_ascii=False).encode('utf-8')
+            self.send_response(code)
+            self.send_header('Content-Type', 'application/json; charset=utf-8')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return Handler
+
+
+def serve(service, host='127.0.0.1', port=8765):
+    """Запускает HTTP API сервиса (блокирующий вызов)"""
+    server = ThreadingHTTPServer((host, port), make_handler(service))
+    print(f"Сервис детекторов слушает http://{host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.stop()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Резидентный сервис детекторов аномалий")
+    parser.add_argument('--dataset', required=True, help="Папка с parquet-файлами")
+    parser.add_argument('--schedule', help="CSV с телепрограммой")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--poll-interval', type=float, default=30, help="Период проверки папки, с")
+    parser.add_argument('--checkpoint', help="Папка чекпоинтов (по умолчанию <dataset>/.cache/checkpoint-detector_service)")
+    parser.add_argument('--no-checkpoint', action='store_true', help="Не сохранять и не загружать чекпоинты")
+    add_memory_argument(parser)
+    args = parser.parse_args()
+    apply_memory_argument(args)
+
+    checkpoint_dir = None if args.no_checkpoint else \
+        args.checkpoint or default_checkpoint_dir(args.dataset, 'detector_service')
+    service = DetectorService(args.dataset, args.schedule, args.poll_interval, checkpoint_dir)
+    service.ingest_new_files()
+    service.start_watching()
+    serve(service, args.host, args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,302 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from checkpoint import Checkpoint
+from data_loader import iter_data_files, list_data_files
+from render_backend import ChartRenderer
+from session_store import IdEncoder
+from timestamps import DATA_TZ, MISSING_MS, TIME_CACHE_VERSION, hour_of_day, parse_ts
+
+# Битовая маска устройства: один байт на событие вместо трех bool-столбцов
+DEVICE_FLAGS = {'ua_is_tablet': 1, 'ua_is_pc': 2, 'ua_is_mobile': 4}
+DEVICE_COLUMNS = list(DEVICE_FLAGS)
+REQUIRED_COLUMNS = ['ts', 'randPAS_session_id'] + DEVICE_COLUMNS
+
+# Число установленных бит для масок 0..7
+POPCOUNT = np.array([0, 1, 1, 2, 1, 2, 2, 3], dtype=np.int8)
+
+MIX_COLUMNS = ['ua_is_pc', 'ua_is_mobile', 'ua_is_tablet', 'Multi-Device', 'Null-Device']
+
+
+def device_mask(df):
+    """Упаковывает флаги ua_is_tablet/ua_is_pc/ua_is_mobile в битовую маску uint8"""
+    mask = np.zeros(len(df), dtype=np.uint8)
+    for col, bit in DEVICE_FLAGS.items():
+        if col in df.columns:
+            # Float64 принимает и bool с пропусками (None, pd.NA), и числа
+            flag = pd.to_numeric(df[col], errors='coerce').astype('Float64').fillna(0).to_numpy(np.float64) > 0
+            mask |= np.where(flag, bit, 0).astype(np.uint8)
+    return mask
+
+
+def session_masks(codes, mask, n_sessions):
+    """Побитовое ИЛИ масок устройств по сессиям (одна сгруппированная редукция)"""
+    result = np.zeros(n_sessions, dtype=np.uint8)
+    valid = codes >= 0
+    np.bitwise_or.at(result, codes[valid], mask[valid])
+    return result
+
+
+def device_mix(masks):
+    """Число сессий по типам устройств для массива масок сессий"""
+    return pd.Series({
+        'ua_is_pc': int(np.count_nonzero(masks & DEVICE_FLAGS['ua_is_pc'])),
+        'ua_is_mobile': int(np.count_nonzero(masks & DEVICE_FLAGS['ua_is_mobile'])),
+        'ua_is_tablet': int(np.count_nonzero(masks & DEVICE_FLAGS['ua_is_tablet'])),
+        'Multi-Device': int(np.count_nonzero(POPCOUNT[masks] > 1)),
+        'Null-Device': int(np.count_nonzero(masks == 0)),
+    })[MIX_COLUMNS]
+
+
+def hourly_device_mix(codes, hours, mask):
+    """
+    Почасовая таблица устройств: число уникальных сессий каждого типа в каждом часе.
+
+    Маски объединяются по паре (сессия, час), поэтому сессия, сменившая
+    устройство внутри часа, попадает в Multi-Device этого часа.
+    События без времени (час -1) в таблицу не попадают.
+    """
+    valid = (codes >= 0) & (hours >= 0)
+    pair = codes[valid] * 24 + hours[valid]
+    pair_codes, pairs = pd.factorize(pair)
+    masks = session_masks(pair_codes, mask[valid], len(pairs))
+    return _hourly_table(pairs % 24, masks)
+
+
+def _hourly_table(pair_hours, masks):
+    """Почасовая таблица по часам и маскам пар (сессия, час)"""
+    table = pd.DataFrame(index=pd.RangeIndex(24, name='hour'))
+    for col in ['ua_is_pc', 'ua_is_mobile', 'ua_is_tablet']:
+        table[col] = np.bincount(pair_hours, weights=(masks & DEVICE_FLAGS[col]) > 0, minlength=24)
+    table['Multi-Device'] = np.bincount(pair_hours, weights=POPCOUNT[masks] > 1, minlength=24)
+    table['Null-Device'] = np.bincount(pair_hours, weights=masks == 0, minlength=24)
+    table['sessions'] = np.bincount(pair_hours, minlength=24)
+    return table.astype(np.int64)
+
+
+def identify_multi_device_users(df, encoder=None):
+    """Помечает события сессий, в которых встречалось несколько типов устройств"""
+    if 'randPAS_session_id' not in df.columns:
+        print("Ошибка: Отсутствуют необходимые столбцы для идентификации многоустройственных пользователей.")
+        return df
+
+    if encoder is None:
+        encoder = IdEncoder()
+    codes = encoder.encode(df['randPAS_session_id'].to_numpy())
+    masks = session_masks(codes, device_mask(df), len(encoder))
+    is_multi = POPCOUNT[masks] > 1
+    df['is_multi_device_session'] = np.where(codes >= 0, is_multi[codes], False)
+    return df
+
+
+def analyze_device_usage(df, file_name):
+    """
+    Анализ использования устройств по сессиям.
+
+    Параметры:
+    df (pd.DataFrame): Данные (ts, randPAS_session_id, ua_is_tablet, ua_is_pc, ua_is_mobile)
+    file_name (str): Имя файла для подписи результатов
+
+    Возвращает:
+    dict: device_proportions, hourly_data, hourly_device_mix, multi_device_sessions,
+          single_device_sessions, multi_device_session_count, single_device_session_count,
+          file_name (или None, если нет нужных столбцов)
+
+    Как в device_of_user.ipynb, multi_device_sessions и single_device_sessions -
+    число событий в многоустройственных и остальных сессиях; число самих
+    сессий - в *_session_count.
+    """
+    if not all(col in df.columns for col in ['ts', 'randPAS_session_id']):
+        print(f"Ошибка: DataFrame должен содержать столбцы {REQUIRED_COLUMNS}.")
+        return None
+
+    encoder = IdEncoder()
+    codes = encoder.encode(df['randPAS_session_id'].to_numpy())
+    mask = device_mask(df)
+    if np.any(POPCOUNT[mask] > 1):
+        print("Предупреждение: В некоторых строках установлено более одного флага устройства.")
+
+    masks = session_masks(codes, mask, len(encoder))
+    if 'hour' in df.columns:
+        hours = df['hour'].to_numpy()
+    else:
+        ts_ms = parse_ts(df['ts'])
+        hours = np.where(ts_ms == MISSING_MS, -1, hour_of_day(ts_ms))
+    return _build_results(masks, session_events(codes, len(encoder)), len(df),
+                          hourly_device_mix(codes, hours, mask), file_name)
+
+
+def session_events(codes, n_sessions):
+    """Число событий каждой сессии (события без сессии не учитываются)"""
+    return np.bincount(codes[codes >= 0], minlength=n_sessions).astype(np.int64)
+
+
+def _build_results(masks, events, n_events, hourly_mix, file_name):
+    """Результаты по маскам сессий, числу событий каждой сессии и общему числу событий"""
+    n_sessions = len(masks)
+    mix = device_mix(masks)
+    multi_device_session_count = int(mix['Multi-Device'])
+    multi_device_events = int(events[POPCOUNT[masks] > 1].sum())
+    return {
+        'device_proportions': mix / n_sessions if n_sessions else mix.astype(float),
+        'hourly_data': hourly_mix['sessions'],
+        'hourly_device_mix': hourly_mix,
+        'multi_device_sessions': multi_device_events,
+        'single_device_sessions': n_events - multi_device_events,
+        'multi_device_session_count': multi_device_session_count,
+        'single_device_session_count': n_sessions - multi_device_session_count,
+        'file_name': file_name,
+    }
+
+
+def _grow(values, size):
+    """Дополняет массив нулями до size элементов"""
+    return np.concatenate([values, np.zeros(size - len(values), dtype=values.dtype)])
+
+
+class DeviceCounts:
+    """
+    Накопитель масок устройств по сессиям и парам (сессия, час) в кодах общего
+    кодировщика. Маски объединяются побитовым ИЛИ, поэтому части можно
+    добавлять в любом порядке: файлы, row groups одного файла.
+    """
+
+    def __init__(self):
+        self.masks = np.zeros(0, dtype=np.uint8)
+        self.events = np.zeros(0, dtype=np.int64)
+        self.seen = np.zeros(0, dtype=bool)
+        # Маски пар (сессия, час) с индексом код * 24 + час
+        self.pair_masks = np.zeros(0, dtype=np.uint8)
+        self.pair_seen = np.zeros(0, dtype=bool)
+        self.rows = 0
+
+    def add(self, codes, mask, hours, n_sessions):
+        """Добавляет события части (коды сессий, маски устройств, часы)"""
+        self.masks = _grow(self.masks, n_sessions) | session_masks(codes, mask, n_sessions)
+        self.events = _grow(self.events, n_sessions) + session_events(codes, n_sessions)
+        self.seen = _grow(self.seen, n_sessions)
+        self.seen[codes[codes >= 0]] = True
+        self.rows += len(codes)
+
+        valid = (codes >= 0) & (hours >= 0)
+        pair = codes[valid] * 24 + hours[valid]
+        self.pair_masks = _grow(self.pair_masks, n_sessions * 24)
+        self.pair_seen = _grow(self.pair_seen, n_sessions * 24)
+        np.bitwise_or.at(self.pair_masks, pair, mask[valid])
+        self.pair_seen[pair] = True
+
+    def results(self, file_name):
+        """Результаты в формате analyze_device_usage по сессиям, встреченным в частях"""
+        pairs = np.flatnonzero(self.pair_seen)
+        hourly = _hourly_table(pairs % 24, self.pair_masks[pairs])
+        return _build_results(self.masks[self.seen], self.events[self.seen], self.rows, hourly, file_name)
+
+
+def analyze_device_usage_files(folder_or_files, checkpoint_dir=None):
+    """
+    Потоковый анализ устройств по файлам с общим кодированием сессий.
+
+    Маски сессий и пар (сессия, час) накапливаются между файлами, поэтому
+    сессия, начатая на одном устройстве вчера и продолженная на другом сегодня,
+    считается многоустройственной, а итог совпадает с analyze_device_usage
+    по всем данным. Полный набор данных в память не загружается, а файл,
+    не помещающийся в пакет бюджета памяти, читается по row groups.
+
+    checkpoint_dir: папка чекпоинта (кодировщик сессий, накопленные маски и
+    результаты по файлам); с ней повторный запуск дочитывает только новые
+    или изменившиеся файлы.
+
+    Возвращает:
+    tuple: (список результатов по файлам, итоговый результат по всем файлам)
+    """
+    files = list_data_files(folder_or_files) if isinstance(folder_or_files, str) else list(folder_or_files)
+    encoder = IdEncoder()
+    total = DeviceCounts()
+    per_file = []
+    checkpoint = None
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(checkpoint_dir, 'device_usage', params={
+            'time_cache': TIME_CACHE_VERSION, 'data_tz': DATA_TZ})
+        parts = checkpoint.restore(files)
+        if parts is not None:
+            encoder, total, per_file = parts['encoder'], parts['total'], parts['files']
+        files = checkpoint.pending(files)
+    current, counts = None, None
+
+    def commit(file_path):
+        per_file.append(counts.results(os.path.basename(file_path)))
+        if checkpoint is not None:
+            checkpoint.commit(file_path, {'encoder': encoder, 'total': total}, append={'files': per_file[-1]})
+
+    for file_path, df in iter_data_files(files, columns=REQUIRED_COLUMNS,
+                                         row_groups='auto', derive_time=True):
+        if file_path != current:
+            if counts is not None:
+                commit(current)
+            current, counts = file_path, DeviceCounts()
+        codes = encoder.encode(df['randPAS_session_id'].to_numpy())
+        mask, hours = device_mask(df), df['hour'].to_numpy()
+        counts.add(codes, mask, hours, len(encoder))
+        total.add(codes, mask, hours, len(encoder))
+
+    if counts is not None:
+        commit(current)
+    if not per_file:
+        raise ValueError("Не удалось загрузить ни одного файла")
+    return per_file, total.results('все файлы')
+
+
+def draw_device_usage(fig, analysis_results):
+    """Круговая диаграмма пропорций устройств и почасовая активность"""
+    file_name = analysis_results['file_name']
+
+    ax1 = fig.add_subplot(1, 2, 1)
+    analysis_results['device_proportions'].plot(
+        kind='pie', autopct='%1.1f%%', startangle=140, ax=ax1,
+        colors=['skyblue', 'lightgreen', 'lightcoral', 'orange', 'gray'])
+    ax1.set_title(f'Пропорции использования устройств - {file_name}', fontsize=14)
+    ax1.set_ylabel('')
+
+    ax2 = fig.add_subplot(1, 2, 2)
+    analysis_results['hourly_device_mix'][MIX_COLUMNS].plot(kind='bar', stacked=True, ax=ax2)
+    ax2.set_title(f'Сессии по часам и устройствам - {file_name}', fontsize=14)
+    ax2.set_xlabel('Час дня')
+    ax2.set_ylabel('Количество сессий')
+    ax2.tick_params(axis='x', labelrotation=0)
+
+
+def visualize_device_usage(analysis_results, plot_path, renderer=None):
+    """Печатает сводку и ставит графики в очередь фоновой отрисовки"""
+    print(f"Файл: {analysis_results['file_name']}")
+    print(f"  Сессий с несколькими устройствами: {analysis_results['multi_device_session_count']:,} "
+          f"(событий: {analysis_results['multi_device_sessions']:,})")
+    print(f"  Сессий с одним устройством: {analysis_results['single_device_session_count']:,} "
+          f"(событий: {analysis_results['single_device_sessions']:,})")
+
+    own_renderer = renderer is None
+    if own_renderer:
+        renderer = ChartRenderer()
+    future = renderer.submit(draw_device_usage, plot_path, analysis_results, figsize=(14, 6))
+    if own_renderer:
+        renderer.close()
+    return future
+
+
+def main():
+    from google.colab import drive
+    drive.mount('/content/drive', force_remount=True)
+
+    folder_path = input("Введите путь к папке с данными (например: /content/drive/MyDrive/dataset): ").strip()
+    output_folder = os.path.join(os.path.dirname(folder_path), "device_results")
+
+    per_file, total = analyze_device_usage_files(folder_path)
+    with ChartRenderer() as renderer:
+        for results in per_file + [total]:
+            name = os.path.splitext(results['file_name'])[0].replace(' ', '_')
+            visualize_device_usage(results, os.path.join(output_folder, f"devices_{name}.png"), renderer)
+
+
+if __name__ == "__main__":
+    main()
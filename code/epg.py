@@ -0,0 +1,167 @@
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from ingest_cache import load_cache, save_cache
+from kernels import stab_intervals
+from timestamps import DATA_TZ, DISPLAY_TZ, MISSING_MS, parse_ts
+
+SCHEDULE_COLUMNS = ['start_ts', 'dur', 'title', 'event_type', 'channel_id']
+# Тип передачи, который не участвует в рейтинге популярности
+OTHER_EVENT_TYPE = 'Прочее'
+SHOW_FIELDS = ['title', 'event_type', 'channel_id']
+# Версия кэша разобранной телепрограммы: v2 без передач с пропущенными start_ts/dur
+SCHEDULE_CACHE_VERSION = 2
+
+
+def file_hash(file_path, chunk_size=1 << 20):
+    """SHA-1 содержимого файла: кэш телепрограммы сбрасывается только при смене данных"""
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def popularity_ranks(event_types):
+    """
+    Место типа передачи в рейтинге по числу выходов в эфир (1 - самый частый).
+
+    Типы 'Прочее' и пустые значения получают 0.
+    """
+    counts = event_types[event_types != OTHER_EVENT_TYPE].value_counts()
+    ranks = pd.Series(np.arange(1, len(counts) + 1, dtype=np.int32), index=counts.index)
+    return event_types.map(ranks).fillna(0).astype(np.int32).to_numpy()
+
+
+def parse_schedule(schedule_file, source_tz=DATA_TZ):
+    """
+    Разбирает CSV телепрограммы в типизированную таблицу (порядок строк сохраняется).
+
+    Передачи без времени начала или длительности отбрасываются: у них нет
+    интервала в эфире.
+
+    Возвращает:
+    pd.DataFrame: start_ms, end_ms (int64 мс UTC), title, event_type (category),
+                  channel_id, popularity_rank (int32)
+    """
+    raw = pd.read_csv(schedule_file, usecols=SCHEDULE_COLUMNS)
+    start_ms = parse_ts(raw['start_ts'], source_tz)
+    dur = pd.to_numeric(raw['dur'], errors='coerce').to_numpy(dtype=np.float64)
+    valid = (start_ms != MISSING_MS) & ~np.isnan(dur)
+    if not valid.all():
+        print(f"Пропущено передач без start_ts или dur: {int((~valid).sum()):,}")
+        raw, start_ms, dur = raw[valid].reset_index(drop=True), start_ms[valid], dur[valid]
+    return pd.DataFrame({
+        'start_ms': start_ms,
+        'end_ms': start_ms + (dur * 1000).astype(np.int64),
+        'title': raw['title'].astype('category'),
+        'event_type': raw['event_type'].astype('category'),
+        'channel_id': raw['channel_id'],
+        'popularity_rank': popularity_ranks(raw['event_type']),
+    })
+
+
+def load_schedule(schedule_file, source_tz=DATA_TZ):
+    """
+    Телепрограмма из кэша .cache/<файл>.epg-v<версия>-<пояс>.parquet или из CSV.
+
+    Кэш проверяется по хэшу содержимого, поэтому копирование файла
+    (с новым mtime) не приводит к повторному разбору.
+    """
+    if not os.path.exists(schedule_file):
+        raise FileNotFoundError(f"Файл телепрограммы не найден: {schedule_file}")
+    kind = f'epg-v{SCHEDULE_CACHE_VERSION}-{source_tz.replace("/", "_")}'
+    digest = file_hash(schedule_file)
+    cached = load_cache(schedule_file, kind, fingerprint=digest)
+    if cached is not None:
+        return cached
+    schedule = parse_schedule(schedule_file, source_tz)
+    save_cache(schedule_file, kind, schedule, fingerprint=digest)
+    return schedule
+
+
+class Epg:
+    """
+    Телепрограмма с интервальным индексом и рейтингом типов передач.
+
+    Атрибуты:
+        shows (pd.DataFrame): Результат load_schedule
+        top_k (int): Сколько мест рейтинга считаются популярными
+        top (pd.Series): Число выходов в эфир для top_k популярных типов
+    """
+
+    def __init__(self, schedule_file, top_k=10, source_tz=DATA_TZ):
+        self.shows = load_schedule(schedule_file, source_tz)
+        self.top_k = top_k
+
+        ranks = self.shows['popularity_rank'].to_numpy()
+        popular = (ranks > 0) & (ranks <= top_k)
+        self.is_popular = popular
+        top = self.shows[popular].groupby('popularity_rank')['event_type'].agg(['first', 'size'])
+        self.top = pd.Series(top['size'].to_numpy(), index=pd.Index(top['first'].astype(str), name='event_type'),
+                             name='count')
+
+        # Индекс: передачи по началу эфира; самая длинная ограничивает окно поиска
+        starts = self.shows['start_ms'].to_numpy()
+        ends = self.shows['end_ms'].to_numpy()
+        self.order = np.argsort(starts, kind='stable')
+        self.starts = starts[self.order]
+        self.ends = ends[self.order]
+        self.max_duration = int((ends - starts).max()) if len(starts) else 0
+        # Для популярных передач - максимум конца эфира среди начавшихся до момента t
+        popular_order = self.order[popular[self.order]]
+        self.popular_starts = starts[popular_order]
+        self.popular_reach = np.maximum.accumulate(ends[popular_order]) if len(popular_order) else ends[:0]
+
+    def popular_on_air(self, ts_ms):
+        """
+        Шла ли в момент t хотя бы одна популярная передача (start <= t <= end).
+
+        Параметры:
+        ts_ms (array-like): int64 мс UTC
+
+        Возвращает:
+        np.ndarray: bool для каждого момента
+        """
+        ts_ms = np.asarray(ts_ms, dtype=np.int64)
+        started = np.searchsorted(self.popular_starts, ts_ms, side='right')
+        reach = np.concatenate([[np.iinfo(np.int64).min], self.popular_reach])[started]
+        return reach >= ts_ms
+
+    def on_air(self, ts_ms):
+        """
+        Все пары (момент, передача в эфире) без цикла по моментам.
+
+        Возвращает:
+        tuple: (np.ndarray позиций в ts_ms, np.ndarray номеров строк shows),
+               внутри момента - в порядке строк файла телепрограммы
+        """
+        query, candidate = stab_intervals(self.starts, self.ends, ts_ms, self.max_duration)
+        rows = self.order[candidate]
+        by_row = np.lexsort((rows, query))
+        return query[by_row], rows[by_row]
+
+    def find_shows(self, ts_ms, with_popularity=False):
+        """
+        Передачи в эфире для каждого момента.
+
+        Возвращает:
+        list: Для каждого момента список словарей title, event_type, channel_id
+              (и is_popular при with_popularity=True)
+        """
+        query, rows = self.on_air(ts_ms)
+        records = self.shows[SHOW_FIELDS].iloc[rows].astype(object)
+        if with_popularity:
+            records['is_popular'] = self.is_popular[rows]
+        matched = [[] for _ in range(len(np.atleast_1d(ts_ms)))]
+        for position, record in zip(query, records.to_dict(orient='records')):
+            matched[position].append(record)
+        return matched
+
+
+def local_to_ms(ts, tz=DISPLAY_TZ):
+    """Наивные datetime в поясе вывода (как столбец ts после загрузки) -> int64 мс UTC"""
+    return parse_ts(pd.Series(np.atleast_1d(np.asarray(ts, dtype='datetime64[ms]'))), tz)
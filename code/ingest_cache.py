@@ -0,0 +1,58 @@
+import os
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Производные столбцы хранятся рядом с данными: <папка>/.cache/<файл>.<вид>.parquet
+CACHE_DIR_NAME = '.cache'
+
+
+def file_fingerprint(file_path):
+    """Отпечаток файла (размер и время изменения) для инвалидации кэша"""
+    stat = os.stat(file_path)
+    return f"{stat.st_size}-{stat.st_mtime_ns}"
+
+
+def cache_path(file_path, kind):
+    """Путь к файлу кэша вида kind для файла данных"""
+    folder, name = os.path.split(file_path)
+    base = os.path.splitext(name)[0]
+    return os.path.join(folder, CACHE_DIR_NAME, f"{base}.{kind}.parquet")
+
+
+def load_cache(file_path, kind, fingerprint=None):
+    """
+    Загружает кэш производных столбцов, если он соответствует файлу данных.
+
+    Возвращает:
+    pd.DataFrame | None: Кэш или None, если его нет или файл данных изменился
+    """
+    path = cache_path(file_path, kind)
+    if not os.path.exists(path):
+        return None
+    fingerprint = fingerprint or file_fingerprint(file_path)
+    try:
+        table = pq.read_table(path)
+    except Exception as e:
+        print(f"Поврежден кэш {path}: {e}")
+        return None
+    metadata = table.schema.metadata or {}
+    if metadata.get(b'fingerprint', b'').decode() != fingerprint:
+        return None
+    return table.to_pandas()
+
+
+def save_cache(file_path, kind, df, fingerprint=None):
+    """Сохраняет производные столбцы рядом с данными (ошибки записи не критичны)"""
+    path = cache_path(file_path, kind)
+    fingerprint = fingerprint or file_fingerprint(file_path)
+    try:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        table = pa.Table.from_pandas(df, preserve_index=False)
+        metadata = dict(table.schema.metadata or {})
+        metadata[b'fingerprint'] = fingerprint.encode()
+        tmp_path = path + '.tmp'
+        pq.write_table(table.replace_schema_metadata(metadata), tmp_path)
+        os.replace(tmp_path, path)
+    except Exception as e:
+        print(f"Не удалось сохранить кэш {path}: {e}")
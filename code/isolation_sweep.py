@@ -0,0 +1,255 @@
+import os
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+from joblib import Parallel, delayed
+from sklearn.ensemble import IsolationForest
+
+from bot_labels import label_rules
+from checkpoint import Checkpoint
+from data_loader import iter_data_files, list_data_files
+from memory_budget import ExternalAggregator
+from timestamps import DATA_TZ, MS_PER_MINUTE, TIME_CACHE_VERSION, floor_ms, to_datetime
+
+DEFAULT_INTERVALS = (1, 5, 15, 60)
+DEFAULT_CONTAMINATIONS = (0.01, 0.02, 0.05, 0.1)
+REFERENCE = (5, 0.05)  # Параметры по умолчанию detect_anomalies
+
+
+def base_aggregates(df):
+    """
+    Минутные агрегаты, из которых сворачиваются все более крупные интервалы.
+
+    Параметры:
+    df (pd.DataFrame): Данные со столбцами ts_ms, ip, is_bot
+
+    Возвращает:
+    tuple: (pd.DataFrame по минутам: rows, requests, bot_count;
+            pd.DataFrame уникальных пар (minute_ms, ip))
+    """
+    minute = floor_ms(df['ts_ms'].to_numpy(), 1)
+    has_ip = df['ip'].notna().to_numpy()
+    minutes = pd.DataFrame({
+        'rows': 1,
+        'requests': has_ip.astype(np.int64),
+        'bot_count': df['is_bot'].to_numpy().astype(np.int64),
+    }).groupby(minute).sum()
+    minutes.index.name = 'minute_ms'
+
+    pairs = pd.DataFrame({'minute_ms': minute[has_ip], 'ip': df['ip'].to_numpy()[has_ip]})
+    return minutes, pairs.drop_duplicates(ignore_index=True)
+
+
+def merge_base(parts):
+    """Объединяет минутные агрегаты нескольких файлов"""
+    minutes = pd.concat([m for m, _ in parts]).groupby(level=0).sum()
+    pairs = pd.concat([p for _, p in parts], ignore_index=True).drop_duplicates(ignore_index=True)
+    return minutes, pairs
+
+
+def unique_ips_per_interval(pairs, interval_minutes):
+    """
+    Число уникальных IP в интервалах по парам (minute_ms, ip).
+
+    pairs - DataFrame или ExternalAggregator с ключами (ip, minute_ms): во
+    втором случае пары читаются частями по диапазонам IP, а так как диапазоны
+    не пересекаются, счетчики частей просто складываются.
+    """
+    chunks = pairs.iter_results() if isinstance(pairs, ExternalAggregator) else [pairs]
+    total = pd.Series(dtype=np.int64)
+    for chunk in chunks:
+        if 'ip' not in chunk.columns:
+            chunk = chunk.reset_index()
+        bucket = floor_ms(chunk['minute_ms'].to_numpy(), interval_minutes)
+        part = pd.DataFrame({'bucket': bucket, 'ip': chunk['ip'].to_numpy()}) \
+            .drop_duplicates().groupby('bucket').size()
+        total = total.add(part, fill_value=0).astype(np.int64)
+    return total
+
+
+def reduce_to_interval(minutes, pairs, interval_minutes):
+    """
+    Сворачивает минутные агрегаты в интервалы interval_minutes.
+
+    Суммы складываются, а unique_ips считается по парам (интервал, ip),
+    поэтому результат совпадает с detect_anomalies на сырых данных.
+
+    Возвращает:
+    pd.DataFrame: time_interval, requests, unique_ips, bot_ratio, bot_count, human_count
+    """
+    bucket = floor_ms(minutes.index.to_numpy(), interval_minutes)
+    sums = minutes.groupby(bucket).sum()
+    unique_ips = unique_ips_per_interval(pairs, interval_minutes)
+
+    return pd.DataFrame({
+        'time_interval': to_datetime(sums.index.to_numpy()),
+        'requests': sums['requests'].to_numpy(),
+        'unique_ips': unique_ips.reindex(sums.index, fill_value=0).to_numpy(),
+        'bot_ratio': sums['bot_count'].to_numpy() / sums['rows'].to_numpy(),
+        'bot_count': sums['bot_count'].to_numpy(),
+        'human_count': (sums['rows'] - sums['bot_count']).to_numpy(),
+        'interval_ms': sums.index.to_numpy(),
+    })
+
+
+def _score_interval(interval_minutes, features, random_state=42):
+    """Обучает одну модель и возвращает score_samples (порог зависит только от contamination)"""
+    model = IsolationForest(random_state=random_state)
+    model.fit(features)
+    return interval_minutes, model.score_samples(features)
+
+
+def anomaly_mask(scores, contamination):
+    """
+    Метки аномалий для заданного contamination по уже посчитанным оценкам.
+
+    IsolationForest(contamination=c) строит те же деревья и лишь ставит порог
+    offset_ = percentile(score_samples, 100 * c), поэтому одна модель на интервал
+    дает метки сразу для всей сетки contamination.
+    """
+    return scores < np.percentile(scores, 100.0 * contamination)
+
+
+def _anomalous_minutes(interval_ms, mask, interval_minutes):
+    """Множество минут, покрытых аномальными интервалами"""
+    starts = interval_ms[mask]
+    offsets = np.arange(interval_minutes, dtype=np.int64) * MS_PER_MINUTE
+    return np.unique((starts[:, None] + offsets[None, :]).ravel())
+
+
+def run_sweep(minutes, pairs, intervals=DEFAULT_INTERVALS,
+              contaminations=DEFAULT_CONTAMINATIONS, n_jobs=-1, reference=REFERENCE):
+    """
+    Перебор сетки (интервал, contamination) на общих минутных агрегатах.
+
+    Модели для разных интервалов обучаются параллельно (joblib).
+
+    Параметры:
+    minutes, pairs: Результат base_aggregates / merge_base / load_base_aggregates
+    intervals (tuple): Интервалы агрегации в минутах
+    contaminations (tuple): Уровни загрязнения
+    n_jobs (int): Число процессов joblib (-1 - все ядра)
+    reference (tuple): Конфигурация, с которой сравнивается пересечение
+
+    Возвращает:
+    tuple: (pd.DataFrame сравнения, dict {(интервал, contamination): activity})
+    """
+    activities = {interval: reduce_to_interval(minutes, pairs, interval) for interval in intervals}
+    scored = Parallel(n_jobs=n_jobs)(
+        delayed(_score_interval)(interval, activity[['requests', 'unique_ips']])
+        for interval, activity in activities.items()
+    )
+
+    results = {}
+    covered = {}
+    for interval, scores in scored:
+        for contamination in contaminations:
+            activity = activities[interval].copy()
+            activity['is_anomaly'] = anomaly_mask(scores, contamination)
+            results[(interval, contamination)] = activity
+            covered[(interval, contamination)] = _anomalous_minutes(
+                activity['interval_ms'].to_numpy(), activity['is_anomaly'].to_numpy(), interval)
+
+    reference = reference if reference in covered else next(iter(covered))
+    reference_minutes = covered[reference]
+
+    rows = []
+    for (interval, contamination), activity in results.items():
+        minutes_set = covered[(interval, contamination)]
+        common = len(np.intersect1d(minutes_set, reference_minutes, assume_unique=True))
+        union = len(minutes_set) + len(reference_minutes) - common
+        rows.append({
+            'interval_minutes': interval,
+            'contamination': contamination,
+            'intervals': len(activity),
+            'anomalies': int(activity['is_anomaly'].sum()),
+            'anomalous_minutes': len(minutes_set),
+            'jaccard_vs_reference': common / union if union else 1.0,
+            'share_in_reference': common / len(minutes_set) if len(minutes_set) else 0.0,
+        })
+
+    comparison = pd.DataFrame(rows).sort_values(['interval_minutes', 'contamination'], ignore_index=True)
+    return comparison, results
+
+
+def load_base_aggregates(folder_path, prefetch=2, checkpoint_dir=None):
+    """
+    Потоково считает минутные агрегаты по всем файлам (сырые данные не объединяются).
+
+    Пары (minute_ms, ip) копятся в ExternalAggregator: если они не помещаются
+    в бюджет памяти, то сбрасываются на диск и читаются частями.
+    Если задан checkpoint_dir, агрегаты каждого файла дописываются в чекпоинт,
+    и повторный запуск дочитывает только новые или изменившиеся файлы
+    (без него в папку данных ничего не пишется).
+
+    Возвращает:
+    tuple: (pd.DataFrame по минутам, ExternalAggregator пар)
+    """
+    files = list_data_files(folder_path) if isinstance(folder_path, str) else list(folder_path)
+    if not files:
+        raise ValueError("Не удалось загрузить ни одного файла")
+    checkpoint, parts = None, None
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(checkpoint_dir, 'base_aggregates', params={
+            'time_cache': TIME_CACHE_VERSION, 'data_tz': DATA_TZ, 'bot_rules': label_rules()})
+        parts = checkpoint.restore(files)
+        files = checkpoint.pending(files)
+
+    minutes = [] if parts is None else parts['minutes']
+    pairs = ExternalAggregator(['ip', 'minute_ms'], {'rows': 'sum'})
+    for file_pairs in [] if parts is None else parts['pairs']:
+        pairs.add(file_pairs.assign(rows=1))
+    # Агрегаты текущего файла (большой файл приходит несколькими row groups)
+    file_minutes, file_pairs = [], []
+
+    def commit(file_path):
+        day_minutes = pd.concat(file_minutes).groupby(level=0).sum()
+        day_pairs = pd.concat(file_pairs, ignore_index=True).drop_duplicates(ignore_index=True)
+        minutes.append(day_minutes)
+        if checkpoint is not None:
+            checkpoint.commit(file_path, {}, append={'minutes': day_minutes, 'pairs': day_pairs})
+        file_minutes.clear()
+        file_pairs.clear()
+
+    current = None
+    for file, df in iter_data_files(files, columns=['ts', 'ip'], prefetch=prefetch,
+                                    row_groups='auto', derive_time=True, derive_bots=True):
+        if current is not None and file != current:
+            commit(current)
+        current = file
+        chunk_minutes, chunk_pairs = base_aggregates(df)
+        file_minutes.append(chunk_minutes)
+        file_pairs.append(chunk_pairs)
+        pairs.add(chunk_pairs.assign(rows=1))
+    if current is not None:
+        commit(current)
+
+    if not minutes:
+        raise ValueError("Не удалось загрузить ни одного файла")
+    return pd.concat(minutes).groupby(level=0).sum(), pairs
+
+
+def main():
+    from google.colab import drive
+    drive.mount('/content/drive', force_remount=True)
+
+    folder_path = input("Введите путь к папке с данными (например: /content/drive/MyDrive/dataset): ").strip()
+    minutes, pairs = load_base_aggregates(folder_path)
+    with pairs:
+        comparison, _ = run_sweep(minutes, pairs)
+
+    print("\nСравнение конфигураций Isolation Forest "
+          f"(пересечение - с интервалом {REFERENCE[0]} мин и contamination {REFERENCE[1]}):")
+    print(comparison.to_string(index=False))
+
+    output_folder = os.path.join(os.path.dirname(folder_path), "anomaly_results")
+    os.makedirs(output_folder, exist_ok=True)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    path = f"{output_folder}/isolation_sweep_{timestamp}.csv"
+    comparison.to_csv(path, index=False)
+    print(f"\nТаблица сохранена в: {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,186 @@
+import os
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Numba - необязательная зависимость: без нее используются векторные версии NumPy
+try:
+    import numba
+    HAVE_NUMBA = True
+except ImportError:
+    numba = None
+    HAVE_NUMBA = False
+
+# Выбор реализации: auto (numba, если установлена), numba или numpy
+ENV_VAR = 'DATA_OUTLIERS_KERNELS'
+BACKENDS = ('auto', 'numba', 'numpy')
+
+_backend = None
+
+
+def set_backend(name):
+    """Выбирает реализацию ядер для всего процесса (None - по переменной окружения)"""
+    global _backend
+    if name is not None and name not in BACKENDS:
+        raise ValueError(f"Неизвестная реализация ядер: {name}. Допустимо: {', '.join(BACKENDS)}")
+    if name == 'numba' and not HAVE_NUMBA:
+        raise ImportError("Numba не установлена: pip install numba или set_backend('numpy')")
+    _backend = name
+
+
+def get_backend():
+    """Реализация, которая будет использована: 'numba' или 'numpy'"""
+    name = _backend or os.environ.get(ENV_VAR, 'auto')
+    if name == 'numpy' or not HAVE_NUMBA:
+        return 'numpy'
+    return 'numba'
+
+
+# Циклические версии: компилируются Numba; без нее не вызываются
+
+def _grouped_diffs_loop(groups, values):
+    n = len(groups)
+    position = np.zeros(n, dtype=np.int64)
+    prev = np.zeros(n, dtype=np.int64)
+    has_prev = np.zeros(n, dtype=np.bool_)
+    for i in range(1, n):
+        if groups[i] == groups[i - 1]:
+            position[i] = position[i - 1] + 1
+            prev[i] = values[i - 1]
+            has_prev[i] = True
+    return position, prev, has_prev
+
+
+def _rolling_max_loop(values, window):
+    # Монотонная очередь индексов: O(n) независимо от ширины окна
+    n = len(values)
+    out = np.empty(n, dtype=np.float64)
+    queue = np.empty(n, dtype=np.int64)
+    head, tail = 0, 0
+    for i in range(n):
+        while tail > head and values[queue[tail - 1]] <= values[i]:
+            tail -= 1
+        queue[tail] = i
+        tail += 1
+        if queue[head] <= i - window:
+            head += 1
+        out[i] = values[queue[head]]
+    return out
+
+
+def _stab_intervals_loop(starts, ends, points, max_duration):
+    n = len(points)
+    lo = np.searchsorted(starts, points - max_duration, side='left')
+    hi = np.searchsorted(starts, points, side='right')
+    total = 0
+    for q in range(n):
+        for c in range(lo[q], hi[q]):
+            if ends[c] >= points[q]:
+                total += 1
+    query = np.empty(total, dtype=np.int64)
+    candidate = np.empty(total, dtype=np.int64)
+    k = 0
+    for q in range(n):
+        for c in range(lo[q], hi[q]):
+            if ends[c] >= points[q]:
+                query[k] = q
+                candidate[k] = c
+                k += 1
+    return query, candidate
+
+
+if HAVE_NUMBA:
+    _grouped_diffs_numba = numba.njit(cache=True)(_grouped_diffs_loop)
+    _rolling_max_numba = numba.njit(cache=True)(_rolling_max_loop)
+    _stab_intervals_numba = numba.njit(cache=True)(_stab_intervals_loop)
+
+
+def grouped_diffs(groups, values):
+    """
+    Соседние разности внутри групп подряд идущих строк.
+
+    Параметры:
+    groups (array-like): Коды групп, строки одной группы идут подряд
+    values (array-like): int64 значения (например, номера просмотров)
+
+    Возвращает:
+    tuple: (position - номер строки в группе, prev - предыдущее значение в
+            группе (0 для первой строки), has_prev - есть ли предыдущее)
+    """
+    groups = np.ascontiguousarray(groups, dtype=np.int64)
+    values = np.ascontiguousarray(values, dtype=np.int64)
+    if get_backend() == 'numba':
+        return _grouped_diffs_numba(groups, values)
+
+    n = len(groups)
+    starts = np.ones(n, dtype=bool)
+    starts[1:] = groups[1:] != groups[:-1]
+    group_start = np.maximum.accumulate(np.where(starts, np.arange(n), 0))
+    position = np.arange(n, dtype=np.int64) - group_start
+    prev = np.zeros(n, dtype=np.int64)
+    prev[1:] = values[:-1]
+    prev[starts] = 0
+    return position, prev, ~starts
+
+
+def rolling_max(values, window):
+    """Максимум по окну из window последних значений (включая текущее), float64"""
+    values = np.ascontiguousarray(values, dtype=np.float64)
+    if window < 1:
+        raise ValueError("Ширина окна должна быть не меньше 1")
+    if get_backend() == 'numba':
+        return _rolling_max_numba(values, window)
+    if not len(values):
+        return values
+    padded = np.concatenate([np.full(window - 1, -np.inf), values])
+    return sliding_window_view(padded, window).max(axis=1)
+
+
+def local_maxima(values, order):
+    """
+    Строгие локальные максимумы в окрестности order точек с каждой стороны.
+
+    Совпадает с scipy.signal.argrelextrema(values, np.greater, order=order)
+    (mode='clip': у краев окрестность обрезается, крайние точки не максимумы).
+
+    Возвращает:
+    np.ndarray: Индексы максимумов
+    """
+    values = np.asarray(values, dtype=np.float64)
+    n = len(values)
+    if n < 3:
+        return np.zeros(0, dtype=np.int64)
+    # left[i] - максимум order значений слева от i, right[i] - справа
+    left = np.concatenate([[np.inf], rolling_max(values, order)[:-1]])
+    right = np.concatenate([rolling_max(values[::-1], order)[::-1][1:], [np.inf]])
+    return np.flatnonzero((values > left) & (values > right))
+
+
+def stab_intervals(starts, ends, points, max_duration):
+    """
+    Все пары (точка, интервал) с start <= точка <= end.
+
+    Параметры:
+    starts (np.ndarray): int64 начала интервалов, отсортированные по возрастанию
+    ends (np.ndarray): int64 концы интервалов в том же порядке
+    points (array-like): int64 точки запроса
+    max_duration (int): Наибольшая длина интервала (ограничивает окно поиска)
+
+    Возвращает:
+    tuple: (np.ndarray номеров точек, np.ndarray номеров интервалов в starts),
+           по возрастанию точки, затем интервала
+    """
+    starts = np.ascontiguousarray(starts, dtype=np.int64)
+    ends = np.ascontiguousarray(ends, dtype=np.int64)
+    points = np.ascontiguousarray(points, dtype=np.int64)
+    if get_backend() == 'numba':
+        return _stab_intervals_numba(starts, ends, points, max_duration)
+
+    lo = np.searchsorted(starts, points - max_duration, side='left')
+    hi = np.searchsorted(starts, points, side='right')
+    lengths = hi - lo
+    query = np.repeat(np.arange(len(points)), lengths)
+    offsets = np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+    candidate = np.repeat(lo, lengths) + offsets
+    hit = ends[candidate] >= points[query]
+    return query[hit], candidate[hit]
@@ -0,0 +1,261 @@
+import os
+import re
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+# Бюджет памяти задается аргументом --max-memory, переменной окружения или
+# по умолчанию - половина физической памяти машины
+ENV_VAR = 'DATA_OUTLIERS_MAX_MEMORY'
+DEFAULT_SHARE = 0.5
+# Доля бюджета на один загружаемый блок (файл или row group)
+BATCH_SHARE = 0.25
+# Доля бюджета на буфер частичных агрегатов до сброса на диск
+SPILL_SHARE = 0.25
+# Накладные расходы pandas на строку в object-столбце (сам объект str)
+STRING_OVERHEAD = 50
+# Строк в row group файлов сброса: чем меньше, тем точнее выборка по диапазону
+RUN_ROW_GROUP = 64_000
+
+_UNITS = {'': 1, 'B': 1, 'K': 1 << 10, 'KB': 1 << 10, 'M': 1 << 20, 'MB': 1 << 20,
+          'G': 1 << 30, 'GB': 1 << 30, 'T': 1 << 40, 'TB': 1 << 40}
+
+_budget = None
+
+
+def parse_size(value):
+    """'4GB', '512M', '1.5G' или число байт -> байты"""
+    if isinstance(value, (int, np.integer)):
+        return int(value)
+    match = re.fullmatch(r'\s*([\d.]+)\s*([KMGT]?B?)\s*', str(value).upper())
+    if not match:
+        raise ValueError(f"Неверный размер памяти: {value}. Пример: 4GB, 512MB")
+    return int(float(match.group(1)) * _UNITS[match.group(2)])
+
+
+def physical_memory():
+    try:
+        return os.sysconf('SC_PAGE_SIZE') * os.sysconf('SC_PHYS_PAGES')
+    except (ValueError, OSError, AttributeError):
+        return 8 << 30
+
+
+def set_memory_budget(value):
+    """Устанавливает бюджет для всего процесса (None - сбросить к значению по умолчанию)"""
+    global _budget
+    _budget = None if value is None else parse_size(value)
+
+
+def memory_budget():
+    """Текущий бюджет памяти в байтах"""
+    if _budget is not None:
+        return _budget
+    if os.environ.get(ENV_VAR):
+        return parse_size(os.environ[ENV_VAR])
+    return int(physical_memory() * DEFAULT_SHARE)
+
+
+def add_memory_argument(parser):
+    """Добавляет --max-memory в argparse; значение применяется через apply_memory_argument"""
+    parser.add_argument('--max-memory', default=None,
+                        help=f"Бюджет памяти (например, 4GB); по умолчанию ${ENV_VAR} или половина RAM")
+
+
+def apply_memory_argument(args):
+    if getattr(args, 'max_memory', None):
+        set_memory_budget(args.max_memory)
+
+
+def format_size(n_bytes):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if abs(n_bytes) < 1024:
+            return f"{n_bytes:.1f} {unit}"
+        n_bytes /= 1024
+    return f"{n_bytes:.1f} TB"
+
+
+def estimate_bytes(files, columns=None, row_group=None):
+    """
+    Оценка памяти под DataFrame по метаданным parquet (без чтения данных).
+
+    Берется несжатый размер выбранных столбцов плюс накладные расходы
+    на строковые объекты pandas.
+    """
+    total = 0
+    for file_path in files:
+        metadata = pq.ParquetFile(file_path).metadata
+        groups = range(metadata.num_row_groups) if row_group is None else [row_group]
+        for i in groups:
+            group = metadata.row_group(i)
+            for j in range(group.num_columns):
+                column = group.column(j)
+                name = column.path_in_schema.split('.')[0]
+                if columns is not None and name not in columns:
+                    continue
+                total += column.total_uncompressed_size
+                if column.physical_type == 'BYTE_ARRAY':
+                    total += group.num_rows * STRING_OVERHEAD
+    return total
+
+
+def fits_in_memory(files, columns=None, share=DEFAULT_SHARE, row_groups=None):
+    """
+    Поместятся ли все файлы в share бюджета одним DataFrame (с учетом копий при обработке).
+    row_groups - {файл: [номера]}: учитываются только перечисленные row groups.
+    """
+    if row_groups is None:
+        return estimate_bytes(files, columns) <= memory_budget() * share
+    size = sum(estimate_bytes([file_path], columns, i)
+               for file_path, groups in row_groups.items() for i in groups)
+    return size <= memory_budget() * share
+
+
+def batch_bytes():
+    """Сколько байт можно загрузить за один раз"""
+    return int(memory_budget() * BATCH_SHARE)
+
+
+def batch_rows(bytes_per_row, share=BATCH_SHARE):
+    """Размер пакета в строках для заданного размера строки"""
+    return max(1, int(memory_budget() * share // max(bytes_per_row, 1)))
+
+
+class ExternalAggregator:
+    """
+    Группировка по ключу с ограниченной памятью (sum/min/max по столбцам).
+
+    Частичные агрегаты копятся в памяти; когда буфер превышает свою долю
+    бюджета, он сортируется по ключу и сбрасывается на диск отдельным
+    «прогоном» (run). Итог сливается внешне: ключи делятся на диапазоны по
+    первому ключевому столбцу так, чтобы каждый диапазон из всех прогонов
+    помещался в память, и каждый диапазон агрегируется отдельно.
+
+    Пример:
+        agg = ExternalAggregator(['ip'], {'requests': 'sum', 'last_seen': 'max'})
+        for df in files: agg.add(df.groupby('ip').agg(...).reset_index())
+        for chunk in agg.iter_results(): ...
+    """
+
+    def __init__(self, keys, aggs, budget_bytes=None, tmp_dir=None):
+        self.keys = list(keys)
+        self.aggs = dict(aggs)
+        self.budget_bytes = budget_bytes or int(memory_budget() * SPILL_SHARE)
+        self.tmp_dir = tmp_dir
+        self._buffer = []
+        self._buffer_bytes = 0
+        self._runs = []
+        self._run_dir = None
+
+    def _reduce(self, frame):
+        return frame.groupby(self.keys, sort=False, observed=True).agg(self.aggs)
+
+    def add(self, df):
+        """Добавляет строки (ключи и значения); ключи могут повторяться"""
+        if df.empty:
+            return self
+        partial = self._reduce(df[self.keys + list(self.aggs)])
+        self._buffer.append(partial)
+        self._buffer_bytes += int(partial.memory_usage(deep=True, index=True).sum())
+        if self._buffer_bytes > self.budget_bytes:
+            self._compact()
+            if self._buffer_bytes > self.budget_bytes // 2:
+                self._spill()
+        return self
+
+    def _compact(self):
+        if len(self._buffer) > 1:
+            merged = self._reduce(pd.concat(self._buffer).reset_index())
+            self._buffer = [merged]
+            self._buffer_bytes = int(merged.memory_usage(deep=True, index=True).sum())
+
+    def _spill(self):
+        """Сбрасывает буфер на диск отсортированным прогоном"""
+        if not self._buffer:
+            return
+        if self._run_dir is None:
+            self._run_dir = tempfile.mkdtemp(prefix='spill_', dir=self.tmp_dir)
+        run = self._reduce(pd.concat(self._buffer).reset_index()).sort_index().reset_index()
+        path = os.path.join(self._run_dir, f'run_{len(self._runs):05d}.parquet')
+        pq.write_table(pa.Table.from_pandas(run, preserve_index=False), path, row_group_size=RUN_ROW_GROUP)
+        self._runs.append(path)
+        self._buffer, self._buffer_bytes = [], 0
+
+    @property
+    def spilled(self):
+        """Сколько прогонов сброшено на диск"""
+        return len(self._runs)
+
+    def _boundaries(self):
+        """Границы диапазонов первого ключа по статистике row group прогонов"""
+        key = self.keys[0]
+        marks = []
+        for path in self._runs:
+            parquet_file = pq.ParquetFile(path)
+            index = parquet_file.schema_arrow.get_field_index(key)
+            for i in range(parquet_file.metadata.num_row_groups):
+                group = parquet_file.metadata.row_group(i)
+                stats = group.column(index).statistics
+                if stats is not None and stats.has_min_max:
+                    marks.append((stats.min, group.total_byte_size))
+        if not marks:
+            return []
+        marks.sort(key=lambda mark: mark[0])
+        # Каждый диапазон - примерно половина буфера в байтах по всем прогонам
+        limit = max(self.budget_bytes // 2, 1)
+        boundaries, size = [], 0
+        for value, n_bytes in marks:
+            if size + n_bytes > limit and (not boundaries or value != boundaries[-1]):
+                boundaries.append(value)
+                size = 0
+            size += n_bytes
+        return boundaries
+
+    def iter_results(self):
+        """
+        Итоговые агрегаты частями (по диапазонам первого ключа, по возрастанию).
+
+        Возвращает:
+        generator: pd.DataFrame с ключами в индексе
+        """
+        if not self._runs:
+            if self._buffer:
+                yield self._reduce(pd.concat(self._buffer).reset_index()).sort_index()
+            return
+        self._spill()
+        key = self.keys[0]
+        edges = [None] + self._boundaries() + [None]
+        for lo, hi in zip(edges[:-1], edges[1:]):
+            filters = []
+            if lo is not None:
+                filters.append((key, '>=', lo))
+            if hi is not None:
+                filters.append((key, '<', hi))
+            parts = [pq.read_table(path, filters=filters or None).to_pandas() for path in self._runs]
+            frame = pd.concat(parts, ignore_index=True)
+            if not frame.empty:
+                yield self._reduce(frame).sort_index()
+
+    def result(self):
+        """Все агрегаты одним DataFrame (только если итог заведомо мал)"""
+        chunks = list(self.iter_results())
+        if not chunks:
+            return pd.DataFrame(columns=list(self.aggs))
+        return pd.concat(chunks)
+
+    def close(self):
+        """Удаляет файлы прогонов"""
+        if self._run_dir is not None:
+            shutil.rmtree(self._run_dir, ignore_errors=True)
+            self._run_dir = None
+        self._runs = []
+        self._buffer, self._buffer_bytes = [], 0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
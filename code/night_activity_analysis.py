@@ -1,11 +1,22 @@
-from google.colab import drive
 import pandas as pd
 import matplotlib.pyplot as plt
 import numpy as np
 from IPython.display import display
-import glob
 import os
 from datetime import datetime
+from data_loader import iter_data_files, list_data_files
+from dataset_catalog import catalog_overview, format_unique_ips, load_catalog, print_profile
+from memory_budget import ExternalAggregator, estimate_bytes, fits_in_memory, format_size, memory_budget
+from sharding import DEFAULT_SHARDS, ROW_COLUMN, ShardWriter, map_frame, map_shards, night_ip_anomalies
+from topk_sketch import TopKWindows
+
+# Сколько файлов читать наперед, пока обрабатывается текущий
+PREFETCH_DEPTH = 2
+NIGHT_PERIOD = "ночной период (00:00-07:00)"
+# Столбцы для потокового режима (без них сводка не зависит от ширины выгрузки)
+SUMMARY_COLUMNS = ['ts', 'ip', 'ua_is_bot', 'ua_header']
+# Ночные строки в шардах: ключевые столбцы деталей аномалий
+NIGHT_SHARD_COLUMNS = ['ts', 'ip', 'is_bot', 'hour', 'minute', 'ua_header']
 
 def get_user_input():
     """Функция для получения пользовательского ввода с валидацией"""
@@ -42,63 +53,81 @@ def get_user_input():
     
     return path, target_date, target_hour
 
-def load_all_data(folder_path):
-    """Загрузка всех файлов данных с обработкой ua_is_bot"""
-    all_files = sorted(glob.glob(f"{folder_path}/data_2024-10-*.parquet"))
-    if not all_files:  # Альтернативный вариант поиска
-        all_files = sorted(glob.glob(f"{folder_path}/*.parquet"))
-    
+def load_all_data(folder_path, prefetch=PREFETCH_DEPTH, ip_windows=None):
+    """
+    Загрузка всех файлов данных с метками ботов (с упреждающим чтением).
+    Если передан ip_windows (TopKWindows), в него добавляются IP каждого файла.
+    """
     dfs = []
-    for file in all_files:
-        try:
-            df = pd.read_parquet(file)
-            df['ts'] = pd.to_datetime(df['ts'])
-            df['date'] = df['ts'].dt.date
-            df['hour'] = df['ts'].dt.hour
-            df['minute'] = df['ts'].dt.minute
-            
-            # Преобразование ua_is_bot в bool
-            if 'ua_is_bot' in df.columns:
-                df['is_bot'] = df['ua_is_bot'].fillna(0).astype(bool)
-            else:
-                df['is_bot'] = False
-                
-            dfs.append(df)
-            print(f"Успешно загружен: {file.split('/')[-1]}")
-        except Exception as e:
-            print(f"Ошибка при загрузке {file}: {e}")
+    # ts, date, hour и minute считаются при загрузке в московском времени,
+    # is_bot - единый разбор ua_is_bot из bot_labels (как в остальных детекторах)
+    for file, df in iter_data_files(folder_path, prefetch=prefetch, derive_time=True, derive_bots=True):
+        if ip_windows is not None:
+            ip_windows.add(df['ts_ms'], df['ip'])
+        dfs.append(df)
     
     if not dfs:
         raise ValueError("Не удалось загрузить ни одного файла")
     return pd.concat(dfs, ignore_index=True)
 
-def extended_analysis(df, folder_path):
-    """Расширенный анализ данных"""
+def ip_windows_for(df):
+    """Скетчи топ-IP по минутам/часам/суткам для уже загруженных данных"""
+    return TopKWindows().add(df['ts_ms'], df['ip'])
+
+def extended_tables(df, catalog_summary=None):
+    """
+    Таблицы расширенного анализа (в потоковом режиме собираются по файлам).
+    Объем, период и уникальные IP берутся из сводки каталога catalog_summary,
+    если она есть и эти значения в ней известны.
+    """
+    tables = catalog_overview(catalog_summary)
+    if 'rows' not in tables:
+        tables['rows'] = len(df)
+    if 'date_min' not in tables:
+        tables['date_min'], tables['date_max'] = df['date'].min(), df['date'].max()
+    if 'unique_ips' not in tables:
+        tables['unique_ips'] = df['ip'].nunique()
+    tables.update({
+        'bots': int(df['is_bot'].sum()),
+        'daily_stats': df.groupby('date').agg(
+            requests=('ip', 'size'),
+            unique_ips=('ip', 'nunique'),
+            bots=('is_bot', 'sum')
+        ),
+        'hourly_stats': df.groupby('hour').agg(
+            requests=('ip', 'size'),
+            unique_ips=('ip', 'nunique'),
+            bot_percentage=('is_bot', 'mean')
+        ),
+    })
+    return tables
+
+def extended_analysis(df, folder_path, ip_windows=None, catalog_summary=None):
+    """Расширенный анализ данных (топ IP берется из скетчей ip_windows, объем и период - из каталога)"""
+    if ip_windows is None:
+        ip_windows = ip_windows_for(df)
+    report_extended(extended_tables(df, catalog_summary), ip_windows)
+
+def report_extended(tables, ip_windows):
+    """Печать и графики расширенного анализа по готовым таблицам"""
     print("\n" + "="*50)
     print("Расширенный анализ данных")
     print("="*50)
     
     # 1. Общая статистика
-    print(f"\nВсего записей: {len(df):,}")
-    print(f"Период данных: {df['date'].min()} - {df['date'].max()}")
-    print(f"Уникальных IP: {df['ip'].nunique():,}")
-    print(f"Боты: {df['is_bot'].sum():,} ({df['is_bot'].mean():.1%})")
+    rows, bots = tables['rows'], tables['bots']
+    print(f"\nВсего записей: {rows:,}")
+    print(f"Период данных: {tables['date_min']:%Y-%m-%d} - {tables['date_max']:%Y-%m-%d}")
+    print(f"Уникальных IP: {format_unique_ips(tables['unique_ips'])}")
+    print(f"Боты: {bots:,} ({bots / rows:.1%})")
     
     # 2. Суточная активность
-    daily_stats = df.groupby('date').agg(
-        requests=('ip', 'size'),
-        unique_ips=('ip', 'nunique'),
-        bots=('is_bot', 'sum')
-    )
+    daily_stats = tables['daily_stats']
     print("\nСуточная статистика:")
     display(daily_stats)
     
     # 3. Почасовой анализ
-    hourly_stats = df.groupby('hour').agg(
-        requests=('ip', 'size'),
-        unique_ips=('ip', 'nunique'),
-        bot_percentage=('is_bot', 'mean')
-    )
+    hourly_stats = tables['hourly_stats']
     print("\nСредняя активность по часам:")
     display(hourly_stats)
     
@@ -121,44 +150,61 @@ def extended_analysis(df, folder_path):
     
     # График 3: Распределение ботов
     plt.subplot(2, 2, 3)
-    df['is_bot'].value_counts().plot(kind='pie', autopct='%1.1f%%', 
-                                   colors=['green', 'red'], 
-                                   labels=['Люди', 'Боты'])
+    pd.Series({False: rows - bots, True: bots}).sort_values(ascending=False).plot(
+        kind='pie', autopct='%1.1f%%', colors=['green', 'red'], labels=['Люди', 'Боты'])
     plt.title('Распределение запросов')
     
     # График 4: Топ IP
     plt.subplot(2, 2, 4)
-    top_ips = df['ip'].value_counts().head(10)
-    top_ips.plot(kind='barh', color='purple', alpha=0.7)
-    plt.title('Топ-10 самых активных IP')
+    top_ips = ip_windows.top(10)
+    top_ips['count'].plot(kind='barh', xerr=top_ips['error'], color='purple', alpha=0.7)
+    plt.title('Топ-10 самых активных IP (с погрешностью оценки)')
     plt.xlabel('Количество запросов')
     
     plt.tight_layout()
     plt.show()
 
-def analyze_night_activity(df, folder_path):
+def night_tables(night_data):
+    """Таблицы ночного анализа (в потоковом режиме собираются по файлам)"""
+    return {
+        'rows': len(night_data),
+        'unique_ips': night_data['ip'].nunique(),
+        'bots': int(night_data['is_bot'].sum()),
+        'hour_stats': night_data.groupby('hour').agg(
+            ips=('ip', 'nunique'),
+            requests=('ip', 'size'),
+            bots=('is_bot', 'sum')
+        ),
+        'date_counts': night_data['date'].value_counts().sort_index(),
+    }
+
+def analyze_night_activity(df, folder_path, n_workers=1):
     """Анализ ночной активности (00:00-07:00)"""
+    night_data = df[df['hour'].between(0, 7)]
+    if not report_night(night_tables(night_data)):
+        return
+    
+    # Анализ аномалий
+    analyze_anomalies(night_data, NIGHT_PERIOD, folder_path, n_workers)
+
+def report_night(tables):
+    """Печать и графики ночного анализа; False - если ночных данных нет"""
     print("\n" + "="*50)
     print("Анализ ночной активности (00:00 - 07:00)")
     print("="*50)
     
-    night_data = df[df['hour'].between(0, 7)]
-    
-    if night_data.empty:
+    if not tables['rows']:
         print("\nНет данных за ночной период")
-        return
+        return False
     
     # Общая статистика
-    print(f"\nВсего событий за ночь: {len(night_data):,}")
-    print(f"Уникальных IP: {night_data['ip'].nunique():,}")
-    print(f"Запросов от ботов: {night_data['is_bot'].sum():,} ({night_data['is_bot'].mean():.1%})")
+    rows, bots = tables['rows'], tables['bots']
+    print(f"\nВсего событий за ночь: {rows:,}")
+    print(f"Уникальных IP: {tables['unique_ips']:,}")
+    print(f"Запросов от ботов: {bots:,} ({bots / rows:.1%})")
     
     # Анализ по часам
-    hour_stats = night_data.groupby('hour').agg(
-        ips=('ip', 'nunique'),
-        requests=('ip', 'size'),
-        bots=('is_bot', 'sum')
-    )
+    hour_stats = tables['hour_stats']
     print("\nАктивность по часам:")
     display(hour_stats)
     
@@ -170,21 +216,19 @@ def analyze_night_activity(df, folder_path):
     plt.xlabel('Час ночи')
     
     plt.subplot(1, 2, 2)
-    night_data['date'].value_counts().sort_index().plot(kind='bar', color='darkblue')
+    tables['date_counts'].plot(kind='bar', color='darkblue')
     plt.title('Распределение по дням')
     plt.tight_layout()
     plt.show()
-    
-    # Анализ аномалий
-    analyze_anomalies(night_data, "ночной период (00:00-07:00)", folder_path)
+    return True
 
-def analyze_specific_hour(df, target_date, target_hour, folder_path):
-    """Анализ конкретного часа в конкретную дату"""
+def analyze_specific_hour(df, target_date, target_hour, folder_path, ip_windows=None):
+    """Анализ конкретного часа в конкретную дату (топ IP - слиянием минутных скетчей)"""
     print("\n" + "="*50)
     print(f"Анализ активности {target_date} в {target_hour}:00")
     print("="*50)
     
-    hour_data = df[(df['date'] == pd.to_datetime(target_date).date()) & 
+    hour_data = df[(df['date'] == pd.to_datetime(target_date)) & 
                  (df['hour'] == target_hour)]
     
     if hour_data.empty:
@@ -198,10 +242,16 @@ def analyze_specific_hour(df, target_date, target_hour, folder_path):
     print(f"Средняя активность: {len(hour_data)/hour_data['ip'].nunique():.1f} запросов/IP")
     
     # Топ активных IP
-    ip_stats = hour_data.groupby('ip').agg(
-        requests=('ip', 'size'),
-        is_bot=('is_bot', 'max')
-    ).sort_values('requests', ascending=False).head(10)
+    if ip_windows is None:
+        ip_windows = ip_windows_for(hour_data)
+    hour_start = pd.Timestamp(target_date) + pd.Timedelta(hours=target_hour)
+    top_ips = ip_windows.top(10, hour_start, hour_start + pd.Timedelta(hours=1))
+    top_data = hour_data[hour_data['ip'].isin(top_ips.index)]
+    ip_stats = pd.DataFrame({
+        'requests': top_ips['count'],
+        'error': top_ips['error'],
+        'is_bot': top_data.groupby('ip')['is_bot'].max().reindex(top_ips.index, fill_value=False)
+    })
     
     print("\nТоп-10 активных IP:")
     display(ip_stats)
@@ -216,56 +266,198 @@ def analyze_specific_hour(df, target_date, target_hour, folder_path):
     # Анализ аномалий
     analyze_anomalies(hour_data, f"{target_date} {target_hour}:00", folder_path)
 
-def save_anomaly_details(full_data, anomalies, period_name, folder_path):
-    """Сохранение деталей аномалий (только ключевые столбцы)"""
-    # Определяем IP с аномалиями
-    anomaly_ips = anomalies['ip'].unique()
-    
-    # Фильтруем исходные данные по этим IP
-    anomaly_data = full_data[full_data['ip'].isin(anomaly_ips)]
-    
-    # Выбираем только нужные столбцы
-    columns_to_save = ['ts', 'ip', 'is_bot', 'hour', 'minute']
-    if 'ua_header' in full_data.columns:
-        columns_to_save.append('ua_header')
-    
-    # Создаем папку для результатов, если ее нет
+def anomaly_file_name(period_name, folder_path):
+    """Путь к CSV с деталями аномалий (папка создается при необходимости)"""
     output_folder = os.path.join(os.path.dirname(folder_path), "anomaly_results")
     if not os.path.exists(output_folder):
         os.makedirs(output_folder)
     
-    # Генерируем имя файла
     timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
     safe_period_name = period_name.replace(" ", "_").replace(":", "").replace("-", "")
-    filename = f"{output_folder}/anomalies_{safe_period_name}_{timestamp}.csv"
+    return f"{output_folder}/anomalies_{safe_period_name}_{timestamp}.csv"
+
+def anomaly_columns(data):
+    """Ключевые столбцы, сохраняемые для аномальных IP"""
+    columns_to_save = ['ts', 'ip', 'is_bot', 'hour', 'minute']
+    if 'ua_header' in data.columns:
+        columns_to_save.append('ua_header')
+    return columns_to_save
+
+def save_anomaly_details(full_data, anomalies, period_name, folder_path):
+    """Сохранение деталей аномалий (только ключевые столбцы)"""
+    # Фильтруем исходные данные по IP с аномалиями
+    anomaly_data = full_data[full_data['ip'].isin(anomalies['ip'].unique())]
     
     # Сохраняем только нужные столбцы
-    anomaly_data[columns_to_save].to_csv(filename, index=False)
+    filename = anomaly_file_name(period_name, folder_path)
+    anomaly_data[anomaly_columns(full_data)].to_csv(filename, index=False)
     print(f"\nДанные аномалий сохранены в: {filename}")
 
-def analyze_anomalies(data, period_name, folder_path):
-    """Обнаружение аномальной активности"""
-    # Группировка данных для выявления аномалий
+def find_anomalies(data, n_workers=1):
+    """
+    IP (отдельно для строк ботов и людей) с >100 запросами.
+    При n_workers > 1 IP считаются по частям (map_frame по хэшу IP) в процессах.
+    """
+    if n_workers > 1:
+        results = map_frame(night_ip_anomalies, data[['ip', 'is_bot']], 'ip', n_workers, columns=[])
+        return pd.concat([anomalies for anomalies, _ in results]).sort_values(['ip', 'is_bot'], ignore_index=True)
     anomalies = data.groupby(['ip', 'is_bot']).size().reset_index(name='requests')
-    anomalies = anomalies[anomalies['requests'] > 100]
-    
-    if not anomalies.empty:
-        print(f"\nОбнаружены аномалии в {period_name}:")
-        print(f"IP с >100 запросами: {len(anomalies)}")
-        print("Распределение:")
-        display(anomalies.groupby('is_bot').agg(
-            count=('ip', 'size'),
-            avg_requests=('requests', 'mean'),
-            max_requests=('requests', 'max')
-        ))
-        
+    return anomalies[anomalies['requests'] > 100]
+
+def report_anomalies(anomalies, period_name):
+    """Печать распределения аномалий; False - если их нет"""
+    if anomalies.empty:
+        print(f"\nАномалий не обнаружено в {period_name}")
+        return False
+    print(f"\nОбнаружены аномалии в {period_name}:")
+    print(f"IP с >100 запросами: {len(anomalies)}")
+    print("Распределение:")
+    display(anomalies.groupby('is_bot').agg(
+        count=('ip', 'size'),
+        avg_requests=('requests', 'mean'),
+        max_requests=('requests', 'max')
+    ))
+    return True
+
+def analyze_anomalies(data, period_name, folder_path, n_workers=1):
+    """Обнаружение аномальной активности"""
+    anomalies = find_anomalies(data, n_workers)
+    if report_anomalies(anomalies, period_name):
         # Сохраняем только ключевые столбцы аномалий
         save_anomaly_details(data, anomalies, period_name, folder_path)
-    else:
-        print(f"\nАномалий не обнаружено в {period_name}")
+
+def _add_counts(total, part):
+    return part if total is None else total.add(part, fill_value=0)
+
+def summarize_files(folder_path, ip_windows, night_shards, prefetch=PREFETCH_DEPTH):
+    """
+    Таблицы extended_tables и night_tables без загрузки всех данных:
+    счетчики по дате/часу складываются по файлам, а уникальные IP считаются
+    по тройкам (ip, date, hour) в ExternalAggregator, который при нехватке
+    памяти сбрасывает их на диск и отдает частями по диапазонам IP.
+    Ночные строки раскладываются по night_shards (ShardWriter по IP)
+    для поиска аномалий.
+
+    Возвращает:
+    tuple: (extended, night)
+    """
+    triples = ExternalAggregator(['ip', 'date', 'hour'], {'requests': 'sum'})
+    daily = hourly = night_hours = date_counts = None
+    rows = bots = night_rows = night_bots = 0
+    date_min = date_max = None
+
+    for file, df in iter_data_files(folder_path, columns=SUMMARY_COLUMNS, prefetch=prefetch,
+                                    row_groups='auto', derive_time=True, derive_bots=True):
+        ip_windows.add(df['ts_ms'], df['ip'])
+        rows += len(df)
+        bots += int(df['is_bot'].sum())
+        date_min = df['date'].min() if date_min is None else min(date_min, df['date'].min())
+        date_max = df['date'].max() if date_max is None else max(date_max, df['date'].max())
+        daily = _add_counts(daily, df.groupby('date').agg(requests=('ip', 'size'), bots=('is_bot', 'sum')))
+        hourly = _add_counts(hourly, df.groupby('hour').agg(requests=('ip', 'size'), bots=('is_bot', 'sum')))
+
+        night = df[df['hour'].between(0, 7)]
+        night_shards.write(night[[c for c in NIGHT_SHARD_COLUMNS if c in night.columns]])
+        night_rows += len(night)
+        night_bots += int(night['is_bot'].sum())
+        night_hours = _add_counts(night_hours, night.groupby('hour').agg(requests=('ip', 'size'),
+                                                                         bots=('is_bot', 'sum')))
+        date_counts = _add_counts(date_counts, night['date'].value_counts())
+
+        known = df[df['ip'].notna()]
+        triples.add(pd.DataFrame({'ip': known['ip'], 'date': known['date'], 'hour': known['hour'], 'requests': 1}))
+
+    if not rows:
+        raise ValueError("Не удалось загрузить ни одного файла")
+
+    # Диапазоны IP не пересекаются, поэтому уникальные IP частей складываются
+    unique_ips = night_ips = 0
+    daily_ips = hourly_ips = pd.Series(dtype=np.int64)
+    with triples:
+        for chunk in triples.iter_results():
+            chunk = chunk.reset_index()
+            unique_ips += chunk['ip'].nunique()
+            daily_ips = _add_counts(daily_ips, chunk.drop_duplicates(['ip', 'date']).groupby('date').size())
+            hourly_ips = _add_counts(hourly_ips, chunk.drop_duplicates(['ip', 'hour']).groupby('hour').size())
+            night_ips += chunk.loc[chunk['hour'] < 8, 'ip'].nunique()
+
+    daily = daily.astype(np.int64)
+    hourly = hourly.astype(np.int64)
+    extended = {
+        'rows': rows, 'date_min': date_min, 'date_max': date_max, 'unique_ips': unique_ips, 'bots': bots,
+        'daily_stats': pd.DataFrame({'requests': daily['requests'],
+                                     'unique_ips': daily_ips.reindex(daily.index, fill_value=0).astype(np.int64),
+                                     'bots': daily['bots']}),
+        'hourly_stats': pd.DataFrame({'requests': hourly['requests'],
+                                      'unique_ips': hourly_ips.reindex(hourly.index, fill_value=0).astype(np.int64),
+                                      'bot_percentage': hourly['bots'] / hourly['requests']}),
+    }
+    night_hours = night_hours.astype(np.int64)
+    night = {
+        'rows': night_rows, 'unique_ips': night_ips, 'bots': night_bots,
+        'hour_stats': pd.DataFrame({'ips': hourly_ips.reindex(night_hours.index, fill_value=0).astype(np.int64),
+                                    'requests': night_hours['requests'], 'bots': night_hours['bots']}),
+        'date_counts': date_counts.astype(np.int64).sort_index(),
+    }
+    return extended, night
+
+def iter_filtered(folder_or_files, condition, prefetch=PREFETCH_DEPTH, row_groups='auto'):
+    """
+    Строки, удовлетворяющие condition(df), по файлам (для второго прохода).
+    row_groups - отбор row groups по каталогу (см. DatasetCatalog.row_groups_in_range)
+    """
+    for file, df in iter_data_files(folder_or_files, prefetch=prefetch, row_groups=row_groups,
+                                    derive_time=True, derive_bots=True):
+        yield df[condition(df)]
+
+def analyze_streaming(folder_path, target_date, target_hour, ip_windows, n_shards=DEFAULT_SHARDS, n_workers=None,
+                      catalog=None):
+    """
+    Тот же анализ по файлам, когда данные не помещаются в бюджет памяти.
+    Ночные аномалии ищутся по шардам IP параллельно в n_workers процессах.
+    С каталогом (dataset_catalog) для анализа часа читаются только row groups,
+    чей диапазон ts пересекает этот час.
+    """
+    with ShardWriter('ip', n_shards) as night_shards:
+        extended, night = summarize_files(folder_path, ip_windows, night_shards)
+        if catalog is not None:
+            extended.update(catalog_overview(catalog.summary()))
+        report_extended(extended, ip_windows)
+
+        if report_night(night):
+            results = map_shards(night_ip_anomalies, night_shards.close(), n_workers,
+                                 columns=NIGHT_SHARD_COLUMNS)
+            # IP шардов не пересекаются: сводки и строки просто объединяются
+            anomalies = pd.concat([anomalies for anomalies, _ in results]) \
+                .sort_values(['ip', 'is_bot'], ignore_index=True)
+            if report_anomalies(anomalies, NIGHT_PERIOD):
+                rows = pd.concat([rows for _, rows in results]).sort_values(ROW_COLUMN)
+                filename = anomaly_file_name(NIGHT_PERIOD, folder_path)
+                rows[anomaly_columns(rows)].to_csv(filename, index=False)
+                print(f"\nДанные аномалий сохранены в: {filename}")
+
+    if target_date is not None and target_hour is not None:
+        # Один час данных заведомо мал - его строки собираются в память
+        day = pd.to_datetime(str(target_date))
+        source, row_groups = folder_path, 'auto'
+        if catalog is not None:
+            hour_start = day + pd.Timedelta(hours=target_hour)
+            row_groups = catalog.row_groups_in_range(hour_start, hour_start + pd.Timedelta(hours=1))
+            source = list(row_groups)
+            print(f"Для анализа часа по каталогу отобрано row groups: "
+                  f"{sum(map(len, row_groups.values()))} из {len(catalog.row_groups)}")
+        parts = list(iter_filtered(source, lambda df: (df['date'] == day) & (df['hour'] == target_hour),
+                                   row_groups=row_groups))
+        if not parts:
+            print(f"\nНет данных за {target_date} {target_hour}:00")
+            return
+        hour_data = pd.concat(parts, ignore_index=True)
+        analyze_specific_hour(hour_data, str(target_date), target_hour, folder_path, ip_windows)
 
 # Основной анализ
 def main():
+    from google.colab import drive
+
     print("Анализ активности пользователей и ботов")
     drive.mount('/content/drive', force_remount=True)
     
@@ -273,28 +465,34 @@ def main():
         # Получаем пользовательский ввод
         folder_path, target_date, target_hour = get_user_input()
         
-        # Загрузка данных
-        df = load_all_data(folder_path)
+        ip_windows = TopKWindows()
+        files = list_data_files(folder_path)
+        # Профиль набора по футерам parquet - до загрузки данных
+        catalog = load_catalog(files, sketches=True)
+        catalog_summary = print_profile(catalog, SUMMARY_COLUMNS)
+        if not fits_in_memory(files):
+            print(f"Данные (~{format_size(estimate_bytes(files))}) больше бюджета памяти "
+                  f"({format_size(memory_budget())}), анализ по файлам")
+            analyze_streaming(folder_path, target_date, target_hour, ip_windows, catalog=catalog)
+            return
+        
+        # Загрузка данных (скетчи топ-IP строятся по ходу чтения файлов)
+        df = load_all_data(folder_path, ip_windows=ip_windows)
         
         # 1. Расширенный анализ
-        extended_analysis(df, folder_path)
+        extended_analysis(df, folder_path, ip_windows, catalog_summary)
         
         # 2. Анализ ночной активности
         analyze_night_activity(df, folder_path)
         
         # 3. Анализ конкретного часа (если указан)
         if target_date is not None and target_hour is not None:
-            analyze_specific_hour(df, str(target_date), target_hour, folder_path)
+            analyze_specific_hour(df, str(target_date), target_hour, folder_path, ip_windows)
         
     except Exception as e:
         print(f"\nОшибка при анализе: {e}")
     finally:
         print("\nАнализ завершен")
 
-if __name__ == "__main__":
-    main()
-    finally:
-        print("\nАнализ завершен")
-
 if __name__ == "__main__":
     main()
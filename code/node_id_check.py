@@ -1,9 +1,15 @@
 import pandas as pd
+import pyarrow.parquet as pq
 import os
 import glob
 from IPython.display import display
-from google.colab import drive
-drive.mount('/content/drive')
+from checkpoint import Checkpoint
+from dataset_catalog import load_catalog, print_profile
+from memory_budget import estimate_bytes, fits_in_memory, format_size, memory_budget
+
+# Столбцы, заполненность которых означает, что у строки должен быть node_id
+REQUIRED_COLUMNS = ['url', 'main_rubric_id', 'content_is_longread',
+                    'content_editor_id', 'content_author_ids', 'title']
 
 def get_user_file_path():
     """Запрашивает путь к файлу/папке у пользователя с проверкой"""
@@ -30,10 +36,25 @@ def get_user_file_path():
             
         return path
 
-def load_data(file_path):
-    """Загружает данные с обработкой ошибок"""
+def data_files(file_path):
+    """Parquet-файлы по пути к файлу или папке"""
+    if os.path.isdir(file_path):
+        return glob.glob(os.path.join(file_path, '*.parquet'))
+    return [file_path]
+
+def load_data(file_path, row_groups=None):
+    """
+    Загружает данные с обработкой ошибок.
+    row_groups - {файл: [номера row groups]}: читаются только они (отбор по каталогу)
+    """
     try:
-        if os.path.isdir(file_path):
+        if row_groups is not None:
+            dfs = [pq.ParquetFile(f).read_row_groups(groups).to_pandas()
+                   for f, groups in row_groups.items()]
+            data = pd.concat(dfs, ignore_index=True)
+            print(f"Загружено row groups: {sum(map(len, row_groups.values()))} "
+                  f"из {len(row_groups)} файлов, всего {len(data)} строк")
+        elif os.path.isdir(file_path):
             # Загрузка всех parquet-файлов из папки
             files = glob.glob(os.path.join(file_path, '*.parquet'))
             dfs = [pd.read_parquet(f) for f in files]
@@ -48,11 +69,14 @@ def load_data(file_path):
         print(f"Ошибка при загрузке данных: {e}")
         return None
 
+def missing_node_id_mask(data, required_columns):
+    """Строки без node_id, у которых заполнен хотя бы один из required_columns"""
+    return data['node_id'].isnull() & data[required_columns].notnull().any(axis=1)
+
 def analyze_missing_node_ids(data):
     """Анализирует строки с отсутствующим node_id"""
     # Условия для проверки
-    required_columns = ['url', 'main_rubric_id', 'content_is_longread', 
-                       'content_editor_id', 'content_author_ids', 'title']
+    required_columns = list(REQUIRED_COLUMNS)
     
     # Проверяем наличие всех требуемых столбцов
     missing_cols = [col for col in required_columns if col not in data.columns]
@@ -61,11 +85,48 @@ def analyze_missing_node_ids(data):
         required_columns = [col for col in required_columns if col in data.columns]
     
     # Фильтрация строк
-    mask = data['node_id'].isnull() & data[required_columns].notnull().any(axis=1)
-    missing_node_id = data[mask]
+    missing_node_id = data[missing_node_id_mask(data, required_columns)]
     
     return missing_node_id, required_columns
 
+def analyze_missing_node_ids_streaming(row_groups, checkpoint_dir=None):
+    """
+    То же, что load_data + analyze_missing_node_ids, когда выбранные row groups
+    не помещаются в бюджет памяти: row groups читаются по одному, в памяти
+    остаются только проблемные строки.
+    С checkpoint_dir проблемные строки каждого файла дописываются в чекпоинт,
+    и повторный запуск читает только новые или изменившиеся файлы.
+    """
+    parts, found_columns = [], set()
+    files = list(row_groups)
+    checkpoint = None
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(checkpoint_dir, 'node_id_check', params={'required_columns': REQUIRED_COLUMNS})
+        restored = checkpoint.restore(files)
+        if restored is not None:
+            parts.extend(restored['missing'])
+            found_columns.update(restored['columns'])
+        files = checkpoint.pending(files)
+    for f in files:
+        parquet_file = pq.ParquetFile(f)
+        required_columns = [col for col in REQUIRED_COLUMNS if col in parquet_file.schema_arrow.names]
+        found_columns.update(required_columns)
+        file_parts = []
+        for i in row_groups[f]:
+            chunk = parquet_file.read_row_group(i).to_pandas()
+            file_parts.append(chunk[missing_node_id_mask(chunk, required_columns)])
+        parts.extend(file_parts)
+        if checkpoint is not None:
+            checkpoint.commit(f, {'columns': sorted(found_columns)},
+                              append={'missing': pd.concat(file_parts, ignore_index=True)})
+    print(f"Прочитано row groups: {sum(map(len, row_groups.values()))} из {len(row_groups)} файлов")
+
+    checked_columns = [col for col in REQUIRED_COLUMNS if col in found_columns]
+    missing_cols = [col for col in REQUIRED_COLUMNS if col not in found_columns]
+    if missing_cols:
+        print(f"Предупреждение: отсутствуют столбцы: {', '.join(missing_cols)}")
+    return pd.concat(parts, ignore_index=True), checked_columns
+
 def generate_report(missing_data, columns_checked):
     """Генерирует детальный отчет"""
     if not missing_data.empty:
@@ -96,18 +157,35 @@ def generate_report(missing_data, columns_checked):
         print("\nПроблемных строк не обнаружено.")
 
 def main():
+    from google.colab import drive
+    drive.mount('/content/drive')
+
     print("Анализ отсутствующих node_id")
     
     # Получаем путь к данным
     file_path = get_user_file_path()
     
-    # Загружаем данные
-    data = load_data(file_path)
-    if data is None:
+    # Профиль по футерам parquet: пропуски node_id видны без чтения данных
+    catalog = load_catalog(data_files(file_path))
+    print_profile(catalog, ['node_id'] + REQUIRED_COLUMNS)
+    row_groups = catalog.row_groups_with_nulls('node_id')
+    if not row_groups:
+        print("\nПропусков node_id нет ни в одном row group. Проблемных строк не обнаружено.")
         return
     
-    # Анализируем проблемные строки
-    missing_data, checked_columns = analyze_missing_node_ids(data)
+    if fits_in_memory(list(row_groups), row_groups=row_groups):
+        # Загружаем только row groups с пропусками node_id
+        data = load_data(file_path, row_groups)
+        if data is None:
+            return
+        
+        # Анализируем проблемные строки
+        missing_data, checked_columns = analyze_missing_node_ids(data)
+    else:
+        selected = sum(estimate_bytes([f], row_group=i) for f, groups in row_groups.items() for i in groups)
+        print(f"Row groups с пропусками (~{format_size(selected)}) больше бюджета памяти "
+              f"({format_size(memory_budget())}), анализ по row groups")
+        missing_data, checked_columns = analyze_missing_node_ids_streaming(row_groups)
     
     # Генерируем отчет
     generate_report(missing_data, checked_columns)
@@ -10,11 +10,26 @@ Original file is located at
 import pandas as pd
 import numpy as np
 import matplotlib.pyplot as plt
+from session_store import SessionStore
+from checkpoint import Checkpoint
+from data_loader import iter_data_files
+from kernels import grouped_diffs
+from memory_budget import fits_in_memory
+from sharding import DEFAULT_SHARDS, ROW_COLUMN, ShardWriter, map_frame, map_shards
+from bot_labels import EXPLICIT, bot_flags_cached
+
+def _comparable(df):
+    """Копия для поиска дубликатов: массивы преобразуются в строки для корректного сравнения"""
+    temp_df = df.copy()
+    for col in temp_df.columns:
+        if len(temp_df) and isinstance(temp_df[col].iloc[0], (np.ndarray, list)):
+            temp_df[col] = temp_df[col].apply(lambda x: str(x))
+    return temp_df
 
 def load_and_preprocess_data(file_path):
     """
     Загружает данные из файла и выполняет предварительную обработку:
-    - Удаление записей с ua_is_bot = 1
+    - Удаление записей, явно помеченных ботами (ua_is_bot, см. bot_labels)
     - Удаление дубликатов
 
     Параметры:
@@ -27,21 +42,15 @@ def load_and_preprocess_data(file_path):
         # Загрузка данных
         df = pd.read_parquet(file_path)
         print(f"Файл {file_path} успешно прочитан! Количество строк: {len(df)}")
+        # Метки ботов - общие для всех детекторов и кэшируются рядом с файлом
+        is_bot = (bot_flags_cached(file_path, df) & EXPLICIT) != 0
 
-        # Создаем временный DataFrame для обнаружения дубликатов
-        temp_df = df.copy()
-
-        # Преобразуем массивы в строки для корректного сравнения
-        for col in temp_df.columns:
-            if isinstance(temp_df[col].iloc[0], (np.ndarray, list)):
-                temp_df[col] = temp_df[col].apply(lambda x: str(x))
-
-        # Удаляем дубликаты
-        new_df = df.loc[temp_df.drop_duplicates().index]
+        # Удаляем дубликаты (временный DataFrame - для сравнения массивов)
+        new_df = df.loc[_comparable(df).drop_duplicates().index]
         print(f"Количество строк после удаления дубликатов: {len(new_df)}")
 
-        # Фильтрация: удаляем ботов (где ua_is_bot != 1)
-        new_df = new_df[(new_df['ua_is_bot'] != 1)]
+        # Фильтрация: удаляем явных ботов
+        new_df = new_df[~is_bot[df.index.get_indexer(new_df.index)]]
         print(f"Количество строк после удаления ботов: {len(new_df)}")
 
         return new_df
@@ -50,7 +59,40 @@ def load_and_preprocess_data(file_path):
         print(f"Ошибка при обработке файла: {e}")
         return None
 
-def detect_page_number_anomalies(df, user_id_column='randPAS_user_agent_id', session_id_column='randPAS_session_id'):
+def iter_preprocessed_data(file_path):
+    """
+    load_and_preprocess_data без загрузки всего файла, если он не помещается
+    в бюджет памяти (см. memory_budget): файл читается по row groups.
+
+    Дубликаты ищутся по хэшам строк всего файла (8 байт на строку), поэтому
+    отбрасываются те же строки, что и при чтении целиком.
+
+    Возвращает:
+    generator: pd.DataFrame (один - если файл помещается в память)
+    """
+    if fits_in_memory([file_path]):
+        df = load_and_preprocess_data(file_path)
+        if df is not None:
+            yield df
+        return
+
+    print(f"Файл {file_path} больше бюджета памяти, читается по row groups")
+    seen = np.zeros(0, dtype=np.uint64)
+    rows = kept = 0
+    for _, df in iter_data_files([file_path], row_groups=True, derive_bots=True):
+        rows += len(df)
+        labels = df[['bot_flags', 'is_bot', 'is_hidden_bot']]
+        df = df.drop(columns=labels.columns)
+        hashes = pd.util.hash_pandas_object(_comparable(df), index=False).to_numpy()
+        first = ~pd.Series(hashes).duplicated().to_numpy() & ~np.isin(hashes, seen)
+        seen = np.concatenate([seen, hashes[first]])
+        kept += int(first.sum())
+        # Фильтрация: удаляем явных ботов (is_bot - бит EXPLICIT из bot_flags)
+        yield df[first & ~labels['is_bot'].to_numpy()]
+    print(f"Файл {file_path}: строк {rows}, после удаления дубликатов {kept}")
+
+def detect_page_number_anomalies(df, user_id_column='randPAS_user_agent_id', session_id_column='randPAS_session_id',
+                                 n_workers=1):
     """
     Находит аномалии в нумерации page_view_order_number:
     - reset: текущий номер < предыдущего (например, 3 → 1),
@@ -61,46 +103,151 @@ def detect_page_number_anomalies(df, user_id_column='randPAS_user_agent_id', ses
     df (pd.DataFrame): DataFrame с данными
     user_id_column (str): Название колонки с ID пользователя
     session_id_column (str): Название колонки с ID сессии
+    n_workers (int): При > 1 строки делятся по хэшу (пользователь, сессия)
+        и части проверяются в процессах (map_frame)
 
     Возвращает:
     pd.DataFrame: DataFrame с аномалиями
     """
-    anomalies = []
-
     if 'page_view_order_number' in df.columns:
         df['page_view_order_number'] = df['page_view_order_number'].astype('int64')
+    if n_workers > 1:
+        results = map_frame(_shard_page_anomalies,
+                            df[[user_id_column, session_id_column, 'page_view_order_number']],
+                            [user_id_column, session_id_column], n_workers,
+                            user_id_column=user_id_column, session_id_column=session_id_column)
+        return _merge_session_anomalies(results)
+
+    # Строки группируются по (пользователь, сессия) в порядке ключей, внутри
+    # сессии сохраняется порядок файла; разности считает ядро kernels
+    groups = df.groupby([user_id_column, session_id_column], sort=True).ngroup().to_numpy()
+    valid = np.flatnonzero(groups >= 0)
+    rows = valid[np.argsort(groups[valid], kind='stable')]
+    groups = groups[rows]
+    page_numbers = df['page_view_order_number'].to_numpy()[rows]
+    position, prev, has_prev = grouped_diffs(groups, page_numbers)
+
+    delta = page_numbers - prev
+    reset = has_prev & (page_numbers < prev)
+    skip = has_prev & (delta > 1)
+    found = np.flatnonzero(reset | skip)
+    if not len(found):
+        return pd.DataFrame()
+
+    return pd.DataFrame({
+        'user_id': df[user_id_column].to_numpy()[rows[found]],
+        'session_id': df[session_id_column].to_numpy()[rows[found]],
+        'event_index': position[found],
+        'page_view_order_number': page_numbers[found],
+        'previous_number': prev[found],
+        'delta': delta[found],
+        'anomaly_type': np.where(reset[found], 'reset', 'skip'),
+    })
+
+def detect_page_number_anomalies_across_files(file_paths, store=None,
+                                             user_id_column='randPAS_user_agent_id',
+                                             session_id_column='randPAS_session_id',
+                                             checkpoint_dir=None):
+    """
+    Инкрементальная проверка нумерации по нескольким файлам (дням).
+
+    Сессии, перешедшие через полночь, продолжаются из хвостов SessionStore,
+    поэтому первый просмотр нового дня не считается сбросом.
+
+    Параметры:
+    file_paths (list): Файлы в хронологическом порядке
+    store (SessionStore): Хранилище сессий (для продолжения с прошлого запуска)
+    user_id_column (str): Название колонки с ID пользователя
+    session_id_column (str): Название колонки с ID сессии
+    checkpoint_dir (str): Папка чекпоинтов: хвосты сессий и найденные аномалии
+                          сохраняются после каждого файла, повторный запуск
+                          обрабатывает только новые или изменившиеся файлы
+
+    Возвращает:
+    tuple: (pd.DataFrame с аномалиями, общее число записей, SessionStore)
+    """
+    if store is None:
+        # События сессий (для session_events) хранятся, только если все данные помещаются в память
+        store = SessionStore(user_id_column, session_id_column,
+                             keep_events=fits_in_memory(file_paths, ['ts', user_id_column, session_id_column,
+                                                                     'page_view_order_number']))
+
+    results = []
+    total_records = 0
+    checkpoint = None
+    if checkpoint_dir is not None:
+        checkpoint = Checkpoint(checkpoint_dir, 'page_view_anomalies', params={
+            'user_id_column': user_id_column, 'session_id_column': session_id_column,
+            'session_timeout': str(store.session_timeout)})
+        parts = checkpoint.restore(file_paths)
+        if parts is not None:
+            store.restore(parts)
+            results.extend(parts['anomalies'])
+            total_records = parts['meta']['total_records']
+        file_paths = checkpoint.pending(file_paths)
+
+    for file_path in file_paths:
+        # Файл больше бюджета памяти проверяется по частям: сессии продолжаются
+        # между row groups, а устаревшие хвосты закрываются после последней части
+        parts = iter_preprocessed_data(file_path)
+        df = next(parts, None)
+        if df is None:
+            continue
+        file_results = []
+        while df is not None:
+            following = next(parts, None)
+            total_records += len(df)
+            file_results.append(store.add(df, final=following is None))
+            df = following
+        anomalies = pd.concat(file_results, ignore_index=True)
+        results.append(anomalies)
+        print(f"Аномалий в {file_path}: {len(anomalies)} (открытых сессий: {len(store.tails)})")
+        if checkpoint is not None:
+            # В чекпоинт дописываются только аномалии этого файла
+            checkpoint.commit(file_path, dict(store.checkpoint_parts(), meta={'total_records': total_records}),
+                              append={'anomalies': anomalies})
+
+    anomalies_df = pd.concat(results, ignore_index=True) if results else pd.DataFrame()
+    return anomalies_df, total_records, store
+
+def _shard_page_anomalies(df, user_id_column, session_id_column):
+    """Обработчик шарда для map_shards (все события сессии - в одном шарде)"""
+    return detect_page_number_anomalies(df.drop(columns=ROW_COLUMN), user_id_column, session_id_column)
+
+def detect_page_number_anomalies_sharded(file_paths, n_shards=DEFAULT_SHARDS, n_workers=None,
+                                         user_id_column='randPAS_user_agent_id',
+                                         session_id_column='randPAS_session_id'):
+    """
+    То же, что detect_page_number_anomalies по всем файлам сразу, но без общего
+    DataFrame: строки раскладываются по шардам на диске по хэшу (пользователь,
+    сессия), и шарды проверяются параллельно в n_workers процессах.
+
+    Параметры:
+    file_paths (list): Файлы в хронологическом порядке
+    n_shards (int): Число шардов
+    n_workers (int): Число процессов (None - по числу ядер, 1 - в текущем процессе)
+
+    Возвращает:
+    tuple: (pd.DataFrame с аномалиями, общее число записей)
+    """
+    total_records = 0
+    with ShardWriter([user_id_column, session_id_column], n_shards) as shards:
+        for file_path in file_paths:
+            for df in iter_preprocessed_data(file_path):
+                total_records += len(df)
+                shards.write(df[[user_id_column, session_id_column, 'page_view_order_number']])
+        results = map_shards(_shard_page_anomalies, shards.close(), n_workers,
+                             user_id_column=user_id_column, session_id_column=session_id_column)
+
+    return _merge_session_anomalies(results), total_records
 
-    for (user_id, session_id), group in df.groupby([user_id_column, session_id_column]):
-        page_numbers = group['page_view_order_number'].values
-
-        for i in range(1, len(page_numbers)):
-            prev_num = page_numbers[i-1]
-            current_num = page_numbers[i]
-            delta = current_num - prev_num
-
-            if current_num < prev_num:
-                anomalies.append({
-                    'user_id': user_id,
-                    'session_id': session_id,
-                    'event_index': i,
-                    'page_view_order_number': current_num,
-                    'previous_number': prev_num,
-                    'delta': delta,
-                    'anomaly_type': 'reset'
-                })
-
-            elif delta > 1:
-                anomalies.append({
-                    'user_id': user_id,
-                    'session_id': session_id,
-                    'event_index': i,
-                    'page_view_order_number': current_num,
-                    'previous_number': prev_num,
-                    'delta': delta,
-                    'anomaly_type': 'skip',
-                })
-
-    return pd.DataFrame(anomalies)
+def _merge_session_anomalies(results):
+    """Аномалии частей в порядке groupby по всему набору (сессии частей не пересекаются)"""
+    results = [result for result in results if not result.empty]
+    if not results:
+        return pd.DataFrame()
+    return pd.concat(results, ignore_index=True) \
+        .sort_values(['user_id', 'session_id'], kind='stable', ignore_index=True)
 
 def visualize_anomalies(anomalies_df, total_records):
     """
@@ -0,0 +1,196 @@
+import os
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+
+import numpy as np
+from matplotlib.figure import Figure
+from matplotlib.backends.backend_agg import FigureCanvasAgg
+
+# Максимальное число точек, которое реально нужно линейному графику шириной ~1500px
+DEFAULT_MAX_POINTS = 4000
+
+
+def _as_numeric(x):
+    """Приводит ось X (в том числе datetime64) к float для вычислений"""
+    x = np.asarray(x)
+    if np.issubdtype(x.dtype, np.datetime64):
+        return x.astype('datetime64[ns]').astype(np.int64).astype(np.float64)
+    return x.astype(np.float64)
+
+
+def minmax_downsample(x, y, max_points=DEFAULT_MAX_POINTS):
+    """
+    Прореживание ряда с сохранением минимума и максимума в каждой корзине.
+
+    Ряд делится на max_points // 2 корзин равной длины, из каждой корзины
+    берутся точки минимума и максимума (в исходном порядке). Пики не теряются.
+
+    Параметры:
+    x (array-like): Значения по оси X (отсортированы)
+    y (array-like): Значения по оси Y
+    max_points (int): Максимальное число точек на выходе
+
+    Возвращает:
+    np.ndarray: Индексы отобранных точек
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= max_points or max_points < 4:
+        return np.arange(n)
+
+    n_buckets = max_points // 2
+    bucket_size = int(np.ceil(n / n_buckets))
+    n_buckets = int(np.ceil(n / bucket_size))
+
+    # Дополняем ряд до кратной длины, чтобы посчитать argmin/argmax одной операцией
+    padded = np.full(n_buckets * bucket_size, np.nan)
+    padded[:n] = y
+    padded = padded.reshape(n_buckets, bucket_size)
+    filled_min = np.where(np.isnan(padded), np.inf, padded)
+    filled_max = np.where(np.isnan(padded), -np.inf, padded)
+
+    offsets = np.arange(n_buckets) * bucket_size
+    idx_min = offsets + filled_min.argmin(axis=1)
+    idx_max = offsets + filled_max.argmax(axis=1)
+
+    idx = np.unique(np.concatenate([[0, n - 1], idx_min, idx_max]))
+    return idx[idx < n]
+
+
+def lttb_downsample(x, y, max_points=DEFAULT_MAX_POINTS):
+    """
+    Прореживание методом Largest-Triangle-Three-Buckets.
+
+    Дополнительно в выборку добавляются глобальные минимум и максимум ряда,
+    чтобы экстремумы гарантированно попали на график.
+
+    Возвращает:
+    np.ndarray: Индексы отобранных точек
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if n <= max_points or max_points < 3:
+        return np.arange(n)
+
+    xs = _as_numeric(x)
+    edges = np.linspace(1, n - 1, max_points - 1).astype(np.int64)
+
+    selected = np.empty(max_points, dtype=np.int64)
+    selected[0] = 0
+    selected[-1] = n - 1
+    a = 0
+    for i in range(max_points - 2):
+        start, end = edges[i], edges[i + 1]
+        # Средняя точка следующей корзины
+        next_end = edges[i + 2] if i + 2 < len(edges) else n
+        next_start = end
+        avg_x = xs[next_start:next_end].mean() if next_end > next_start else xs[-1]
+        avg_y = y[next_start:next_end].mean() if next_end > next_start else y[-1]
+
+        bx = xs[start:end]
+        by = y[start:end]
+        areas = np.abs((xs[a] - avg_x) * (by - y[a]) - (xs[a] - bx) * (avg_y - y[a]))
+        a = start + int(np.argmax(areas))
+        selected[i + 1] = a
+
+    extremes = [int(np.nanargmin(y)), int(np.nanargmax(y))]
+    return np.unique(np.concatenate([selected, extremes]))
+
+
+def downsample(x, y, max_points=DEFAULT_MAX_POINTS, method='minmax'):
+    """Прореживание ряда выбранным методом ('minmax' или 'lttb'), возвращает (x, y)"""
+    if method == 'minmax':
+        idx = minmax_downsample(x, y, max_points)
+    elif method == 'lttb':
+        idx = lttb_downsample(x, y, max_points)
+    else:
+        raise ValueError(f"Неизвестный метод прореживания: {method}")
+    return np.asarray(x)[idx], np.asarray(y)[idx]
+
+
+def plot_line(ax, x, y, max_points=DEFAULT_MAX_POINTS, method='minmax', **kwargs):
+    """Линейный график с предварительным прореживанием"""
+    xd, yd = downsample(x, y, max_points, method)
+    return ax.plot(xd, yd, **kwargs)
+
+
+def plot_density(ax, x, y, highlight=None, gridsize=60, **kwargs):
+    """
+    Плотность точек (hexbin) вместо scatter для больших облаков точек.
+
+    Точки из маски highlight (например, аномалии) дорисовываются поверх
+    отдельным scatter - их обычно немного.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    hb = ax.hexbin(x, y, gridsize=gridsize, bins='log', mincnt=1, cmap='Blues', **kwargs)
+    if highlight is not None:
+        highlight = np.asarray(highlight, dtype=bool)
+        if highlight.any():
+            ax.scatter(x[highlight], y[highlight], color='red', s=12, zorder=3)
+    return hb
+
+
+def _render_to_png(draw_fn, path, figsize, args, kwargs):
+    """Рисует фигуру без pyplot (Agg) и сохраняет в PNG"""
+    fig = Figure(figsize=figsize)
+    FigureCanvasAgg(fig)
+    draw_fn(fig, *args, **kwargs)
+    fig.tight_layout()
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    fig.savefig(path)
+    return path
+
+
+class ChartRenderer:
+    """
+    Отложенная отрисовка графиков в фоновом потоке или процессе.
+
+    Фигуры строятся через объектный API matplotlib с бэкендом Agg и сразу
+    пишутся в PNG, поэтому основной конвейер не ждет отрисовки.
+
+    Атрибуты:
+        mode (str): 'thread' (по умолчанию) или 'process'
+        futures (list): Поставленные в очередь задачи
+    """
+
+    def __init__(self, mode='thread', max_workers=1):
+        self.mode = mode
+        if mode == 'thread':
+            self._executor = ThreadPoolExecutor(max_workers=max_workers)
+        elif mode == 'process':
+            # В процессе функция отрисовки и аргументы должны сериализоваться pickle
+            self._executor = ProcessPoolExecutor(max_workers=max_workers)
+        else:
+            raise ValueError(f"Неизвестный режим отрисовки: {mode}")
+        self.futures = []
+
+    def submit(self, draw_fn, path, *args, figsize=(14, 6), **kwargs):
+        """Ставит фигуру в очередь; draw_fn(fig, *args, **kwargs) заполняет фигуру"""
+        future = self._executor.submit(_render_to_png, draw_fn, path, figsize, args, kwargs)
+        self.futures.append(future)
+        return future
+
+    def wait(self):
+        """Дожидается всех графиков, возвращает список путей к PNG"""
+        paths = []
+        for future in self.futures:
+            try:
+                paths.append(future.result())
+            except Exception as e:
+                print(f"Ошибка при построении графика: {e}")
+        self.futures = []
+        return paths
+
+    def close(self):
+        """Дожидается графиков и останавливает фоновый исполнитель"""
+        paths = self.wait()
+        self._executor.shutdown(wait=True)
+        return paths
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
@@ -0,0 +1,228 @@
+import numpy as np
+import pandas as pd
+
+from kernels import grouped_diffs
+
+ANOMALY_COLUMNS = ['user_id', 'session_id', 'event_index', 'page_view_order_number',
+                   'previous_number', 'delta', 'anomaly_type', 'ts']
+
+
+class IdEncoder:
+    """Стабильное целочисленное кодирование идентификаторов между файлами"""
+
+    def __init__(self):
+        self.index = pd.Index([], dtype=object)
+
+    def encode(self, values):
+        """Возвращает коды для values, новые идентификаторы получают следующие номера"""
+        codes, uniques = pd.factorize(values)
+        known = self.index.get_indexer(uniques)
+        new = known == -1
+        if new.any():
+            known[new] = np.arange(len(self.index), len(self.index) + new.sum())
+            self.index = self.index.append(pd.Index(uniques[new], dtype=object))
+        result = known[codes]
+        result[codes == -1] = -1  # пропуски остаются без кода
+        return result.astype(np.int64)
+
+    def decode(self, codes):
+        """Обратное преобразование кодов в исходные идентификаторы"""
+        return self.index.take(np.asarray(codes, dtype=np.int64)).to_numpy()
+
+    def __len__(self):
+        return len(self.index)
+
+
+class SessionStore:
+    """
+    Хранилище упорядоченных событий сессий, накапливаемое по файлам.
+
+    Сессия идентифицируется парой (randPAS_user_agent_id, randPAS_session_id),
+    которая кодируется в одно целое число. События каждого файла сортируются
+    по (сессия, ts) и хранятся блоками. Для сессий, которые могут продолжиться
+    в следующем файле (последнее событие ближе session_timeout к концу файла),
+    сохраняется «хвост»: последний номер страницы и число событий. Благодаря
+    хвостам переход через полночь не считается сбросом нумерации.
+
+    Атрибуты:
+        tails (pd.DataFrame): Открытые сессии (индекс - ключ сессии)
+        chunks (list): Отсортированные блоки (keys, ts, order_numbers) по файлам
+    """
+
+    SESSION_SHIFT = 32
+
+    def __init__(self, user_id_column='randPAS_user_agent_id',
+                 session_id_column='randPAS_session_id', session_timeout='30min',
+                 keep_events=True):
+        self.user_id_column = user_id_column
+        self.session_id_column = session_id_column
+        self.session_timeout = pd.Timedelta(session_timeout)
+        self.keep_events = keep_events
+        self.users = IdEncoder()
+        self.sessions = IdEncoder()
+        self.tails = self._empty_tails()
+        self.chunks = []
+        # Последнее время текущего файла (файл может добавляться частями)
+        self._file_end = None
+
+    @staticmethod
+    def _empty_tails():
+        return pd.DataFrame({
+            'last_number': pd.Series(dtype=np.int64),
+            'last_ts': pd.Series(dtype='datetime64[ns]'),
+            'count': pd.Series(dtype=np.int64),
+        })
+
+    def _session_keys(self, df):
+        user_codes = self.users.encode(df[self.user_id_column].to_numpy())
+        session_codes = self.sessions.encode(df[self.session_id_column].to_numpy())
+        keys = (user_codes << self.SESSION_SHIFT) | session_codes
+        keys[(user_codes < 0) | (session_codes < 0)] = -1
+        return keys
+
+    def split_key(self, keys):
+        """Раскладывает ключи сессий обратно на (user_id, session_id)"""
+        keys = np.asarray(keys, dtype=np.int64)
+        user_codes = keys >> self.SESSION_SHIFT
+        session_codes = keys & ((1 << self.SESSION_SHIFT) - 1)
+        return self.users.decode(user_codes), self.sessions.decode(session_codes)
+
+    def add(self, df, final=True):
+        """
+        Добавляет события очередного файла и проверяет нумерацию страниц.
+
+        Файл, не помещающийся в память, можно добавлять частями (row groups
+        по возрастанию времени) с final=False у всех частей, кроме последней:
+        внутри файла сессии не закрываются по session_timeout, поэтому
+        результат тот же, что и при добавлении файла целиком.
+
+        Параметры:
+        df (pd.DataFrame): Данные файла (ts, page_view_order_number, id пользователя и сессии)
+        final (bool): Последняя часть файла - после нее закрываются устаревшие хвосты
+
+        Возвращает:
+        pd.DataFrame: Аномалии reset/skip в формате detect_page_number_anomalies
+        """
+        df = df[df['page_view_order_number'].notna()]
+        if df.empty:
+            if final:
+                self._close_file()
+            return pd.DataFrame(columns=ANOMALY_COLUMNS)
+
+        keys = self._session_keys(df)
+        valid = keys >= 0
+        keys = keys[valid]
+        ts = pd.to_datetime(df['ts']).to_numpy()[valid]
+        numbers = df['page_view_order_number'].to_numpy()[valid].astype(np.int64)
+
+        # Порядок событий: по сессии, затем по времени (стабильно - при равном ts
+        # сохраняется порядок строк в файле)
+        order = np.lexsort((ts, keys))
+        keys, ts, numbers = keys[order], ts[order], numbers[order]
+        if self.keep_events:
+            self.chunks.append((keys, ts, numbers))
+
+        position, prev, has_prev = grouped_diffs(keys, numbers)
+        starts = ~has_prev
+
+        # Первые события сессий, продолжающих открытые хвосты прошлых файлов
+        offset = np.zeros(len(keys), dtype=np.int64)
+        if not self.tails.empty:
+            first_keys = keys[starts]
+            tail_pos = self.tails.index.get_indexer(first_keys)
+            continued = tail_pos >= 0
+            first_idx = np.flatnonzero(starts)
+            prev[first_idx[continued]] = self.tails['last_number'].to_numpy()[tail_pos[continued]]
+            has_prev[first_idx[continued]] = True
+            group_offset = np.zeros(len(first_keys), dtype=np.int64)
+            group_offset[continued] = self.tails['count'].to_numpy()[tail_pos[continued]]
+            offset = group_offset[np.cumsum(starts) - 1]
+
+        delta = numbers - prev
+        reset = has_prev & (numbers < prev)
+        skip = has_prev & (delta > 1)
+        anomalies = self._anomaly_frame(
+            reset | skip, keys, position + offset, numbers, prev, delta, reset, ts)
+
+        self._update_tails(keys, ts, numbers, starts, position + offset)
+        if final:
+            self._close_file()
+        return anomalies
+
+    def _anomaly_frame(self, mask, keys, event_index, numbers, prev, delta, reset, ts):
+        idx = np.flatnonzero(mask)
+        user_ids, session_ids = self.split_key(keys[idx])
+        return pd.DataFrame({
+            'user_id': user_ids,
+            'session_id': session_ids,
+            'event_index': event_index[idx],
+            'page_view_order_number': numbers[idx],
+            'previous_number': prev[idx],
+            'delta': delta[idx],
+            'anomaly_type': np.where(reset[idx], 'reset', 'skip'),
+            'ts': ts[idx],
+        }, columns=ANOMALY_COLUMNS)
+
+    def _update_tails(self, keys, ts, numbers, starts, event_index):
+        """Обновляет хвосты сессий последними событиями части файла"""
+        ends = np.ones(len(keys), dtype=bool)
+        ends[:-1] = starts[1:]
+        new_tails = pd.DataFrame({
+            'last_number': numbers[ends],
+            'last_ts': ts[ends],
+            'count': event_index[ends] + 1,
+        }, index=pd.Index(keys[ends], dtype=np.int64))
+
+        self.tails = pd.concat([self.tails[~self.tails.index.isin(new_tails.index)], new_tails])
+        self._file_end = ts.max() if self._file_end is None else max(self._file_end, ts.max())
+
+    def _close_file(self):
+        """Оставляет хвосты только для сессий, которые могут продолжиться в следующем файле"""
+        if self._file_end is not None:
+            horizon = self._file_end - self.session_timeout
+            self.tails = self.tails[self.tails['last_ts'] >= horizon]
+        self._file_end = None
+
+    def checkpoint_parts(self):
+        """
+        Хвосты открытых сессий для checkpoint.Checkpoint.
+
+        Ключи раскладываются на исходные идентификаторы, поэтому в чекпоинт
+        не попадают словари всех пользователей и сессий за историю.
+        События (chunks) не сохраняются.
+        """
+        user_ids, session_ids = self.split_key(self.tails.index.to_numpy())
+        tails = self.tails.reset_index(drop=True)
+        tails.insert(0, 'user_id', user_ids)
+        tails.insert(1, 'session_id', session_ids)
+        return {'tails': tails}
+
+    def restore(self, parts):
+        """Восстанавливает хвосты из checkpoint_parts (ключи кодируются заново)"""
+        tails = parts['tails']
+        keys = self._session_keys(tails.rename(columns={'user_id': self.user_id_column,
+                                                        'session_id': self.session_id_column}))
+        self.tails = pd.DataFrame({
+            'last_number': tails['last_number'].to_numpy(dtype=np.int64),
+            'last_ts': tails['last_ts'].to_numpy(dtype='datetime64[ns]'),
+            'count': tails['count'].to_numpy(dtype=np.int64),
+        }, index=pd.Index(keys, dtype=np.int64))
+        return self
+
+    def session_events(self, user_id, session_id):
+        """Упорядоченные события одной сессии по всем добавленным файлам"""
+        user_code = self.users.index.get_indexer([user_id])[0]
+        session_code = self.sessions.index.get_indexer([session_id])[0]
+        if user_code < 0 or session_code < 0:
+            return pd.DataFrame(columns=['ts', 'page_view_order_number'])
+        key = (user_code << self.SESSION_SHIFT) | session_code
+
+        parts = []
+        for keys, ts, numbers in self.chunks:
+            left, right = np.searchsorted(keys, [key, key + 1])
+            if right > left:
+                parts.append(pd.DataFrame({'ts': ts[left:right],
+                                           'page_view_order_number': numbers[left:right]}))
+        if not parts:
+            return pd.DataFrame(columns=['ts', 'page_view_order_number'])
+        return pd.concat(parts, ignore_index=True)
@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+DEFAULT_SHARDS = 8
+MANIFEST_NAME = 'shards.json'
+# Сквозной номер строки: по нему результаты шардов возвращаются в порядок исходных файлов
+ROW_COLUMN = '_row'
+
+
+def shard_ids(df, key, n_shards):
+    """
+    Номер шарда для каждой строки: хэш ключа по модулю n_shards.
+
+    Хэш pandas (hash_pandas_object) не зависит от процесса и машины, поэтому
+    одна и та же сущность всегда попадает в один шард.
+
+    Параметры:
+    df (pd.DataFrame): Данные
+    key (str | list): Столбец (например, 'ip') или столбцы сессии
+
+    Возвращает:
+    np.ndarray: int64 номера шардов
+    """
+    columns = [key] if isinstance(key, str) else list(key)
+    hashes = pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+    return (hashes % np.uint64(n_shards)).astype(np.int64)
+
+
+class ShardWriter:
+    """
+    Перемешивание (shuffle): строки раскладываются по n_shards папкам на диске
+    по хэшу ключа, так что все события одной сущности (IP, сессии) оказываются
+    в одном шарде. Каждый шард затем обрабатывается независимо (map_shards),
+    и ни одному обработчику не нужен весь набор данных.
+
+    Каждый вызов write дописывает в шарды по одной части; части нумеруются по
+    порядку, поэтому внутри шарда сохраняется порядок исходных файлов.
+
+    Пример:
+        with ShardWriter('ip', n_shards=8) as shards:
+            for file, df in iter_data_files(folder, row_groups='auto'):
+                shards.write(df)
+            results = map_shards(count_requests, shards.close())
+    """
+
+    def __init__(self, key, n_shards=DEFAULT_SHARDS, shard_dir=None, tmp_dir=None):
+        self.key = key
+        self.n_shards = n_shards
+        self._owned = shard_dir is None
+        self.shard_dir = shard_dir or tempfile.mkdtemp(prefix='shards_', dir=tmp_dir)
+        self.paths = [os.path.join(self.shard_dir, f'shard-{i:05d}') for i in range(n_shards)]
+        for path in self.paths:
+            os.makedirs(path, exist_ok=True)
+        self.rows = np.zeros(n_shards, dtype=np.int64)
+        self._parts = 0
+
+    def write(self, df):
+        """Раскладывает строки df по шардам (добавляет столбец ROW_COLUMN)"""
+        if df.empty:
+            return self
+        df = df.assign(**{ROW_COLUMN: np.arange(self.rows.sum(), self.rows.sum() + len(df))})
+        ids = shard_ids(df, self.key, self.n_shards)
+        order = np.argsort(ids, kind='stable')
+        bounds = np.searchsorted(ids[order], np.arange(self.n_shards + 1))
+        for shard in range(self.n_shards):
+            rows = order[bounds[shard]:bounds[shard + 1]]
+            if not len(rows):
+                continue
+            table = pa.Table.from_pandas(df.iloc[rows], preserve_index=False)
+            pq.write_table(table, os.path.join(self.paths[shard], f'part-{self._parts:06d}.parquet'))
+            self.rows[shard] += len(rows)
+        self._parts += 1
+        return self
+
+    def close(self):
+        """
+        Завершает перемешивание и записывает манифест shards.json
+        (ключ, число шардов и строк) - по нему шарды можно раздать на другие машины.
+
+        Возвращает:
+        list: Пути к папкам шардов
+        """
+        manifest = {'key': self.key, 'n_shards': self.n_shards, 'rows': self.rows.tolist(),
+                    'shards': [os.path.basename(path) for path in self.paths]}
+        with open(os.path.join(self.shard_dir, MANIFEST_NAME), 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+        return self.paths
+
+    def cleanup(self):
+        """Удаляет шарды (только если папка создана самим ShardWriter)"""
+        if self._owned:
+            shutil.rmtree(self.shard_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.cleanup()
+
+
+def read_shard(shard_path, columns=None):
+    """Все части шарда одним DataFrame (в порядке записи)"""
+    parts = sorted(name for name in os.listdir(shard_path) if name.endswith('.parquet'))
+    if not parts:
+        return pd.DataFrame(columns=columns)
+    return pd.concat([pd.read_parquet(os.path.join(shard_path, name), columns=columns) for name in parts],
+                     ignore_index=True)
+
+
+def _apply(func, shard_path, kwargs):
+    return func(read_shard(shard_path), **kwargs)
+
+
+def map_shards(func, shard_paths, n_workers=None, **kwargs):
+    """
+    Применяет func(shard_df, **kwargs) к каждому шарду в отдельных процессах.
+
+    func должна быть функцией уровня модуля (передается в процессы через
+    pickle) и возвращать небольшую сводку; сводки объединяет вызывающий код.
+    n_workers=1 - последовательно в текущем процессе.
+
+    Возвращает:
+    list: Результаты в порядке shard_paths
+    """
+    if n_workers is None:
+        n_workers = min(len(shard_paths), os.cpu_count() or 1)
+    if n_workers <= 1:
+        return [_apply(func, path, kwargs) for path in shard_paths]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(_apply, func, path, kwargs) for path in shard_paths]
+        return [future.result() for future in futures]
+
+
+def map_frame(func, df, key, n_workers=None, n_shards=None, **kwargs):
+    """
+    То же, что ShardWriter + map_shards, для данных, уже загруженных в память:
+    строки делятся по хэшу key без записи на диск (с тем же ROW_COLUMN),
+    и части обрабатываются в n_workers процессах.
+
+    n_shards по умолчанию равно n_workers (по одной части на процесс).
+
+    Возвращает:
+    list: Результаты func по частям
+    """
+    if n_workers is None:
+        n_workers = os.cpu_count() or 1
+    n_shards = n_shards or max(n_workers, 1)
+    df = df.assign(**{ROW_COLUMN: np.arange(len(df))})
+    ids = shard_ids(df, key, n_shards)
+    parts = [df[ids == shard] for shard in range(n_shards)]
+    if n_workers <= 1:
+        return [func(part, **kwargs) for part in parts]
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        futures = [executor.submit(func, part, **kwargs) for part in parts]
+        return [future.result() for future in futures]
+
+
+# Обработчики шардов по IP (сводки небольшие, объединяются вызывающим кодом)
+
+def bot_ip_summary(df, top_n=10):
+    """
+    Топ ботов шарда по точному числу запросов.
+
+    total_requests - все запросы IP (как request_count в top_bot_activity):
+    все строки IP лежат в одном шарде, поэтому счетчик точный.
+
+    Возвращает:
+    tuple: (число уникальных IP шарда, pd.DataFrame top_n IP: total_requests,
+            first_seen, last_seen, is_hidden)
+    """
+    request_count = df['ip'].value_counts()
+    bots = df[df['is_bot']]
+    top = bots.groupby('ip').agg(
+        first_seen=('ts', 'min'),
+        last_seen=('ts', 'max'),
+        is_hidden=('is_hidden_bot', 'any'),
+    )
+    top.insert(0, 'total_requests', request_count.reindex(top.index).to_numpy())
+    return len(request_count), top.nlargest(top_n, 'total_requests')
+
+
+def night_ip_anomalies(df, threshold=100, columns=None):
+    """
+    IP с > threshold ночных запросов (отдельно для строк ботов и людей) и их строки.
+
+    Возвращает:
+    tuple: (pd.DataFrame ip, is_bot, requests; pd.DataFrame строк аномальных IP
+            с ROW_COLUMN для восстановления исходного порядка)
+    """
+    anomalies = df.groupby(['ip', 'is_bot']).size().reset_index(name='requests')
+    anomalies = anomalies[anomalies['requests'] > threshold]
+    rows = df[df['ip'].isin(anomalies['ip'].unique())]
+    if columns is not None:
+        rows = rows[[c for c in columns if c in rows.columns] + [ROW_COLUMN]]
+    return anomalies, rows
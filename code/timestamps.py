@@ -0,0 +1,165 @@
+import numpy as np
+import pandas as pd
+
+from ingest_cache import load_cache, save_cache
+
+MS_PER_MINUTE = 60_000
+MS_PER_HOUR = 60 * MS_PER_MINUTE
+MS_PER_DAY = 24 * MS_PER_HOUR
+
+# Москва живет по UTC+3 без перехода на летнее время (с 2014 года),
+# поэтому смещение постоянное и считается целочисленной арифметикой
+TZ_OFFSETS_MS = {
+    'UTC': 0,
+    'Europe/Moscow': 3 * MS_PER_HOUR,
+}
+
+# Часовой пояс, в котором записаны «наивные» ts в выгрузке (без смещения),
+# и пояс, в котором считаются часы/даты (ночной анализ - по Москве)
+DATA_TZ = 'Europe/Moscow'
+DISPLAY_TZ = 'Europe/Moscow'
+
+# Пропущенный ts (NaT, None, NaN) в результатах parse_ts - как NaT в datetime64
+MISSING_MS = np.iinfo(np.int64).min
+# Версия кэша разобранных ts: v2 хранит пропуски как MISSING_MS
+TIME_CACHE_VERSION = 2
+
+
+def tz_offset_ms(tz):
+    """Смещение часового пояса относительно UTC в миллисекундах"""
+    if tz not in TZ_OFFSETS_MS:
+        raise ValueError(f"Неизвестный часовой пояс: {tz}. Доступны: {', '.join(TZ_OFFSETS_MS)}")
+    return TZ_OFFSETS_MS[tz]
+
+
+def parse_ts(values, source_tz=DATA_TZ):
+    """
+    Разбирает столбец ts в int64 миллисекунды эпохи (UTC).
+
+    Наивные значения считаются записанными в source_tz, значения со смещением
+    переводятся в UTC. Числа трактуются как эпоха (с, мс, мкс или нс - по величине).
+    Пропуски (NaT, None, NaN) дают MISSING_MS, а не сдвинутое на пояс переполненное число.
+
+    Параметры:
+    values (pd.Series | array-like): Значения ts
+    source_tz (str): Пояс наивных значений
+
+    Возвращает:
+    np.ndarray: int64 миллисекунды эпохи UTC
+    """
+    values = pd.Series(values) if not isinstance(values, pd.Series) else values
+
+    if pd.api.types.is_numeric_dtype(values) and not pd.api.types.is_bool_dtype(values):
+        raw = values.to_numpy(dtype=np.float64, na_value=np.nan)
+        missing = np.isnan(raw)
+        magnitude = np.abs(raw[~missing]).max() if (~missing).any() else 0
+        divisor = 1e6 if magnitude > 1e17 else 1e3 if magnitude > 1e14 else 1 if magnitude > 1e11 else 1e-3
+        return np.where(missing, MISSING_MS, np.floor(np.where(missing, 0, raw) / divisor)).astype(np.int64)
+
+    if not pd.api.types.is_datetime64_any_dtype(values):
+        try:
+            values = pd.to_datetime(values, format='ISO8601')
+        except (ValueError, TypeError):
+            values = pd.to_datetime(values)
+
+    missing = values.isna().to_numpy()
+    if isinstance(values.dtype, pd.DatetimeTZDtype):
+        ts_ms = values.dt.tz_convert('UTC').dt.tz_localize(None).to_numpy('datetime64[ms]').astype(np.int64)
+    else:
+        ts_ms = values.to_numpy('datetime64[ms]').astype(np.int64) - tz_offset_ms(source_tz)
+    ts_ms[missing] = MISSING_MS
+    return ts_ms
+
+
+def floor_ms(ts_ms, minutes):
+    """Начало интервала длиной minutes минут (как dt.floor, но на целых числах)"""
+    step = minutes * MS_PER_MINUTE
+    return ts_ms - ts_ms % step
+
+
+def local_ms(ts_ms, tz=DISPLAY_TZ):
+    """Миллисекунды эпохи «настенного» времени пояса tz"""
+    return ts_ms + tz_offset_ms(tz)
+
+
+def to_datetime(ts_ms, tz=DISPLAY_TZ):
+    """int64 мс UTC -> наивный datetime64 в поясе tz (для вывода и графиков); MISSING_MS -> NaT"""
+    ts_ms = np.asarray(ts_ms)
+    missing = ts_ms == MISSING_MS
+    result = pd.to_datetime(np.asarray(local_ms(np.where(missing, 0, ts_ms), tz)), unit='ms')
+    return result.where(~missing) if missing.any() else result
+
+
+def day_number(ts_ms, tz=DISPLAY_TZ):
+    """Номер дня от 1970-01-01 в поясе tz"""
+    return (local_ms(ts_ms, tz) // MS_PER_DAY).astype(np.int32)
+
+
+def hour_of_day(ts_ms, tz=DISPLAY_TZ):
+    return ((local_ms(ts_ms, tz) % MS_PER_DAY) // MS_PER_HOUR).astype(np.int8)
+
+
+def minute_of_hour(ts_ms, tz=DISPLAY_TZ):
+    return ((local_ms(ts_ms, tz) % MS_PER_HOUR) // MS_PER_MINUTE).astype(np.int8)
+
+
+def weekday(ts_ms, tz=DISPLAY_TZ):
+    """День недели (понедельник = 0); 1970-01-01 был четвергом"""
+    return ((day_number(ts_ms, tz).astype(np.int64) + 3) % 7).astype(np.int8)
+
+
+def add_time_columns(df, ts_ms=None, tz=DISPLAY_TZ, source_tz=DATA_TZ):
+    """
+    Добавляет производные календарные столбцы одним проходом по int64.
+
+    Столбцы: ts_ms (мс UTC), ts (наивное время пояса tz), date, day, hour,
+    minute, weekday. Заменяет pd.to_datetime + .dt.date/.dt.hour/.dt.minute.
+
+    Строки без ts (NaT, None, NaN) отбрасываются: у них нет ни минуты, ни даты,
+    и в агрегаты они не попадают. В этом случае возвращается новый DataFrame,
+    поэтому результат нужно использовать (df = add_time_columns(df)).
+
+    Параметры:
+    df (pd.DataFrame): Данные со столбцом ts
+    ts_ms (np.ndarray): Уже разобранные мс (например, из кэша)
+    tz (str): Пояс для календарных полей
+    source_tz (str): Пояс наивных значений ts
+
+    Возвращает:
+    pd.DataFrame: df с новыми столбцами (без строк с пропущенным ts)
+    """
+    if ts_ms is None:
+        ts_ms = parse_ts(df['ts'], source_tz)
+    ts_ms = np.asarray(ts_ms, dtype=np.int64)
+    missing = ts_ms == MISSING_MS
+    if missing.any():
+        print(f"Пропущено строк без ts: {int(missing.sum()):,}")
+        df = df[~missing].copy()
+        ts_ms = ts_ms[~missing]
+    day = day_number(ts_ms, tz)
+
+    df['ts_ms'] = ts_ms
+    df['ts'] = to_datetime(ts_ms, tz)
+    df['day'] = day
+    df['date'] = day.astype('datetime64[D]')
+    df['hour'] = hour_of_day(ts_ms, tz)
+    df['minute'] = minute_of_hour(ts_ms, tz)
+    df['weekday'] = weekday(ts_ms, tz)
+    return df
+
+
+def add_time_columns_cached(df, file_path, tz=DISPLAY_TZ, source_tz=DATA_TZ):
+    """
+    То же, что add_time_columns, но разобранные ts_ms берутся из кэша рядом с файлом.
+
+    При первом запуске ts разбирается и сохраняется в .cache/<файл>.time-v<версия>-<пояс>.parquet;
+    повторные запуски пропускают разбор строк полностью.
+    """
+    kind = f'time-v{TIME_CACHE_VERSION}-{source_tz.replace("/", "_")}'
+    cached = load_cache(file_path, kind)
+    if cached is not None and len(cached) == len(df):
+        return add_time_columns(df, cached['ts_ms'].to_numpy(), tz, source_tz)
+
+    ts_ms = parse_ts(df['ts'], source_tz)
+    save_cache(file_path, kind, pd.DataFrame({'ts_ms': ts_ms}))
+    return add_time_columns(df, ts_ms, tz, source_tz)
@@ -0,0 +1,229 @@
+import numpy as np
+import pandas as pd
+
+from timestamps import DISPLAY_TZ, MS_PER_MINUTE, floor_ms, tz_offset_ms
+
+# Сколько счетчиков хранит один скетч. Оценка завышена не более чем на
+# floor <= N / DEFAULT_CAPACITY, где N - число событий в окне
+DEFAULT_CAPACITY = 100
+# Уровни окон: минута, час и сутки (в поясе вывода)
+LEVELS = {'minute': 1, 'hour': 60, 'day': 1440}
+
+
+def merge_sketches(entries, group_floors, capacity=DEFAULT_CAPACITY):
+    """
+    Слияние скетчей Space-Saving сразу для многих окон.
+
+    Оценка элемента в объединении - сумма его счетчиков; если в каком-то
+    скетче элемента нет, вместо счетчика берется floor этого скетча (верхняя
+    граница для отсутствующих). Из результата остаются capacity крупнейших,
+    а floor окна поднимается до первого отброшенного счетчика.
+
+    Параметры:
+    entries (pd.DataFrame): group, item, count, error, part_floor
+                            (part_floor - floor скетча, из которого строка)
+    group_floors (pd.Series): Сумма floor всех сливаемых скетчей по group
+
+    Возвращает:
+    tuple: (pd.DataFrame group, item, count, error; pd.Series floor по group)
+    """
+    merged = entries.groupby(['group', 'item'], sort=False, observed=True).agg(
+        count=('count', 'sum'), error=('error', 'sum'), present=('part_floor', 'sum')
+    ).reset_index()
+    missing = group_floors.reindex(merged['group']).to_numpy() - merged.pop('present').to_numpy()
+    merged['count'] += missing
+    merged['error'] += missing
+
+    merged = merged.sort_values(['group', 'count'], ascending=[True, False], kind='stable', ignore_index=True)
+    rank = merged.groupby('group', sort=False).cumcount().to_numpy()
+    dropped = merged[rank == capacity].set_index('group')['count']
+    floors = np.maximum(group_floors, dropped.reindex(group_floors.index, fill_value=0))
+    return merged[rank < capacity].reset_index(drop=True), floors.astype(np.int64)
+
+
+class SpaceSaving:
+    """
+    Скетч топ-K (Space-Saving): не более capacity счетчиков.
+
+    Для каждого элемента count - оценка сверху, count - error - оценка снизу;
+    любой отсутствующий элемент встречался не более floor раз.
+    """
+
+    def __init__(self, counts=None, errors=None, floor=0, capacity=DEFAULT_CAPACITY):
+        self.capacity = capacity
+        self.counts = counts if counts is not None else pd.Series(dtype=np.int64)
+        self.errors = errors if errors is not None else pd.Series(0, index=self.counts.index, dtype=np.int64)
+        self.floor = int(floor)
+
+    @classmethod
+    def from_items(cls, items, capacity=DEFAULT_CAPACITY):
+        """Скетч по массиву элементов одного окна"""
+        counts = pd.Series(items).value_counts()
+        floor = counts.iloc[capacity] if len(counts) > capacity else 0
+        counts = counts.head(capacity)
+        return cls(counts, pd.Series(0, index=counts.index, dtype=np.int64), floor, capacity)
+
+    def merge(self, *others):
+        """Объединение со скетчами других окон (результат - новый скетч)"""
+        sketches = (self,) + others
+        entries = pd.concat([
+            pd.DataFrame({'group': 0, 'item': s.counts.index, 'count': s.counts.to_numpy(),
+                          'error': s.errors.to_numpy(), 'part_floor': s.floor})
+            for s in sketches
+        ], ignore_index=True)
+        group_floors = pd.Series([sum(s.floor for s in sketches)], index=[0])
+        merged, floors = merge_sketches(entries, group_floors, self.capacity)
+        return SpaceSaving(pd.Series(merged['count'].to_numpy(), index=merged['item'].to_numpy()),
+                           pd.Series(merged['error'].to_numpy(), index=merged['item'].to_numpy()),
+                           floors.iloc[0], self.capacity)
+
+    def top(self, n=10):
+        """
+        Топ-n элементов с границами ошибки.
+
+        Возвращает:
+        pd.DataFrame: count (оценка), error (максимальное завышение), guaranteed
+                      (элемент точно входит в топ-n: нижняя граница не меньше
+                      верхней границы (n+1)-го и floor)
+        """
+        result = pd.DataFrame({'count': self.counts, 'error': self.errors}).sort_values(
+            'count', ascending=False, kind='stable').head(n + 1)
+        threshold = max(result['count'].iloc[n] if len(result) > n else 0, self.floor)
+        result = result.head(n)
+        result['guaranteed'] = (result['count'] - result['error']) >= threshold
+        return result
+
+
+class TopKWindows:
+    """
+    Скетчи Space-Saving по минутам, часам и суткам.
+
+    Запрос топа за произвольный диапазон сливает наименьшее число скетчей:
+    целые сутки, затем целые часы, затем оставшиеся минуты. Точные счетчики
+    по всем IP не строятся ни при добавлении, ни при запросе.
+    """
+
+    def __init__(self, capacity=DEFAULT_CAPACITY, tz=DISPLAY_TZ):
+        self.capacity = capacity
+        self.offset = tz_offset_ms(tz)
+        self.levels = {
+            name: (pd.DataFrame({'group': pd.Series(dtype=np.int64), 'item': pd.Series(dtype=object),
+                                 'count': pd.Series(dtype=np.int64), 'error': pd.Series(dtype=np.int64)}),
+                   pd.Series(dtype=np.int64))
+            for name in LEVELS
+        }
+
+    def _bucket(self, ts_ms, minutes):
+        """Начало окна длиной minutes в поясе вывода (в мс UTC)"""
+        return floor_ms(ts_ms + self.offset, minutes) - self.offset
+
+    def add(self, ts_ms, items):
+        """
+        Учитывает события (например, один файл): ts_ms - int64 мс UTC, items - IP.
+        """
+        ts_ms = np.asarray(ts_ms, dtype=np.int64)
+        items = np.asarray(items, dtype=object)
+        valid = pd.notna(items)
+        if not valid.any():
+            return self
+        counts = pd.DataFrame({'group': floor_ms(ts_ms[valid], 1), 'item': items[valid]}) \
+            .groupby(['group', 'item'], sort=False).size().rename('count').reset_index()
+        counts['error'] = 0
+        counts['part_floor'] = 0
+        minute_floors = pd.Series(0, index=np.unique(counts['group']), dtype=np.int64)
+        minutes, minute_floors = merge_sketches(counts, minute_floors, self.capacity)
+        minutes['part_floor'] = minute_floors.reindex(minutes['group']).to_numpy()
+
+        # Минутные скетчи файла сливаются в часовые и суточные, а окна, уже
+        # начатые предыдущими файлами, - с тем, что накоплено в них ранее
+        for name, step in LEVELS.items():
+            entries, floors = self.levels[name]
+            new_entries = minutes.assign(group=self._bucket(minutes['group'].to_numpy(), step))
+            new_floors = minute_floors.groupby(self._bucket(minute_floors.index.to_numpy(), step)).sum()
+            touched = floors.index.intersection(new_floors.index)
+            old = entries[entries['group'].isin(touched)]
+            parts = pd.concat([old.assign(part_floor=floors.reindex(old['group']).to_numpy()), new_entries],
+                              ignore_index=True)
+            group_floors = new_floors.add(floors.reindex(touched), fill_value=0).astype(np.int64)
+            merged, merged_floors = merge_sketches(parts, group_floors, self.capacity)
+            self.levels[name] = (
+                pd.concat([entries[~entries['group'].isin(touched)], merged], ignore_index=True),
+                pd.concat([floors.drop(touched), merged_floors]).sort_index(),
+            )
+        return self
+
+    def _cover(self, start_ms, end_ms):
+        """
+        Окна (уровень, начало), покрывающие [start_ms, end_ms) без пересечений.
+
+        Точность - минута: крайние минуты диапазона берутся целиком.
+        """
+        selected = []
+        covered = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+        for name in ('day', 'hour', 'minute'):
+            step = LEVELS[name] * MS_PER_MINUTE
+            buckets = self.levels[name][1].index.to_numpy(dtype=np.int64)
+            inside = (buckets >= start_ms) & (buckets + step <= end_ms)
+            if name == 'minute':
+                # Минуты берутся и на краях диапазона (ts округлены до минуты)
+                inside = (buckets >= floor_ms(start_ms, 1)) & (buckets < end_ms)
+            starts, ends = covered
+            position = np.searchsorted(starts, buckets, side='right') - 1
+            already = (position >= 0) & (buckets < np.append(ends, 0)[position])
+            chosen = buckets[inside & ~already]
+            selected.append((name, chosen))
+            merged_starts = np.concatenate([starts, chosen])
+            order = np.argsort(merged_starts)
+            covered = merged_starts[order], np.concatenate([ends, chosen + step])[order]
+        return selected
+
+    def query(self, start=None, end=None):
+        """
+        Скетч за диапазон [start, end) - наивные datetime в поясе вывода или мс UTC
+        (None - без ограничения).
+
+        Возвращает:
+        SpaceSaving: Слияние минимального набора оконных скетчей
+        """
+        start_ms = self._to_ms(start, np.iinfo(np.int64).min // 2)
+        end_ms = self._to_ms(end, np.iinfo(np.int64).max // 2)
+        parts, group_floor = [], 0
+        for name, buckets in self._cover(start_ms, end_ms):
+            entries, floors = self.levels[name]
+            part = entries[entries['group'].isin(buckets)]
+            parts.append(part.assign(part_floor=floors.reindex(part['group']).to_numpy(), group=0))
+            group_floor += int(floors.reindex(buckets).sum())
+        entries = pd.concat(parts, ignore_index=True)
+        if entries.empty:
+            return SpaceSaving(capacity=self.capacity)
+        merged, floors = merge_sketches(entries, pd.Series([group_floor], index=[0]), self.capacity)
+        return SpaceSaving(pd.Series(merged['count'].to_numpy(), index=merged['item'].to_numpy()),
+                           pd.Series(merged['error'].to_numpy(), index=merged['item'].to_numpy()),
+                           floors.iloc[0], self.capacity)
+
+    def top(self, n=10, start=None, end=None):
+        """Топ-n IP за диапазон с границами ошибки (см. SpaceSaving.top)"""
+        return self.query(start, end).top(n)
+
+    def checkpoint_parts(self, prefix='topk'):
+        """Скетчи всех уровней как таблицы для checkpoint.Checkpoint"""
+        parts = {}
+        for name, (entries, floors) in self.levels.items():
+            parts[f'{prefix}_{name}'] = entries
+            parts[f'{prefix}_{name}_floors'] = floors
+        return parts
+
+    def restore(self, parts, prefix='topk'):
+        """Восстанавливает скетчи из checkpoint_parts"""
+        for name in LEVELS:
+            entries = parts[f'{prefix}_{name}'].reset_index(drop=True)
+            floors = parts[f'{prefix}_{name}_floors'].astype(np.int64)
+            self.levels[name] = (entries, floors)
+        return self
+
+    def _to_ms(self, value, default):
+        if value is None:
+            return default
+        if isinstance(value, (int, np.integer)):
+            return int(value)
+        return int(np.datetime64(pd.Timestamp(value), 'ms').astype(np.int64)) - self.offset
@@ -0,0 +1,97 @@
+"""
+Бюджеты времени и памяти для функций загрузки, агрегации и детекторов
+на тестовом наборе (tests/fixture_data.py: 3 файла по 20 000 строк).
+
+Бюджет - это потолок, а не ожидаемое значение: он задан с запасом в
+несколько раз над замером, чтобы тесты не зависели от загрузки машины,
+но ловили возврат к построчным циклам и полным копиям данных.
+Бюджет времени не бывает меньше MIN_SECONDS: более короткие замеры на общей
+машине CI зависят от планировщика больше, чем от кода. Превышение
+перемеряется до TIME_ATTEMPTS раз, и в зачет идет лучшее время.
+Если оптимизация сделала функцию заметно быстрее, бюджет стоит уменьшить.
+
+Время умножается на DATA_OUTLIERS_BUDGET_SCALE (например, 3 на медленной
+машине CI). Память - пик выделений Python и NumPy по tracemalloc
+(буферы Arrow в него не входят).
+"""
+import gc
+import os
+import time
+import tracemalloc
+
+SCALE_ENV_VAR = 'DATA_OUTLIERS_BUDGET_SCALE'
+MIN_SECONDS = 0.5
+TIME_ATTEMPTS = 3
+
+# Функция: (секунды, мегабайты)
+BUDGETS = {
+    'iter_data_files': (1.0, 15),
+    'iter_data_files_row_groups': (1.0, 10),
+    'load_all_data': (0.5, 25),
+    'compute_bot_flags': (0.5, 5),
+    'detect_anomalies': (1.0, 30),
+    'detect_anomalies_streaming': (1.5, 40),
+    'summarize_files': (3.0, 60),
+    'top_bot_activity': (0.5, 30),
+    'topk_windows_add': (1.0, 100),
+    'analyze_data': (2.0, 15),
+    'epg_find_shows': (0.5, 20),
+    'detect_page_number_anomalies': (0.5, 15),
+    'session_store_add': (0.5, 10),
+    'detect_page_number_anomalies_sharded': (2.0, 15),
+    'local_maxima': (0.5, 40),
+    'grouped_diffs': (0.5, 50),
+    'stab_intervals': (0.5, 80),
+    'load_catalog': (0.5, 10),
+}
+
+
+def time_scale():
+    return float(os.environ.get(SCALE_ENV_VAR, 1))
+
+
+def best_seconds(func, *args, limit=None, **kwargs):
+    """
+    Время выполнения func: повторные замеры (до TIME_ATTEMPTS) делаются,
+    только пока время выше limit, и в зачет идет лучшее.
+    """
+    best = None
+    for _ in range(TIME_ATTEMPTS):
+        gc.collect()
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        seconds = time.perf_counter() - start
+        del result
+        best = seconds if best is None else min(best, seconds)
+        if limit is None or best <= limit:
+            break
+    return best
+
+
+def measure(func, *args, seconds_limit=None, **kwargs):
+    """
+    Выполняет func без трассировки (время, см. best_seconds) и под tracemalloc (пик памяти).
+
+    Возвращает:
+    tuple: (результат, секунды, пик в мегабайтах)
+    """
+    seconds = best_seconds(func, *args, limit=seconds_limit, **kwargs)
+
+    gc.collect()
+    tracemalloc.start()
+    try:
+        result = func(*args, **kwargs)
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return result, seconds, peak / (1 << 20)
+
+
+def check_budget(name, func, *args, **kwargs):
+    """Замеряет func и падает, если превышен бюджет BUDGETS[name]"""
+    seconds_limit, megabytes_limit = BUDGETS[name]
+    seconds_limit = max(seconds_limit, MIN_SECONDS) * time_scale()
+    result, seconds, megabytes = measure(func, *args, seconds_limit=seconds_limit, **kwargs)
+    assert seconds <= seconds_limit, f"{name}: {seconds:.3f} с при бюджете {seconds_limit:.3f} с"
+    assert megabytes <= megabytes_limit, f"{name}: {megabytes:.1f} МБ при бюджете {megabytes_limit} МБ"
+    return result
@@ -0,0 +1,65 @@
+import os
+import shutil
+import sys
+
+import matplotlib
+import pandas as pd
+import pytest
+
+matplotlib.use('Agg')
+
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(TESTS_DIR), 'code'))
+sys.path.insert(0, TESTS_DIR)
+
+from fixture_data import make_dataset, make_epg  # noqa: E402
+
+GOLDEN_DIR = os.path.join(TESTS_DIR, 'golden')
+
+
+def pytest_addoption(parser):
+    parser.addoption('--update-golden', action='store_true',
+                     help="Перезаписать эталонные CSV в tests/golden текущими выходами")
+
+
+@pytest.fixture(scope='session')
+def dataset_dir(tmp_path_factory):
+    """Папка с тестовой выгрузкой (data_<день>.parquet)"""
+    folder = tmp_path_factory.mktemp('dataset')
+    make_dataset(str(folder))
+    return str(folder)
+
+
+@pytest.fixture(scope='session')
+def dataset_files(dataset_dir):
+    return sorted(os.path.join(dataset_dir, name) for name in os.listdir(dataset_dir)
+                  if name.endswith('.parquet'))
+
+
+@pytest.fixture(scope='session')
+def epg_file(tmp_path_factory):
+    return make_epg(str(tmp_path_factory.mktemp('epg') / 'epg.csv'))
+
+
+class Golden:
+    """Сравнение CSV с эталоном из tests/golden (или его перезапись при --update-golden)"""
+
+    def __init__(self, update):
+        self.update = update
+
+    def check(self, actual_path, golden_name):
+        golden_path = os.path.join(GOLDEN_DIR, golden_name)
+        if self.update:
+            os.makedirs(GOLDEN_DIR, exist_ok=True)
+            shutil.copyfile(actual_path, golden_path)
+            return
+        assert os.path.exists(golden_path), f"Нет эталона {golden_name}: запустите pytest --update-golden"
+        actual = pd.read_csv(actual_path)
+        expected = pd.read_csv(golden_path)
+        assert list(actual.columns) == list(expected.columns)
+        pd.testing.assert_frame_equal(actual, expected, check_exact=False, rtol=1e-9)
+
+
+@pytest.fixture
+def golden(request):
+    return Golden(request.config.getoption('--update-golden'))
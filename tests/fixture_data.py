@@ -0,0 +1,149 @@
+"""
+Детерминированный набор данных для тестов: несколько дней выгрузки в формате
+реальных parquet-файлов (data_ГГГГ-ММ-ДД.parquet) и телепрограмма к ним.
+
+Данные полностью задаются SEED, поэтому эталонные выходы (tests/golden)
+воспроизводятся на любой машине.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+SEED = 20241001
+DAYS = ['2024-10-01', '2024-10-02', '2024-10-03']
+ROWS_PER_DAY = 20_000
+ROW_GROUP_SIZE = 5_000
+HUMAN_IPS = 1_500
+USERS = 800
+
+# Суточный профиль (доля трафика по часам): ночной спад и вечерний прайм-тайм
+HOURLY_PROFILE = np.array([
+    2, 1, 1, 1, 1, 1, 2, 3, 4, 5, 5, 5,
+    5, 5, 5, 5, 6, 7, 9, 10, 10, 8, 5, 3,
+], dtype=np.float64)
+
+# Всплески: (время начала в поясе данных, минут, событий в минуту)
+SPIKES = {
+    '2024-10-01': [('19:30', 3, 250), ('03:10', 2, 200)],
+    '2024-10-02': [('21:05', 4, 220)],
+    '2024-10-03': [('12:40', 2, 300), ('20:15', 3, 180)],
+}
+
+# Боты: явно помеченные, с UA робота и «тихие» (выдают себя только числом запросов)
+EXPLICIT_BOTS = ['192.0.2.1', '192.0.2.2', '192.0.2.3']
+UA_BOTS = ['198.51.100.7', '198.51.100.8']
+HEAVY_IPS = ['203.0.113.50']
+
+EVENTS = ['page_view', 'page_view', 'page_view', 'click', 'scroll']
+HUMAN_UA = ['Mozilla/5.0 (Windows NT 10.0)', 'Mozilla/5.0 (iPhone)', 'Mozilla/5.0 (Linux; Android 14)']
+BOT_UA = 'Mozilla/5.0 (compatible; Googlebot/2.1)'
+
+
+def _day_events(day, rng):
+    """Моменты событий одного дня (секунды от полуночи) с учетом профиля и всплесков"""
+    n = ROWS_PER_DAY - sum(minutes * per_minute for _, minutes, per_minute in SPIKES[day])
+    hours = rng.choice(24, size=n, p=HOURLY_PROFILE / HOURLY_PROFILE.sum())
+    seconds = hours * 3600 + rng.integers(0, 3600, size=n)
+    for start, minutes, per_minute in SPIKES[day]:
+        hour, minute = map(int, start.split(':'))
+        base = hour * 3600 + minute * 60
+        spike = base + rng.integers(0, minutes * 60, size=minutes * per_minute)
+        seconds = np.concatenate([seconds, spike])
+    return np.sort(seconds)
+
+
+def _sources(n, rng):
+    """IP, признак бота и UA для n событий"""
+    ip = np.array([f'10.{i // 250}.{i % 250}.{(i * 7) % 250 + 1}' for i in range(HUMAN_IPS)], dtype=object)
+    weights = 1.0 / (np.arange(HUMAN_IPS) + 20)
+    ip = ip[rng.choice(HUMAN_IPS, size=n, p=weights / weights.sum())]
+    ua = np.array(HUMAN_UA, dtype=object)[rng.integers(0, len(HUMAN_UA), size=n)]
+    ua_is_bot = np.zeros(n, dtype=np.int64)
+
+    special = rng.random(n)
+    explicit = special < 0.03
+    ip[explicit] = np.array(EXPLICIT_BOTS, dtype=object)[rng.integers(0, len(EXPLICIT_BOTS), size=explicit.sum())]
+    ua_is_bot[explicit] = 1
+    ua_bot = (special >= 0.03) & (special < 0.045)
+    ip[ua_bot] = np.array(UA_BOTS, dtype=object)[rng.integers(0, len(UA_BOTS), size=ua_bot.sum())]
+    ua[ua_bot] = BOT_UA
+    heavy = (special >= 0.045) & (special < 0.055)
+    ip[heavy] = HEAVY_IPS[0]
+    return ip, ua_is_bot, ua
+
+
+def _sessions(n, rng):
+    """Пользователь, сессия и номер просмотра с редкими сбросами и пропусками нумерации"""
+    users = rng.integers(0, USERS, size=n)
+    sessions = rng.integers(0, 3, size=n)
+    frame = pd.DataFrame({'user': users, 'session': sessions})
+    numbers = frame.groupby(['user', 'session']).cumcount().to_numpy() + 1
+    broken = rng.random(n)
+    numbers = np.where(broken < 0.004, 1, numbers)                                     # reset
+    numbers = np.where((broken >= 0.004) & (broken < 0.008), numbers + rng.integers(2, 5, size=n), numbers)  # skip
+    return ([f'u{u:05d}' for u in users], [f'u{u:05d}-s{s}' for u, s in zip(users, sessions)],
+            numbers.astype(np.int64))
+
+
+def make_day(day, rng):
+    """DataFrame одного дня в формате выгрузки (строки по возрастанию ts)"""
+    seconds = _day_events(day, rng)
+    n = len(seconds)
+    ts = pd.Timestamp(day) + pd.to_timedelta(seconds, unit='s')
+    ip, ua_is_bot, ua = _sources(n, rng)
+    users, sessions, numbers = _sessions(n, rng)
+    df = pd.DataFrame({
+        'ts': ts.strftime('%Y-%m-%d %H:%M:%S'),
+        'ip': ip,
+        'ua_is_bot': ua_is_bot,
+        'ua_header': ua,
+        'event': np.array(EVENTS, dtype=object)[rng.integers(0, len(EVENTS), size=n)],
+        'randPAS_user_agent_id': users,
+        'randPAS_session_id': sessions,
+        'page_view_order_number': numbers,
+        'node_id': np.where(rng.random(n) < 0.01, None, 'node-1'),
+    })
+    return df
+
+
+def make_dataset(folder, days=DAYS, seed=SEED):
+    """
+    Записывает data_<день>.parquet в folder.
+
+    Возвращает:
+    list: Пути к файлам
+    """
+    os.makedirs(folder, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    paths = []
+    for day in days:
+        path = os.path.join(folder, f'data_{day}.parquet')
+        table = pa.Table.from_pandas(make_day(day, rng), preserve_index=False)
+        pq.write_table(table, path, row_group_size=ROW_GROUP_SIZE)
+        paths.append(path)
+    return paths
+
+
+def make_epg(path):
+    """Телепрограмма: двухчасовые блоки на трех каналах, футбол и новости вечером"""
+    rows = []
+    for day in pd.date_range(DAYS[0], periods=len(DAYS) + 1, freq='D'):
+        for channel, shift in ((1, 0), (2, 60), (3, 30)):
+            for start in range(0, 24 * 60, 120):
+                begin = day + pd.Timedelta(minutes=start + shift)
+                hour = begin.hour
+                if 18 <= hour < 23:
+                    title, event_type = ('Футбол', 'Футбол') if channel == 1 else ('Вечерние новости', 'Новости')
+                elif 6 <= hour < 12:
+                    title, event_type = 'Утреннее шоу', 'Развлечения'
+                elif hour < 6:
+                    title, event_type = 'Ночной эфир', 'Прочее'
+                else:
+                    title, event_type = f'Сериал {channel}', 'Сериал'
+                rows.append({'start_ts': begin.strftime('%Y-%m-%d %H:%M'), 'dur': 7200,
+                             'title': title, 'event_type': event_type, 'channel_id': channel})
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
@@ -0,0 +1,148 @@
+"""
+Эталонные (медленные, но очевидно правильные) реализации, с которыми
+сравниваются оптимизированные версии из code/.
+"""
+import numpy as np
+import pandas as pd
+from scipy.signal import argrelextrema
+
+
+def grouped_diffs(groups, values):
+    """Построчный цикл: номер строки в группе и предыдущее значение группы"""
+    n = len(groups)
+    position = np.zeros(n, dtype=np.int64)
+    prev = np.zeros(n, dtype=np.int64)
+    has_prev = np.zeros(n, dtype=bool)
+    for i in range(1, n):
+        if groups[i] == groups[i - 1]:
+            position[i] = position[i - 1] + 1
+            prev[i] = values[i - 1]
+            has_prev[i] = True
+    return position, prev, has_prev
+
+
+def rolling_max(values, window):
+    """Максимум по окну через pandas"""
+    return pd.Series(values, dtype=np.float64).rolling(window, min_periods=1).max().to_numpy()
+
+
+def local_maxima(values, order):
+    """Строгие локальные максимумы scipy (как в исходной версии activity_spikes_analysis)"""
+    return argrelextrema(np.asarray(values, dtype=np.float64), np.greater, order=order)[0]
+
+
+def stab_intervals(starts, ends, points):
+    """Полный перебор пар (точка, интервал)"""
+    pairs = [(q, c) for q, point in enumerate(points)
+             for c in range(len(starts)) if starts[c] <= point <= ends[c]]
+    if not pairs:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    query, candidate = np.array(pairs, dtype=np.int64).T
+    return query, candidate
+
+
+def detect_page_number_anomalies(df, user_id_column='randPAS_user_agent_id',
+                                 session_id_column='randPAS_session_id'):
+    """Исходный цикл по сессиям из page_view_anomalies (до векторизации)"""
+    anomalies = []
+    for (user_id, session_id), group in df.groupby([user_id_column, session_id_column]):
+        page_numbers = group['page_view_order_number'].values.astype(np.int64)
+        for i in range(1, len(page_numbers)):
+            prev_num = page_numbers[i - 1]
+            current_num = page_numbers[i]
+            delta = current_num - prev_num
+            if current_num < prev_num or delta > 1:
+                anomalies.append({
+                    'user_id': user_id,
+                    'session_id': session_id,
+                    'event_index': i,
+                    'page_view_order_number': current_num,
+                    'previous_number': prev_num,
+                    'delta': delta,
+                    'anomaly_type': 'reset' if current_num < prev_num else 'skip',
+                })
+    return pd.DataFrame(anomalies)
+
+
+def interval_activity(df, interval_minutes=5):
+    """Агрегация detect_anomalies через dt.floor и поэлементную lambda (исходная версия)"""
+    df = df.assign(time_interval=pd.to_datetime(df['ts']).dt.floor(f'{interval_minutes}min'))
+    return df.groupby('time_interval').agg(
+        requests=('ip', 'count'),
+        unique_ips=('ip', 'nunique'),
+        bot_ratio=('is_bot', 'mean'),
+        bot_count=('is_bot', 'sum'),
+        human_count=('is_bot', lambda x: (~x).sum()),
+    ).reset_index()
+
+
+def device_usage(df):
+    """
+    analyze_device_usage из device_of_user.ipynb (groupby по сессиям).
+
+    Многоустройственная сессия - с несколькими разными типами устройств
+    (max по флагам, как num_multi_device_users блокнота).
+    """
+    flags = ['ua_is_tablet', 'ua_is_pc', 'ua_is_mobile']
+    sessions = df.groupby('randPAS_session_id')[flags].max()
+    multi = sessions[sessions.sum(axis=1) > 1].index
+    n_sessions = df['randPAS_session_id'].nunique()
+    proportions = sessions.sum() / n_sessions
+    proportions['Multi-Device'] = len(multi) / n_sessions
+    multi_device_sessions = int(df['randPAS_session_id'].isin(multi).sum())
+    return {
+        'device_proportions': proportions[['ua_is_pc', 'ua_is_mobile', 'ua_is_tablet', 'Multi-Device']],
+        'hourly_data': df.groupby(pd.to_datetime(df['ts']).dt.hour)['randPAS_session_id'].nunique(),
+        'multi_device_sessions': multi_device_sessions,
+        'single_device_sessions': len(df) - multi_device_sessions,
+        'multi_device_session_count': len(multi),
+    }
+
+
+def top_bots(df, top_n=10):
+    """print_top_bots из исходного anomaly_without_tag_bot: request_count через merge с value_counts"""
+    request_count = df['ip'].value_counts().rename('request_count')
+    df = df.merge(request_count.to_frame(), left_on='ip', right_index=True)
+    return df[df['is_bot']].groupby('ip').agg(
+        total_requests=('request_count', 'max'),
+        first_seen=('ts', 'min'),
+        last_seen=('ts', 'max'),
+        is_hidden=('is_hidden_bot', 'any')
+    ).sort_values('total_requests', ascending=False).head(top_n)
+
+
+def preprocess_page_views(file_path):
+    """load_and_preprocess_data из PageViewOrderNumber.ipynb: дубликаты по строкам с массивами в str, без ботов"""
+    df = pd.read_parquet(file_path)
+    temp_df = df.copy()
+    for col in temp_df.columns:
+        if isinstance(temp_df[col].iloc[0], (np.ndarray, list)):
+            temp_df[col] = temp_df[col].apply(lambda x: str(x))
+    df = df.loc[temp_df.drop_duplicates().index]
+    return df[df['ua_is_bot'] != 1]
+
+
+def activity_spikes(files, schedule_file):
+    """
+    Шаги 1-5 analyze_data из исходного activity_spikes_analysis: поминутный ряд
+    page_view, локальные максимумы argrelextrema, топ-10 и передачи в эфире
+    (перебором расписания для каждого пика).
+    """
+    data = pd.concat([pd.read_parquet(f, columns=['event', 'ts']) for f in files])
+    data = data[data['event'] == 'page_view']
+    data['ts'] = pd.to_datetime(data['ts'])
+    activity = data.groupby(data['ts'].dt.floor('min')).size().reset_index(name='requests')
+    activity['local_max'] = activity.iloc[argrelextrema(activity['requests'].values, np.greater,
+                                                        order=10)[0]]['requests']
+    peaks = activity.nlargest(10, 'requests')
+
+    schedule_df = pd.read_csv(schedule_file)
+    schedule_df['start_ts'] = pd.to_datetime(schedule_df['start_ts'])
+    schedule_df['end_ts'] = schedule_df['start_ts'] + pd.to_timedelta(schedule_df['dur'], unit='s')
+
+    def find_show(timestamp):
+        show = schedule_df[(schedule_df['start_ts'] <= timestamp) & (schedule_df['end_ts'] >= timestamp)]
+        return show[['title', 'event_type', 'channel_id']].to_dict(orient='records')
+
+    peaks['matched_shows'] = peaks['ts'].apply(find_show).apply(str)
+    return activity, peaks
@@ -0,0 +1,82 @@
+"""
+Сезонная база (baseline_detector): потоковый OnlineBaseline совпадает с
+пакетным seasonal_baseline + cusum, в том числе когда в ряду пропущены минуты.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from baseline_detector import OnlineBaseline, cusum, detect_baseline_spikes, fill_missing_minutes, seasonal_baseline
+
+
+def minute_activity(days, seed=0):
+    """Суточный профиль с шумом, всплеском в 3 часа ночи, выпавшими минутами и часом без данных"""
+    rng = np.random.default_rng(seed)
+    ts = pd.date_range('2024-10-01 05:17', periods=days * 1440 - 400, freq='min')
+    hour = ts.hour.to_numpy()
+    requests = rng.poisson(np.where((hour >= 18) & (hour < 23), 80, np.where(hour < 6, 5, 30)))
+    requests[(ts.day == 5) & (hour == 3)] += 60
+    activity = pd.DataFrame({'ts': ts, 'requests': requests})
+    keep = (rng.random(len(ts)) > 0.05) & ~((ts.day == 3) & (hour == 14))
+    return activity[keep & (requests > 0)].reset_index(drop=True)
+
+
+def online(activity, **kwargs):
+    detector = OnlineBaseline(**kwargs)
+    return pd.DataFrame([detector.update(ts, requests) for ts, requests in
+                         zip(activity['ts'], activity['requests'])])
+
+
+@pytest.mark.parametrize('days, options', [(10, {}), (10, {'window': 3}), (22, {'weekly': True, 'window': 2})])
+def test_online_matches_batch(days, options):
+    activity = minute_activity(days)
+    actual = online(activity, **options)
+    expected = seasonal_baseline(activity, **options)
+    np.testing.assert_allclose(actual['baseline'], expected['baseline'])
+    np.testing.assert_allclose(actual['score'], np.nan_to_num(expected['score']))
+
+    # CUSUM - по всем минутам, пропущенные считаются нулевыми
+    full = seasonal_baseline(fill_missing_minutes(activity), **options)
+    stat, _ = cusum(full['score'].to_numpy())
+    present = full['ts'].isin(activity['ts']).to_numpy()
+    np.testing.assert_allclose(actual['cusum'], stat[present])
+
+    spikes = detect_baseline_spikes(activity, top_n=len(activity), **options)
+    assert set(actual.loc[actual['is_spike'], 'ts']) == set(spikes['ts'])
+    assert len(spikes)
+
+
+def test_fill_missing_minutes():
+    activity = pd.DataFrame({'ts': pd.to_datetime(['2024-10-01 00:00', '2024-10-01 00:03']),
+                             'requests': [5, 7]})
+    filled = fill_missing_minutes(activity)
+    assert filled['requests'].tolist() == [5, 0, 0, 7]
+    assert filled['ts'].diff().dropna().eq(pd.Timedelta(minutes=1)).all()
+
+
+@pytest.mark.parametrize('options', [{'window': 2}, {'window': 3}, {'weekly': True, 'window': 1}])
+def test_online_after_outage(options):
+    """Простой длиннее window сезонов: нули дописываются без перебора минут, результат как у пакетной версии"""
+    activity = minute_activity(22, seed=1)
+    day = activity['ts'].dt.day
+    activity = activity[(day < 6) | (day > 15)].reset_index(drop=True)
+
+    class CountingBaseline(OnlineBaseline):
+        calls = 0
+
+        def _score(self, minute, requests):
+            CountingBaseline.calls += 1
+            return super()._score(minute, requests)
+
+    detector = CountingBaseline(**options)
+    actual = pd.DataFrame([detector.update(ts, requests) for ts, requests in
+                           zip(activity['ts'], activity['requests'])])
+    # Почти все пропущенные минуты (в том числе 10 дней простоя) учтены без _score
+    assert CountingBaseline.calls < 1.2 * len(activity)
+
+    expected = seasonal_baseline(activity, **options)
+    np.testing.assert_allclose(actual['baseline'], expected['baseline'])
+    np.testing.assert_allclose(actual['score'], np.nan_to_num(expected['score']))
+    full = seasonal_baseline(fill_missing_minutes(activity), **options)
+    stat, _ = cusum(full['score'].to_numpy())
+    np.testing.assert_allclose(actual['cusum'], stat[full['ts'].isin(activity['ts']).to_numpy()])
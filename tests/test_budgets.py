@@ -0,0 +1,189 @@
+"""
+Бюджеты времени и памяти (tests/budgets.py) для загрузчиков, агрегаций и
+детекторов, а также проверки того, что оптимизированные версии быстрее
+эталонных циклов из tests/reference.py.
+"""
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import kernels
+import reference
+from activity_spikes_analysis import analyze_data
+from activity_spikes_isolation import detect_anomalies, detect_anomalies_streaming, load_all_data
+from anomaly_without_tag_bot import detect_hidden_bots, top_bot_activity
+from bot_labels import compute_bot_flags
+from budgets import BUDGETS, check_budget
+from data_loader import iter_data_files
+from dataset_catalog import load_catalog
+from epg import Epg
+from night_activity_analysis import summarize_files
+from page_view_anomalies import (detect_page_number_anomalies, detect_page_number_anomalies_sharded,
+                                 load_and_preprocess_data)
+from session_store import SessionStore
+from sharding import ShardWriter
+from topk_sketch import TopKWindows
+
+
+@pytest.fixture(scope='module')
+def loaded(dataset_dir):
+    """Все данные фикстуры в памяти (с производными столбцами и метками ботов)"""
+    return load_all_data(dataset_dir)
+
+
+@pytest.fixture(scope='module')
+def page_views(dataset_files):
+    return load_and_preprocess_data(dataset_files[0])
+
+
+def consume(iterator):
+    """Прочитать все блоки, не удерживая их в памяти"""
+    rows = 0
+    for _, df in iterator:
+        rows += len(df)
+    return rows
+
+
+def summarize(dataset_dir):
+    with ShardWriter('ip', n_shards=4) as shards:
+        return summarize_files(dataset_dir, TopKWindows(), shards)
+
+
+def test_budget_table_is_covered():
+    tested = {name.split('[')[0] for name in globals()}
+    assert all(f'test_{name}' in tested for name in BUDGETS)
+
+
+def test_iter_data_files(dataset_dir):
+    check_budget('iter_data_files', lambda: consume(iter_data_files(
+        dataset_dir, prefetch=2, derive_time=True, derive_bots=True)))
+
+
+def test_iter_data_files_row_groups(dataset_dir):
+    check_budget('iter_data_files_row_groups', lambda: consume(iter_data_files(
+        dataset_dir, prefetch=2, row_groups=True, derive_time=True, derive_bots=True)))
+
+
+def test_load_all_data(dataset_dir):
+    check_budget('load_all_data', load_all_data, dataset_dir)
+
+
+def test_compute_bot_flags(dataset_files):
+    df = pd.read_parquet(dataset_files[0])
+    check_budget('compute_bot_flags', compute_bot_flags, df)
+
+
+def test_detect_anomalies(loaded):
+    check_budget('detect_anomalies', lambda: detect_anomalies(loaded.copy()))
+
+
+def test_detect_anomalies_streaming(dataset_dir, tmp_path):
+    # Без чекпоинта с прошлого запуска: каждый замер читает все файлы
+    def run():
+        return detect_anomalies_streaming(dataset_dir,
+                                          checkpoint_dir=str(tmp_path / f'checkpoint-{time.perf_counter_ns()}'))
+    check_budget('detect_anomalies_streaming', run)
+
+
+def test_summarize_files(dataset_dir):
+    check_budget('summarize_files', summarize, dataset_dir)
+
+
+def test_top_bot_activity(loaded):
+    df = detect_hidden_bots(loaded.copy())
+    check_budget('top_bot_activity', top_bot_activity, df)
+
+
+def test_topk_windows_add(loaded):
+    check_budget('topk_windows_add', lambda: TopKWindows().add(loaded['ts_ms'], loaded['ip']))
+
+
+def test_analyze_data(dataset_dir, epg_file, tmp_path):
+    # Без чекпоинта с прошлого запуска: каждый замер читает все файлы
+    def run():
+        analyze_data(os.path.join(dataset_dir, '*.parquet'), epg_file,
+                     checkpoint_dir=str(tmp_path / f'checkpoint-{time.perf_counter_ns()}'),
+                     output_dir=str(tmp_path / 'output'))
+    check_budget('analyze_data', run)
+
+
+def test_epg_find_shows(epg_file):
+    epg = Epg(epg_file)
+    points = np.linspace(epg.starts.min(), epg.ends.max(), 5_000).astype(np.int64)
+    check_budget('epg_find_shows', epg.find_shows, points)
+
+
+def test_detect_page_number_anomalies(page_views):
+    check_budget('detect_page_number_anomalies', lambda: detect_page_number_anomalies(page_views.copy()))
+
+
+def test_session_store_add(page_views):
+    check_budget('session_store_add', lambda: SessionStore().add(page_views))
+
+
+def test_detect_page_number_anomalies_sharded(dataset_files):
+    check_budget('detect_page_number_anomalies_sharded', detect_page_number_anomalies_sharded,
+                 dataset_files, n_shards=4, n_workers=2)
+
+
+def test_local_maxima():
+    values = np.random.default_rng(0).integers(0, 1000, size=200_000)
+    check_budget('local_maxima', kernels.local_maxima, values, 10)
+
+
+def test_grouped_diffs():
+    rng = np.random.default_rng(0)
+    groups = np.sort(rng.integers(0, 50_000, size=500_000))
+    check_budget('grouped_diffs', kernels.grouped_diffs, groups, rng.integers(0, 100, size=500_000))
+
+
+def test_stab_intervals():
+    rng = np.random.default_rng(0)
+    # Телепрограмма на 10 суток по двадцати каналам, передачи до двух часов
+    starts = np.sort(rng.integers(0, 864_000_000, size=5_000))
+    ends = starts + rng.integers(600_000, 7_200_000, size=5_000)
+    points = rng.integers(0, 864_000_000, size=20_000)
+    check_budget('stab_intervals', kernels.stab_intervals, starts, ends, points, 7_200_000)
+
+
+def test_load_catalog(dataset_dir):
+    # Индекс уже построен: сводка собирается без чтения футеров
+    load_catalog(dataset_dir, sketches=True)
+    catalog = check_budget('load_catalog', load_catalog, dataset_dir, sketches=True)
+    assert catalog.summary()['rows'] == 60_000
+
+
+def best_time(func, *args, repeat=3):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(*args)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def test_page_anomalies_faster_than_loop(page_views):
+    fast = best_time(lambda: detect_page_number_anomalies(page_views.copy()))
+    slow = best_time(lambda: reference.detect_page_number_anomalies(page_views.copy()), repeat=1)
+    assert fast * 5 < slow, f"векторная версия {fast:.3f} с, цикл {slow:.3f} с"
+
+
+def test_grouped_diffs_faster_than_loop():
+    rng = np.random.default_rng(0)
+    groups = np.sort(rng.integers(0, 5_000, size=100_000))
+    values = rng.integers(0, 100, size=100_000)
+    fast = best_time(kernels.grouped_diffs, groups, values)
+    slow = best_time(reference.grouped_diffs, groups, values, repeat=1)
+    assert fast * 5 < slow, f"ядро {fast:.3f} с, цикл {slow:.3f} с"
+
+
+def test_stab_intervals_faster_than_scan(epg_file):
+    epg = Epg(epg_file)
+    starts, ends = epg.shows['start_ms'].to_numpy(), epg.shows['end_ms'].to_numpy()
+    points = np.linspace(starts.min(), ends.max(), 500).astype(np.int64)
+    fast = best_time(epg.on_air, points)
+    slow = best_time(reference.stab_intervals, starts, ends, points, repeat=1)
+    assert fast * 5 < slow, f"индекс {fast:.3f} с, перебор {slow:.3f} с"
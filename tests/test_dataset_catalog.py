@@ -0,0 +1,130 @@
+"""
+Каталог по футерам parquet (dataset_catalog) согласуется с полной загрузкой:
+объем, период, пропуски, отбор row groups по времени и оценка уникальных IP.
+"""
+import os
+import shutil
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import pytest
+
+from anomaly_without_tag_bot import activity_summary, detect_hidden_bots
+from data_loader import iter_data_files
+from dataset_catalog import catalog_dir, catalog_overview, load_catalog, print_profile
+from night_activity_analysis import extended_tables, load_all_data
+
+
+@pytest.fixture
+def folder(dataset_files, tmp_path):
+    """Копия набора: каталог в ней можно дополнять и портить"""
+    for file_path in dataset_files:
+        shutil.copy(file_path, tmp_path)
+    return str(tmp_path)
+
+
+def test_profile_matches_data(dataset_dir, capsys):
+    df = load_all_data(dataset_dir)
+    summary = print_profile(load_catalog(dataset_dir, sketches=True))
+    assert summary['rows'] == len(df)
+    assert summary['date_min'] == df['ts'].min()
+    assert summary['date_max'] == df['ts'].max()
+    assert summary['unique_ips'] == pytest.approx(df['ip'].nunique(), rel=0.05)
+    assert summary['null_counts']['node_id'] == df['node_id'].isna().sum()
+    assert summary['missing_columns'] == {}
+    assert "Профиль набора данных" in capsys.readouterr().out
+
+
+def test_reports_take_overview_from_catalog(dataset_dir):
+    df = detect_hidden_bots(load_all_data(dataset_dir))
+    summary = load_catalog(dataset_dir, sketches=True).summary()
+    for tables in (activity_summary(df, summary), extended_tables(df, summary)):
+        assert {key: tables[key] for key in catalog_overview(summary)} == catalog_overview(summary)
+        assert tables['rows'] == len(df)
+        assert tables['unique_ips'] == pytest.approx(df['ip'].nunique(), rel=0.05)
+        assert tables['bots'] == df['is_bot'].sum()
+
+    # Чего каталог не знает (период при ts не в ISO), считается по данным
+    unknown = dict(summary, date_min=None, date_max=None, unique_ips=None)
+    tables = extended_tables(df, unknown)
+    assert (tables['date_min'], tables['date_max']) == (df['date'].min(), df['date'].max())
+    assert tables['unique_ips'] == df['ip'].nunique()
+
+
+def test_row_groups_in_range(dataset_dir):
+    catalog = load_catalog(dataset_dir)
+    start, end = pd.Timestamp('2024-10-02 03:00'), pd.Timestamp('2024-10-02 04:00')
+    selection = catalog.row_groups_in_range(start, end)
+    assert sum(map(len, selection.values())) < len(catalog.row_groups)
+
+    def hour_rows(frames):
+        df = pd.concat([df for _, df in frames], ignore_index=True)
+        return df[(df['ts'] >= start) & (df['ts'] < end)].reset_index(drop=True)
+
+    expected = hour_rows(iter_data_files(dataset_dir, derive_time=True))
+    actual = hour_rows(iter_data_files(list(selection), row_groups=selection, derive_time=True))
+    assert len(expected)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+def test_row_groups_with_nulls(dataset_files):
+    catalog = load_catalog(dataset_files)
+    selection = catalog.row_groups_with_nulls('node_id')
+    for file_path in dataset_files:
+        parquet_file = pq.ParquetFile(file_path)
+        expected = [i for i in range(parquet_file.num_row_groups)
+                    if parquet_file.read_row_group(i, columns=['node_id']).column(0).null_count]
+        assert selection.get(file_path, []) == expected
+
+
+def test_index_is_incremental(folder, capsys):
+    load_catalog(folder)
+    assert "прочитано футеров - 3" in capsys.readouterr().out
+    load_catalog(folder)
+    assert "прочитано футеров" not in capsys.readouterr().out
+
+    # Новый файл без node_id: читается только его футер, столбец отмечается как отсутствующий
+    new_file = os.path.join(folder, 'data_2024-10-04.parquet')
+    table = pq.read_table(os.path.join(folder, 'data_2024-10-03.parquet')).drop(['node_id'])
+    pq.write_table(table, new_file, row_group_size=5000)
+    catalog = load_catalog(folder)
+    assert "прочитано футеров - 1, всего файлов - 4" in capsys.readouterr().out
+    assert catalog.missing_columns(['ip', 'node_id']) == {'node_id': [new_file]}
+    assert catalog.row_groups_with_nulls('node_id')[new_file] == [0, 1, 2, 3]
+
+    os.remove(new_file)
+    assert len(load_catalog(folder).files) == 3
+
+
+def test_unparsable_ts_keeps_row_groups(folder):
+    """ts не в ISO: статистика непригодна для отбора, row groups не отбрасываются"""
+    file_path = os.path.join(folder, 'data_2024-10-01.parquet')
+    table = pq.read_table(file_path)
+    ts = pa.array(['неизвестно'] * table.num_rows)
+    pq.write_table(table.set_column(table.schema.get_field_index('ts'), 'ts', ts), file_path,
+                   row_group_size=5000)
+    selection = load_catalog(folder).row_groups_in_range('2024-10-02 03:00', '2024-10-02 04:00')
+    assert selection[file_path] == [0, 1, 2, 3]
+
+
+def test_day_first_ts_keeps_row_groups(folder):
+    """ts в формате ДД.ММ.ГГГГ: min/max строк не хронологические, статистика не используется"""
+    file_path = os.path.join(folder, 'data_2024-10-02.parquet')
+    table = pq.read_table(file_path)
+    ts = pa.array(pd.to_datetime(table.column('ts').to_pandas()).dt.strftime('%d.%m.%Y %H:%M:%S'))
+    pq.write_table(table.set_column(table.schema.get_field_index('ts'), 'ts', ts), file_path,
+                   row_group_size=5000)
+    catalog = load_catalog(folder)
+    groups = catalog.row_groups[catalog.row_groups['path'] == file_path]
+    assert groups['ts_min_ms'].isna().all() and groups['ts_max_ms'].isna().all()
+    selection = catalog.row_groups_in_range('2024-10-02 03:00', '2024-10-02 04:00')
+    assert selection[file_path] == [0, 1, 2, 3]
+
+
+def test_corrupt_index_is_rebuilt(folder, capsys):
+    load_catalog(folder)
+    with open(os.path.join(catalog_dir(folder), 'files.parquet'), 'wb') as f:
+        f.write(b'not parquet')
+    assert load_catalog(folder).summary()['rows'] == 60_000
+    assert "Поврежден каталог" in capsys.readouterr().out
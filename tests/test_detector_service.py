@@ -0,0 +1,192 @@
+"""
+Резидентный сервис детекторов (detector_service): файл, положенный в папку,
+подхватывается фоновым потоком, HTTP API отвечает JSON (в том числе 400 на
+некорректные параметры), а запросы не ждут обучения модели.
+"""
+import json
+import os
+import threading
+import time
+from http.server import ThreadingHTTPServer
+from urllib.error import HTTPError
+from urllib.request import urlopen
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import detector_service
+from anomaly_without_tag_bot import detect_hidden_bots, top_bot_activity
+from bot_labels import add_bot_columns
+from detector_service import DetectorService, DetectorState, make_handler
+from night_activity_analysis import find_anomalies
+from timestamps import add_time_columns
+
+
+@pytest.fixture
+def service(tmp_path):
+    """Сервис над пустой папкой с HTTP API на свободном порту"""
+    folder = tmp_path / 'drop'
+    folder.mkdir()
+    service = DetectorService(str(folder), poll_interval=0.1)
+    server = ThreadingHTTPServer(('127.0.0.1', 0), make_handler(service))
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    service.start_watching()
+    service.url = f'http://127.0.0.1:{server.server_address[1]}'
+    service.folder = str(folder)
+    yield service
+    server.shutdown()
+    server.server_close()
+    service.stop()
+
+
+def get(service, path):
+    """(код ответа, JSON) запроса к API"""
+    try:
+        with urlopen(service.url + path, timeout=10) as response:
+            return response.status, json.loads(response.read())
+    except HTTPError as e:
+        return e.code, json.loads(e.read())
+
+
+def drop_file(service, source, name):
+    """Кладет файл в папку сервиса атомарно (как выгрузка через временное имя)"""
+    target = os.path.join(service.folder, name)
+    source.to_parquet(target + '.tmp', index=False)
+    os.replace(target + '.tmp', target)
+
+
+def wait_for_files(service, n, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        status = get(service, '/status')[1]
+        if status['files'] >= n and status['model_fitted']:
+            return status
+        time.sleep(0.1)
+    raise AssertionError(f"Сервис не загрузил {n} файлов за {timeout} с")
+
+
+def test_file_drop(service, dataset_files):
+    df = pd.read_parquet(dataset_files[0])
+    # Строки без node_id с заполненным url - пропуски node_id для /node_id_misses
+    df['url'] = np.where(df['node_id'].isna(), 'https://example.org/video', None)
+    assert get(service, '/status')[1]['files'] == 0
+
+    drop_file(service, df, 'data_2024-10-01.parquet')
+    status = wait_for_files(service, 1)
+    assert status['minutes'] > 0
+    assert status['unique_ips'] == df['ip'].nunique()
+
+    code, spikes = get(service, '/spikes?start=2024-10-01T00:00&end=2024-10-02T00:00&top=5')
+    assert code == 200 and len(spikes['peaks']) == 5
+    loaded = add_bot_columns(add_time_columns(df.copy()))
+    per_minute = loaded.groupby(loaded['ts'].dt.floor('min')).size()
+    assert [peak['requests'] for peak in spikes['peaks']] == per_minute.nlargest(5).tolist()
+    assert spikes['anomalies']
+
+    # Ночные IP - по меткам bot_flags, как в night_activity_analysis
+    code, night = get(service, '/night')
+    night_data = loaded[loaded['hour'] < 8]
+    assert code == 200
+    assert night['requests'] == len(night_data)
+    assert night['heavy_ips'] == len(find_anomalies(night_data))
+    assert night['hidden_bot_ips'] == night_data.loc[night_data['is_hidden_bot'], 'ip'].nunique()
+
+    # Топ ботов - как top_bot_activity (явные и скрытые по bot_flags)
+    code, bots = get(service, '/top_bots?n=3')
+    expected = top_bot_activity(detect_hidden_bots(loaded.copy()), 3)
+    assert code == 200
+    assert [bot['ip'] for bot in bots] == expected.index.tolist()
+    assert [bot['requests'] for bot in bots] == expected['total_requests'].tolist()
+    assert [bot['type'] == 'скрытый' for bot in bots] == expected['is_hidden'].tolist()
+
+    code, misses = get(service, '/node_id_misses?top=1')
+    assert code == 200
+    assert misses['rows'] == int(df['node_id'].isna().sum())
+    assert misses['top_urls'] == [['https://example.org/video', misses['rows']]]
+
+    # Второй файл дописывается к агрегатам
+    drop_file(service, pd.read_parquet(dataset_files[1]), 'data_2024-10-02.parquet')
+    wait_for_files(service, 2)
+    assert get(service, '/spikes?start=2024-10-02T00:00')[1]['peaks']
+
+
+@pytest.mark.parametrize('path', [
+    '/spikes?start=garbage',
+    '/spikes?end=2024-13-45',
+    '/spikes?top=abc',
+    '/top_ips?start=NaT',
+    '/top_bots?n=ten',
+    '/node_id_misses?top=x',
+])
+def test_bad_parameters(service, path):
+    code, payload = get(service, path)
+    assert code == 400
+    assert payload['error']
+
+
+def test_unknown_route(service):
+    assert get(service, '/nothing')[0] == 404
+
+
+def test_queries_do_not_wait_for_fit(dataset_files, monkeypatch):
+    df = add_time_columns(pd.read_parquet(dataset_files[0]))
+    fitting, release = threading.Event(), threading.Event()
+
+    class SlowForest(detector_service.IsolationForest):
+        def fit_predict(self, X, y=None):
+            fitting.set()
+            assert release.wait(10)
+            return super().fit_predict(X, y)
+
+    monkeypatch.setattr(detector_service, 'IsolationForest', SlowForest)
+    state = DetectorState()
+    ingest = threading.Thread(target=state.ingest, args=(df,))
+    ingest.start()
+    try:
+        assert fitting.wait(10)
+        # Агрегаты уже видны, модель еще обучается: lock свободен
+        assert state.lock.acquire(timeout=1)
+        state.lock.release()
+        assert state.minutes['requests'].sum() == len(df)
+        assert state.model is None
+    finally:
+        release.set()
+        ingest.join()
+    assert state.model is not None
+    assert state.is_anomaly.index.equals(state.intervals.index)
+
+
+def test_stale_fit_does_not_replace_newer_model(dataset_files):
+    df = add_time_columns(pd.read_parquet(dataset_files[0]))
+    state = DetectorState()
+    state.ingest(df)
+    model = state.model
+    # Обучение по более старому снимку, закончившееся позже, не подменяет модель
+    state._fit_model(state.intervals.iloc[:10], state._model_generation - 1)
+    assert state.model is model
+
+
+def test_shared_minute_unique_ips(dataset_files):
+    """Минута и интервал, попавшие в два файла, считают IP один раз"""
+    df = add_time_columns(pd.read_parquet(dataset_files[0]))
+    # Граница файлов посреди минуты, плюс повторно доставленный кусок
+    split = df.index[df['ts'].dt.floor('min') == df['ts'].dt.floor('min').iloc[len(df) // 2]][3]
+    first, second = df.loc[:split], pd.concat([df.loc[split - 50:split], df.loc[split + 1:]])
+    state = DetectorState()
+    state.ingest(first)
+    state.ingest(second)
+
+    both = pd.concat([first, second])
+    expected_minutes = both.groupby(both['ts'].dt.floor('min'))['ip'].nunique()
+    expected_intervals = both.groupby(both['ts'].dt.floor('5min'))['ip'].nunique()
+    np.testing.assert_array_equal(state.minutes['unique_ips'], expected_minutes.to_numpy())
+    np.testing.assert_array_equal(state.intervals['unique_ips'], expected_intervals.to_numpy())
+    assert state.minutes['requests'].sum() == len(both)
+    assert len(state.ip_pairs) == both.groupby([both['ts'].dt.floor('min'), 'ip']).ngroups
+
+    # После восстановления из чекпоинта пересчет продолжается по сохраненным парам
+    restored = DetectorState().restore(state.checkpoint_parts())
+    restored.ingest(df.loc[split - 10:split])
+    np.testing.assert_array_equal(restored.minutes['unique_ips'], expected_minutes.to_numpy())
@@ -0,0 +1,120 @@
+"""
+Анализ устройств (device_usage): побитовая редукция масок совпадает с
+groupby, итог совпадает с блокнотом device_of_user.ipynb (tests/reference.py),
+а потоковый режим по файлам - с расчетом по всем данным в памяти.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import reference
+from device_usage import (DEVICE_COLUMNS, DEVICE_FLAGS, analyze_device_usage, analyze_device_usage_files,
+                          device_mask, identify_multi_device_users, session_masks)
+from memory_budget import set_memory_budget
+from session_store import IdEncoder
+
+
+def make_devices(day, n=4_000, n_sessions=600, seed=0):
+    """События одного дня: большинство сессий на одном устройстве, часть - на двух"""
+    rng = np.random.default_rng(seed)
+    sessions = rng.integers(0, n_sessions, size=n)
+    device = sessions % 3
+    switch = (sessions % 7 == 0) & (rng.random(n) < 0.5)
+    device[switch] = (device[switch] + 1) % 3
+    df = pd.DataFrame({
+        'ts': (pd.Timestamp(day) + pd.to_timedelta(np.sort(rng.integers(0, 86_400, size=n)), unit='s'))
+        .strftime('%Y-%m-%d %H:%M:%S'),
+        # Сессии переходят через полночь в следующий файл
+        'randPAS_session_id': [f's{s}' for s in sessions],
+    })
+    for i, col in enumerate(DEVICE_COLUMNS):
+        df[col] = pd.array(device == i, dtype='boolean')
+    df.loc[rng.random(n) < 0.01, 'randPAS_session_id'] = None
+    df.loc[rng.random(n) < 0.02, DEVICE_COLUMNS] = None
+    return df
+
+
+@pytest.fixture(scope='module')
+def device_files(tmp_path_factory):
+    folder = tmp_path_factory.mktemp('devices')
+    files = []
+    for i, day in enumerate(['2024-10-01', '2024-10-02', '2024-10-03']):
+        path = str(folder / f'data_{day}.parquet')
+        make_devices(day, seed=i).to_parquet(path, index=False, row_group_size=1000)
+        files.append(path)
+    return files
+
+
+def test_device_mask():
+    df = pd.DataFrame({'ua_is_tablet': [True, None, False, 1],
+                       'ua_is_pc': [False, True, None, 1],
+                       'ua_is_mobile': [False, np.nan, None, 0]})
+    np.testing.assert_array_equal(device_mask(df), [1, 2, 0, 3])
+
+
+def test_session_masks_match_groupby():
+    df = make_devices('2024-10-01')
+    codes = IdEncoder().encode(df['randPAS_session_id'].to_numpy())
+    masks = session_masks(codes, device_mask(df), codes.max() + 1)
+    flags = df.groupby('randPAS_session_id', sort=False)[DEVICE_COLUMNS].max().fillna(False).astype(bool)
+    expected = sum(np.where(flags[col], bit, 0) for col, bit in DEVICE_FLAGS.items())
+    np.testing.assert_array_equal(masks, expected.astype(np.uint8))
+
+
+def test_identify_multi_device_users():
+    df = identify_multi_device_users(make_devices('2024-10-01'))
+    flags = df.groupby('randPAS_session_id')[DEVICE_COLUMNS].max()
+    multi = flags.index[flags.sum(axis=1) > 1]
+    np.testing.assert_array_equal(df['is_multi_device_session'], df['randPAS_session_id'].isin(multi))
+
+
+def test_matches_notebook():
+    df = make_devices('2024-10-01')
+    actual = analyze_device_usage(df.copy(), 'day')
+    expected = reference.device_usage(df)
+    for key in ('multi_device_sessions', 'single_device_sessions', 'multi_device_session_count'):
+        assert actual[key] == expected[key]
+    pd.testing.assert_series_equal(actual['device_proportions'][expected['device_proportions'].index],
+                                   expected['device_proportions'], check_dtype=False, check_names=False)
+    pd.testing.assert_series_equal(actual['hourly_data'][expected['hourly_data'].index],
+                                   expected['hourly_data'], check_dtype=False, check_names=False,
+                                   check_index_type=False)
+
+
+@pytest.mark.parametrize('budget', [None, '4KB'])
+def test_streaming_matches_in_memory(device_files, budget):
+    # При малом бюджете файлы читаются по row groups, результаты - те же
+    set_memory_budget(budget)
+    try:
+        per_file, total = analyze_device_usage_files(device_files)
+    finally:
+        set_memory_budget(None)
+    assert len(per_file) == len(device_files)
+    df = pd.concat([pd.read_parquet(path) for path in device_files], ignore_index=True)
+    expected = analyze_device_usage(df, 'все файлы')
+    for key in ('multi_device_sessions', 'single_device_sessions',
+                'multi_device_session_count', 'single_device_session_count'):
+        assert total[key] == expected[key]
+    pd.testing.assert_series_equal(total['device_proportions'], expected['device_proportions'])
+    pd.testing.assert_frame_equal(total['hourly_device_mix'], expected['hourly_device_mix'])
+
+    # По отдельности файл считается как в памяти
+    for path, result in zip(device_files, per_file):
+        expected = analyze_device_usage(pd.read_parquet(path), os.path.basename(path))
+        assert result['multi_device_sessions'] == expected['multi_device_sessions']
+        pd.testing.assert_frame_equal(result['hourly_device_mix'], expected['hourly_device_mix'])
+
+
+def test_checkpoint_resume(device_files, tmp_path):
+    expected_files, expected = analyze_device_usage_files(device_files)
+    # Второй запуск восстанавливает кодировщик и маски двух дней и дочитывает третий
+    analyze_device_usage_files(device_files[:2], checkpoint_dir=str(tmp_path))
+    per_file, total = analyze_device_usage_files(device_files, checkpoint_dir=str(tmp_path))
+    assert [r['file_name'] for r in per_file] == [r['file_name'] for r in expected_files]
+    for key in ('multi_device_sessions', 'single_device_sessions', 'multi_device_session_count'):
+        assert total[key] == expected[key]
+        assert [r[key] for r in per_file] == [r[key] for r in expected_files]
+    pd.testing.assert_series_equal(total['device_proportions'], expected['device_proportions'])
+    pd.testing.assert_frame_equal(total['hourly_device_mix'], expected['hourly_device_mix'])
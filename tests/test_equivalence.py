@@ -0,0 +1,262 @@
+"""
+Оптимизированные пути (упреждающее чтение, row groups, потоковая агрегация,
+шарды в процессах, чекпоинты) дают те же результаты, что и расчет в памяти.
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+import reference
+from activity_spikes_isolation import detect_anomalies
+from anomaly_without_tag_bot import analyze_activity_streaming, detect_hidden_bots, top_bot_activity
+from bot_labels import compute_bot_flags
+import data_loader
+from data_loader import iter_data_files
+from isolation_sweep import base_aggregates, load_base_aggregates, reduce_to_interval, run_sweep
+from memory_budget import set_memory_budget
+from dataset_catalog import load_catalog
+from night_activity_analysis import extended_tables, find_anomalies, load_all_data, night_tables, summarize_files
+from node_id_check import analyze_missing_node_ids, analyze_missing_node_ids_streaming, load_data
+from page_view_anomalies import (detect_page_number_anomalies, detect_page_number_anomalies_across_files,
+                                 detect_page_number_anomalies_sharded,
+                                 iter_preprocessed_data, load_and_preprocess_data)
+from sharding import ShardWriter, bot_ip_summary, map_shards, night_ip_anomalies
+from topk_sketch import TopKWindows
+
+
+def read_all(dataset_dir, **kwargs):
+    return pd.concat([df for _, df in iter_data_files(dataset_dir, **kwargs)], ignore_index=True)
+
+
+@pytest.mark.parametrize('options', [
+    {'prefetch': 2},
+    {'row_groups': True},
+    {'row_groups': True, 'prefetch': 2},
+])
+def test_loader_modes(dataset_dir, options):
+    columns = ['ts', 'ip', 'ua_is_bot', 'ua_header', 'event']
+    expected = read_all(dataset_dir, columns=columns, derive_time=True, derive_bots=True)
+    actual = read_all(dataset_dir, columns=columns, derive_time=True, derive_bots=True, **options)
+    pd.testing.assert_frame_equal(actual, expected)
+
+
+@pytest.fixture
+def broken_files(dataset_files, tmp_path):
+    """Набор, в котором второй файл не читается"""
+    broken = str(tmp_path / 'data_2024-10-02.parquet')
+    with open(broken, 'wb') as f:
+        f.write(b'not parquet')
+    return [dataset_files[0], broken, dataset_files[2]]
+
+
+@pytest.mark.parametrize('prefetch', [0, 2])
+def test_failed_read(broken_files, prefetch, capsys):
+    # По умолчанию файл пропускается с сообщением, с errors='raise' - ошибка доходит до вызывающего
+    loaded = [file for file, _ in iter_data_files(broken_files, prefetch=prefetch)]
+    assert loaded == [broken_files[0], broken_files[2]]
+    assert f"Ошибка при загрузке {broken_files[1]}" in capsys.readouterr().out
+    with pytest.raises(Exception):
+        list(iter_data_files(broken_files, prefetch=prefetch, errors='raise'))
+
+
+def test_prefetch_pipeline_failure(dataset_files, monkeypatch):
+    """Сбой фонового потока не выглядит как обычный конец данных"""
+    def failing_tasks(files, row_groups=False, columns=None):
+        yield files[0], None
+        raise OSError("диск недоступен")
+
+    monkeypatch.setattr(data_loader, '_iter_read_tasks', failing_tasks)
+    frames = iter_data_files(dataset_files, prefetch=2)
+    with pytest.raises(OSError, match="диск недоступен"):
+        for _ in frames:
+            pass
+
+
+def test_time_columns(dataset_files):
+    df = read_all(dataset_files[:1], derive_time=True)
+    raw = pd.to_datetime(pd.read_parquet(dataset_files[0], columns=['ts'])['ts'])
+    np.testing.assert_array_equal(df['ts'].to_numpy(), raw.to_numpy())
+    np.testing.assert_array_equal(df['hour'].to_numpy(), raw.dt.hour.to_numpy())
+    np.testing.assert_array_equal(df['minute'].to_numpy(), raw.dt.minute.to_numpy())
+
+
+def test_bot_flags_cached(dataset_files):
+    df = read_all(dataset_files[:1], derive_bots=True)
+    np.testing.assert_array_equal(df['bot_flags'].to_numpy(),
+                                  compute_bot_flags(pd.read_parquet(dataset_files[0])))
+
+
+def test_interval_activity(dataset_dir):
+    df = load_all_data(dataset_dir)
+    actual = detect_anomalies(df.copy()).drop(columns='is_anomaly')
+    expected = reference.interval_activity(df)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+@pytest.mark.parametrize('interval, contamination', [(5, 0.05), (1, 0.01), (15, 0.1)])
+def test_sweep_matches_detect_anomalies(dataset_dir, interval, contamination):
+    """Одна модель на интервал с порогом по percentile = IsolationForest(contamination)"""
+    df = load_all_data(dataset_dir)
+    expected = detect_anomalies(df.copy(), interval, contamination)
+    minutes, pairs = base_aggregates(df)
+    comparison, results = run_sweep(minutes, pairs, intervals=(interval,),
+                                    contaminations=(contamination,), n_jobs=1)
+    actual = results[(interval, contamination)].drop(columns='interval_ms')
+    pd.testing.assert_frame_equal(actual, expected[actual.columns], check_dtype=False)
+    assert comparison['anomalies'].tolist() == [expected['is_anomaly'].sum()]
+    assert comparison['jaccard_vs_reference'].tolist() == [1.0]
+
+
+def test_night_summary(dataset_dir):
+    df = load_all_data(dataset_dir)
+    with ShardWriter('ip', n_shards=4) as shards:
+        extended, night = summarize_files(dataset_dir, TopKWindows(), shards)
+        results = map_shards(night_ip_anomalies, shards.close(), n_workers=2)
+
+    expected = extended_tables(df)
+    for key in ('rows', 'date_min', 'date_max', 'unique_ips', 'bots'):
+        assert extended[key] == expected[key]
+    for key in ('daily_stats', 'hourly_stats'):
+        pd.testing.assert_frame_equal(extended[key], expected[key], check_dtype=False,
+                                      check_names=False, check_index_type=False)
+
+    night_data = df[df['hour'].between(0, 7)]
+    expected = night_tables(night_data)
+    for key in ('rows', 'unique_ips', 'bots'):
+        assert night[key] == expected[key]
+    pd.testing.assert_frame_equal(night['hour_stats'], expected['hour_stats'], check_dtype=False,
+                                  check_index_type=False)
+    pd.testing.assert_series_equal(night['date_counts'], expected['date_counts'],
+                                   check_dtype=False, check_names=False, check_index_type=False)
+
+    anomalies = pd.concat([anomalies for anomalies, _ in results]).sort_values(['ip', 'is_bot'], ignore_index=True)
+    pd.testing.assert_frame_equal(anomalies, find_anomalies(night_data).reset_index(drop=True))
+    # Данные в памяти делятся по IP без записи шардов на диск
+    pd.testing.assert_frame_equal(find_anomalies(night_data, n_workers=2), anomalies)
+
+
+def test_bot_top(dataset_dir, tmp_path):
+    df = detect_hidden_bots(load_all_data(dataset_dir))
+    expected = top_bot_activity(df)
+    # total_requests - все запросы IP, как в исходной версии
+    notebook = reference.top_bots(df).sort_index().sort_values('total_requests', ascending=False, kind='stable')
+    pd.testing.assert_frame_equal(expected, notebook, check_dtype=False, check_names=False)
+    with ShardWriter('ip', n_shards=4) as shards:
+        shards.write(df[['ip', 'ts', 'is_bot', 'is_hidden_bot']])
+        results = map_shards(bot_ip_summary, shards.close(), n_workers=2)
+    assert sum(unique for unique, _ in results) == df['ip'].nunique()
+    actual = pd.concat([top for _, top in results]).sort_index().nlargest(10, 'total_requests')
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False, check_names=False)
+    pd.testing.assert_frame_equal(top_bot_activity(df, n_workers=2), expected, check_dtype=False, check_names=False)
+
+    analyze_activity_streaming(dataset_dir, str(tmp_path), n_shards=4, n_workers=1)
+    bots = pd.read_csv(next(tmp_path.glob('anomalies_*.csv')))
+    assert len(bots) == int(df['is_bot'].sum())
+
+
+def test_page_anomalies_sharded(dataset_files):
+    df = pd.concat([load_and_preprocess_data(file_path) for file_path in dataset_files], ignore_index=True)
+    actual, total = detect_page_number_anomalies_sharded(dataset_files, n_shards=4, n_workers=2)
+    assert total == len(df)
+    pd.testing.assert_frame_equal(actual, reference.detect_page_number_anomalies(df), check_dtype=False)
+    in_memory = detect_page_number_anomalies(df.copy(), n_workers=2)
+    pd.testing.assert_frame_equal(in_memory, reference.detect_page_number_anomalies(df), check_dtype=False)
+
+
+def test_preprocessed_by_row_groups(dataset_files, tmp_path):
+    df = pd.read_parquet(dataset_files[0])
+    # Дубликаты внутри row group и в других row groups
+    df = pd.concat([df.iloc[:6000], df.iloc[[10, 10, 5500]], df.iloc[6000:], df.iloc[[20, 5500]]],
+                   ignore_index=True)
+    path = str(tmp_path / 'data_2024-10-01.parquet')
+    df.to_parquet(path, index=False, row_group_size=5000)
+    expected = load_and_preprocess_data(path).reset_index(drop=True)
+    set_memory_budget('64KB')
+    try:
+        parts = list(iter_preprocessed_data(path))
+    finally:
+        set_memory_budget(None)
+    assert len(parts) == 5
+    pd.testing.assert_frame_equal(pd.concat(parts, ignore_index=True), expected)
+
+
+def test_node_id_by_row_groups(dataset_files, tmp_path):
+    df = pd.read_parquet(dataset_files[0])
+    df['url'] = np.where(np.arange(len(df)) % 3 == 0, 'https://example.org/video', None)
+    path = str(tmp_path / 'data_2024-10-01.parquet')
+    df.to_parquet(path, index=False, row_group_size=5000)
+    row_groups = load_catalog([path]).row_groups_with_nulls('node_id')
+    expected, expected_columns = analyze_missing_node_ids(load_data(path, row_groups))
+    actual, columns = analyze_missing_node_ids_streaming(row_groups)
+    assert columns == expected_columns == ['url']
+    assert len(actual)
+    pd.testing.assert_frame_equal(actual, expected.reset_index(drop=True))
+
+
+def test_node_id_checkpoint(dataset_files, tmp_path):
+    paths = []
+    for i, file_path in enumerate(dataset_files):
+        df = pd.read_parquet(file_path)
+        df['url'] = np.where(np.arange(len(df)) % 3 == i, 'https://example.org/video', None)
+        paths.append(str(tmp_path / os.path.basename(file_path)))
+        df.to_parquet(paths[-1], index=False, row_group_size=5000)
+    row_groups = load_catalog(paths).row_groups_with_nulls('node_id')
+    expected, expected_columns = analyze_missing_node_ids_streaming(row_groups)
+    # Второй запуск берет проблемные строки первых двух файлов из чекпоинта
+    checkpoint_dir = str(tmp_path / 'checkpoint')
+    analyze_missing_node_ids_streaming({f: row_groups[f] for f in paths[:2]}, checkpoint_dir)
+    actual, columns = analyze_missing_node_ids_streaming(row_groups, checkpoint_dir)
+    assert columns == expected_columns
+    assert sorted(os.listdir(tmp_path / 'checkpoint' / 'appended')) == \
+        [f'missing-{i:05d}.parquet' for i in range(3)]
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+
+
+def test_page_anomalies_by_row_groups(dataset_files):
+    expected, total, store = detect_page_number_anomalies_across_files(dataset_files)
+    expected_sharded, _ = detect_page_number_anomalies_sharded(dataset_files, n_shards=4, n_workers=1)
+    assert store.keep_events
+    # Файлы больше бюджета читаются по row groups, события сессий не хранятся
+    set_memory_budget('64KB')
+    try:
+        actual, actual_total, store = detect_page_number_anomalies_across_files(dataset_files)
+        sharded, sharded_total = detect_page_number_anomalies_sharded(dataset_files, n_shards=4, n_workers=1)
+    finally:
+        set_memory_budget(None)
+    assert not store.keep_events and not store.chunks
+    assert actual_total == sharded_total == total
+    # Аномалии выдаются по частям файла, поэтому сравнение без учета порядка
+    columns = list(expected.columns)
+    pd.testing.assert_frame_equal(actual.sort_values(columns, ignore_index=True),
+                                  expected.sort_values(columns, ignore_index=True))
+    pd.testing.assert_frame_equal(sharded, expected_sharded)
+
+
+def test_page_anomalies_checkpoint(dataset_files, tmp_path):
+    expected, total, _ = detect_page_number_anomalies_across_files(dataset_files)
+    # Первый запуск учитывает два дня, второй дочитывает третий из чекпоинта
+    detect_page_number_anomalies_across_files(dataset_files[:2], checkpoint_dir=str(tmp_path))
+    actual, actual_total, _ = detect_page_number_anomalies_across_files(dataset_files, checkpoint_dir=str(tmp_path))
+    assert actual_total == total
+    # Каждое поколение дописывает только аномалии своего файла
+    assert sorted(os.listdir(tmp_path / 'appended')) == [f'anomalies-{i:05d}.parquet' for i in range(3)]
+    # Коды сессий после восстановления назначаются заново, поэтому сравнение без учета порядка
+    columns = list(expected.columns)
+    pd.testing.assert_frame_equal(actual.sort_values(columns, ignore_index=True),
+                                  expected.sort_values(columns, ignore_index=True))
+
+
+
+def test_base_aggregates_checkpoint(dataset_dir, dataset_files, tmp_path):
+    df = load_all_data(dataset_dir)
+    expected = reduce_to_interval(*base_aggregates(df), 5)
+    # Второй запуск берет первые два дня из чекпоинта и дочитывает третий
+    load_base_aggregates(dataset_files[:2], checkpoint_dir=str(tmp_path))
+    minutes, pairs = load_base_aggregates(dataset_files, checkpoint_dir=str(tmp_path))
+    with pairs:
+        actual = reduce_to_interval(minutes, pairs, 5)
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
+    # В чекпоинте по одной части агрегатов на файл, а не накопленная история
+    assert len(os.listdir(tmp_path / 'appended')) == 2 * len(dataset_files)
@@ -0,0 +1,96 @@
+"""
+Выходные CSV детекторов на тестовом наборе совпадают с эталонами tests/golden.
+
+Эталоны имеют тот же формат, что и выгрузки в «graphs and reports/»
+(те посчитаны по реальным данным, которых нет в репозитории), а часть из них
+сверена с исходным кодом блокнотов (tests/reference.py), поэтому
+--update-golden не закрепит ошибку оптимизированной версии.
+"""
+import os
+
+import pandas as pd
+import pytest
+
+import reference
+from activity_spikes_analysis import analyze_data
+from activity_spikes_isolation import detect_anomalies, detect_anomalies_streaming, load_all_data, save_results
+from memory_budget import set_memory_budget
+from page_view_anomalies import detect_page_number_anomalies, load_and_preprocess_data
+
+GOLDEN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'golden')
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'graphs and reports')
+# Эталон -> выгрузка того же формата из реального запуска
+REPORT_FORMATS = {
+    'activity_by_minute.csv': 'activity_spikes_analysis/datasets/activity_by_minute.csv',
+    'top10_peaks_with_matches.csv': 'activity_spikes_analysis/datasets/top10_peaks_with_matches.csv',
+    'activity_data.csv': 'activity_spikes_isolation/datasets/activity_data_20250331_143630.csv',
+    'anomalies.csv': 'activity_spikes_isolation/datasets/anomalies_20250331_143630.csv',
+}
+
+
+def test_activity_spikes(dataset_dir, epg_file, tmp_path, golden):
+    analyze_data(os.path.join(dataset_dir, '*.parquet'), epg_file,
+                 checkpoint_dir=str(tmp_path / 'checkpoint'), output_dir=str(tmp_path / 'first'))
+    golden.check(tmp_path / 'first' / 'activity_by_minute.csv', 'activity_by_minute.csv')
+    golden.check(tmp_path / 'first' / 'top10_peaks_with_matches.csv', 'top10_peaks_with_matches.csv')
+
+    # Повторный запуск берет поминутный ряд из чекпоинта - результат тот же
+    analyze_data(os.path.join(dataset_dir, '*.parquet'), epg_file,
+                 checkpoint_dir=str(tmp_path / 'checkpoint'), output_dir=str(tmp_path / 'second'))
+    golden.check(tmp_path / 'second' / 'activity_by_minute.csv', 'activity_by_minute.csv')
+    golden.check(tmp_path / 'second' / 'top10_peaks_with_matches.csv', 'top10_peaks_with_matches.csv')
+
+
+@pytest.mark.parametrize('mode', ['memory', 'streaming', 'spill'])
+def test_isolation_anomalies(mode, dataset_dir, tmp_path, golden):
+    if mode == 'memory':
+        activity = detect_anomalies(load_all_data(dataset_dir))
+    else:
+        # spill: пары (минута, IP) не помещаются в бюджет и сбрасываются на диск
+        set_memory_budget('1MB' if mode == 'spill' else None)
+        try:
+            activity = detect_anomalies_streaming(dataset_dir, checkpoint_dir=str(tmp_path / 'checkpoint'))
+        finally:
+            set_memory_budget(None)
+    save_results(activity, activity[activity['is_anomaly']], str(tmp_path), timestamp='fixture')
+    golden.check(tmp_path / 'activity_data_fixture.csv', 'activity_data.csv')
+    golden.check(tmp_path / 'anomalies_fixture.csv', 'anomalies.csv')
+
+
+def test_page_view_anomalies(dataset_files, tmp_path, golden):
+    anomalies = pd.concat([detect_page_number_anomalies(load_and_preprocess_data(file_path))
+                           for file_path in dataset_files], ignore_index=True)
+    anomalies.to_csv(tmp_path / 'page_view_anomalies.csv', index=False)
+    golden.check(tmp_path / 'page_view_anomalies.csv', 'page_view_anomalies.csv')
+
+
+def read_golden(name):
+    return pd.read_csv(os.path.join(GOLDEN_DIR, name))
+
+
+def test_spikes_golden_matches_notebook(dataset_files, epg_file, tmp_path):
+    activity, peaks = reference.activity_spikes(dataset_files, epg_file)
+    # Через CSV, как выгружал исходный код
+    activity.to_csv(tmp_path / 'activity_by_minute.csv', index=False)
+    peaks.to_csv(tmp_path / 'top10_peaks_with_matches.csv', index=False)
+    for name in ('activity_by_minute.csv', 'top10_peaks_with_matches.csv'):
+        pd.testing.assert_frame_equal(pd.read_csv(tmp_path / name), read_golden(name))
+
+
+def test_page_view_golden_matches_notebook(dataset_files):
+    expected = pd.concat([reference.detect_page_number_anomalies(reference.preprocess_page_views(file_path))
+                          for file_path in dataset_files], ignore_index=True)
+    golden = read_golden('page_view_anomalies.csv')
+    assert len(golden)
+    # Исходный цикл выдает аномалии в порядке groupby, поэтому сравнение без учета порядка
+    columns = list(golden.columns)
+    pd.testing.assert_frame_equal(golden.sort_values(columns, ignore_index=True),
+                                  expected[columns].sort_values(columns, ignore_index=True), check_dtype=False)
+
+
+# Проверка формата идет последней: при --update-golden эталоны к ней уже записаны
+@pytest.mark.parametrize('golden_name', sorted(REPORT_FORMATS))
+def test_golden_matches_report_format(golden_name):
+    golden_path = os.path.join(GOLDEN_DIR, golden_name)
+    report = pd.read_csv(os.path.join(REPORTS_DIR, REPORT_FORMATS[golden_name]), nrows=0)
+    assert list(pd.read_csv(golden_path, nrows=0).columns) == list(report.columns)
@@ -0,0 +1,94 @@
+"""
+Ядра kernels совпадают с эталонными реализациями во всех вариантах:
+векторный NumPy, циклические версии (исходный код ядер Numba, выполняемый
+интерпретатором) и скомпилированные Numba (если она установлена).
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+import kernels
+import reference
+from epg import Epg
+from page_view_anomalies import detect_page_number_anomalies, load_and_preprocess_data
+
+BACKENDS = ['numpy', 'loop', pytest.param('numba', marks=pytest.mark.skipif(
+    not kernels.HAVE_NUMBA, reason="Numba не установлена"))]
+
+
+@pytest.fixture(params=BACKENDS)
+def backend(request, monkeypatch):
+    """
+    Переключает kernels на проверяемую реализацию.
+
+    loop - ветка numba с подставленными циклическими функциями: проверяет
+    логику ядер без компиляции.
+    """
+    if request.param == 'loop':
+        monkeypatch.setattr(kernels, 'get_backend', lambda: 'numba')
+        monkeypatch.setattr(kernels, '_grouped_diffs_numba', kernels._grouped_diffs_loop, raising=False)
+        monkeypatch.setattr(kernels, '_rolling_max_numba', kernels._rolling_max_loop, raising=False)
+        monkeypatch.setattr(kernels, '_stab_intervals_numba', kernels._stab_intervals_loop, raising=False)
+    else:
+        kernels.set_backend(request.param)
+        request.addfinalizer(lambda: kernels.set_backend(None))
+    return request.param
+
+
+def assert_arrays_equal(actual, expected):
+    for a, e in zip(actual, expected):
+        np.testing.assert_array_equal(np.asarray(a), np.asarray(e))
+
+
+@pytest.mark.parametrize('n, n_groups', [(0, 1), (1, 1), (50, 1), (500, 40), (2000, 2000)])
+def test_grouped_diffs(backend, n, n_groups):
+    rng = np.random.default_rng(n)
+    groups = np.sort(rng.integers(0, n_groups, size=n))
+    values = rng.integers(-5, 20, size=n)
+    assert_arrays_equal(kernels.grouped_diffs(groups, values), reference.grouped_diffs(groups, values))
+
+
+@pytest.mark.parametrize('n, window', [(0, 3), (1, 1), (10, 1), (10, 25), (1000, 7), (1000, 100)])
+def test_rolling_max(backend, n, window):
+    values = np.random.default_rng(window).integers(0, 10, size=n).astype(np.float64)
+    np.testing.assert_array_equal(kernels.rolling_max(values, window), reference.rolling_max(values, window))
+
+
+def test_rolling_max_rejects_empty_window(backend):
+    with pytest.raises(ValueError):
+        kernels.rolling_max(np.arange(5), 0)
+
+
+@pytest.mark.parametrize('n, order', [(0, 10), (2, 1), (3, 1), (30, 10), (1440, 10), (5000, 3)])
+def test_local_maxima(backend, n, order):
+    # Мелкие целые дают много равных соседей: максимумы должны быть строгими
+    values = np.random.default_rng(n).integers(0, 6, size=n)
+    np.testing.assert_array_equal(kernels.local_maxima(values, order), reference.local_maxima(values, order))
+
+
+@pytest.mark.parametrize('n_intervals, n_points', [(0, 5), (5, 0), (50, 200), (300, 1000)])
+def test_stab_intervals(backend, n_intervals, n_points):
+    rng = np.random.default_rng(n_intervals + n_points)
+    starts = np.sort(rng.integers(0, 10_000, size=n_intervals))
+    ends = starts + rng.integers(0, 500, size=n_intervals)
+    points = rng.integers(-100, 10_600, size=n_points)
+    max_duration = int((ends - starts).max()) if n_intervals else 0
+    assert_arrays_equal(kernels.stab_intervals(starts, ends, points, max_duration),
+                        reference.stab_intervals(starts, ends, points))
+
+
+def test_epg_on_air(backend, epg_file):
+    epg = Epg(epg_file)
+    points = np.sort(np.random.default_rng(0).integers(epg.starts.min() - 3_600_000,
+                                                       epg.ends.max() + 3_600_000, size=300))
+    query, rows = epg.on_air(points)
+    starts, ends = epg.shows['start_ms'].to_numpy(), epg.shows['end_ms'].to_numpy()
+    expected_query, expected_rows = reference.stab_intervals(starts, ends, points)
+    assert_arrays_equal((query, rows), (expected_query, expected_rows))
+
+
+def test_page_number_anomalies(backend, dataset_files):
+    df = load_and_preprocess_data(dataset_files[0])
+    actual = detect_page_number_anomalies(df.copy())
+    expected = reference.detect_page_number_anomalies(df.copy())
+    pd.testing.assert_frame_equal(actual, expected, check_dtype=False)
@@ -0,0 +1,90 @@
+"""
+Прореживание рядов (render_backend) сохраняет концы ряда и экстремумы,
+а отложенная отрисовка пишет PNG.
+"""
+import matplotlib.pyplot as plt
+import numpy as np
+import pandas as pd
+import pytest
+
+import activity_spikes_isolation
+from activity_spikes_isolation import analyze_anomalies, detect_anomalies, load_all_data
+from render_backend import ChartRenderer, downsample, lttb_downsample, minmax_downsample, plot_line
+
+METHODS = [minmax_downsample, lttb_downsample]
+
+
+def noisy_series(n, seed=0):
+    """Шум с одиночными пиком и провалом в случайных местах"""
+    rng = np.random.default_rng(seed)
+    y = rng.normal(100, 5, size=n)
+    y[rng.integers(1, n - 1)] = 1_000
+    y[rng.integers(1, n - 1)] = -1_000
+    return np.arange(n), y
+
+
+@pytest.mark.parametrize('method', METHODS)
+@pytest.mark.parametrize('n, max_points', [(10_000, 100), (50_001, 4000), (1_000, 7)])
+def test_keeps_endpoints_and_extremes(method, n, max_points):
+    x, y = noisy_series(n, seed=n)
+    idx = method(x, y, max_points)
+    assert idx[0] == 0 and idx[-1] == n - 1
+    assert np.all(np.diff(idx) > 0)
+    assert y.argmax() in idx and y.argmin() in idx
+    # Кроме корзин - не больше концов ряда и глобальных экстремумов
+    assert len(idx) <= max_points + 2
+
+
+def test_minmax_keeps_bucket_extremes():
+    x, y = noisy_series(10_000)
+    idx = minmax_downsample(x, y, 100)
+    # 50 корзин по 200 точек: экстремум каждой корзины попадает в выборку
+    buckets = y.reshape(50, 200)
+    assert np.all(np.isin(np.arange(50) * 200 + buckets.argmax(axis=1), idx))
+    assert np.all(np.isin(np.arange(50) * 200 + buckets.argmin(axis=1), idx))
+
+
+@pytest.mark.parametrize('method', METHODS)
+def test_short_series_unchanged(method):
+    x, y = noisy_series(50)
+    np.testing.assert_array_equal(method(x, y, 100), np.arange(50))
+
+
+def test_datetime_axis():
+    x = pd.date_range('2024-10-01', periods=20_000, freq='min').to_numpy()
+    y = noisy_series(20_000)[1]
+    for method in ('minmax', 'lttb'):
+        xd, yd = downsample(x, y, 500, method)
+        assert xd.dtype == x.dtype
+        assert xd[0] == x[0] and xd[-1] == x[-1]
+        assert yd.max() == y.max() and yd.min() == y.min()
+
+
+def test_unknown_method():
+    with pytest.raises(ValueError):
+        downsample(*noisy_series(10), method='random')
+
+
+def draw(fig, x, y):
+    plot_line(fig.add_subplot(111), x, y, max_points=200)
+
+
+@pytest.mark.parametrize('mode', ['thread', 'process'])
+def test_renderer_writes_png(mode, tmp_path):
+    x, y = noisy_series(5_000)
+    with ChartRenderer(mode) as renderer:
+        renderer.submit(draw, str(tmp_path / 'chart.png'), x, y)
+        paths = renderer.wait()
+    assert paths == [str(tmp_path / 'chart.png')]
+    with open(paths[0], 'rb') as f:
+        assert f.read(8) == b'\x89PNG\r\n\x1a\n'
+
+
+def test_anomalies_inline_without_path(dataset_dir, monkeypatch):
+    """Без plot_path графики по-прежнему выводятся в ноутбук"""
+    shown = []
+    monkeypatch.setattr(activity_spikes_isolation.plt, 'show', lambda: shown.append(plt.gcf()))
+    activity = detect_anomalies(load_all_data(dataset_dir))
+    assert analyze_anomalies(activity) is None
+    assert len(shown) == 1 and len(shown[0].axes) >= 4
+    plt.close('all')
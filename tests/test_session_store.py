@@ -0,0 +1,101 @@
+"""
+SessionStore и IdEncoder: коды стабильны между файлами, сессия через полночь
+не дает ложного сброса, хвосты закрываются после session_timeout, а состояние
+после чекпоинта продолжает проверку так же, как без перерыва.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from checkpoint import Checkpoint
+from session_store import IdEncoder, SessionStore
+
+
+def events(rows):
+    """Кадр событий из кортежей (пользователь, сессия, ts, номер страницы)"""
+    return pd.DataFrame(rows, columns=['randPAS_user_agent_id', 'randPAS_session_id', 'ts',
+                                       'page_view_order_number'])
+
+
+DAY1 = events([
+    ('u1', 's1', '2024-10-01 23:50:00', 1),
+    ('u1', 's1', '2024-10-01 23:55:00', 2),
+    ('u1', 's1', '2024-10-01 23:58:00', 3),
+    # Закончилась задолго до полуночи - хвост не сохраняется
+    ('u2', 's2', '2024-10-01 20:00:00', 1),
+    ('u2', 's2', '2024-10-01 20:05:00', 2),
+    ('u3', 's3', '2024-10-01 23:40:00', 1),
+    ('u3', 's3', '2024-10-01 23:45:00', 2),
+])
+DAY2 = events([
+    ('u1', 's1', '2024-10-02 00:02:00', 4),
+    ('u1', 's1', '2024-10-02 00:05:00', 6),
+    ('u2', 's2', '2024-10-02 00:10:00', 5),
+    ('u3', 's3', '2024-10-02 00:01:00', 1),
+])
+
+
+def test_id_encoder():
+    encoder = IdEncoder()
+    np.testing.assert_array_equal(encoder.encode(np.array(['b', 'a', None, 'b'], dtype=object)), [0, 1, -1, 0])
+    # Известные идентификаторы сохраняют коды, новые получают следующие номера
+    np.testing.assert_array_equal(encoder.encode(np.array(['c', 'a'], dtype=object)), [2, 1])
+    assert len(encoder) == 3
+    np.testing.assert_array_equal(encoder.decode([2, 0, 1]), ['c', 'b', 'a'])
+
+
+def test_midnight_session():
+    store = SessionStore()
+    assert store.add(DAY1).empty
+    anomalies = store.add(DAY2)
+    # 3 -> 4 через полночь - продолжение сессии, 4 -> 6 - пропуск с номером события по всей сессии
+    s1 = anomalies[anomalies['session_id'] == 's1']
+    assert s1[['anomaly_type', 'previous_number', 'event_index']].values.tolist() == [['skip', 4, 4]]
+    # Открытая в полночь сессия, начатая заново, - сброс
+    s3 = anomalies[anomalies['session_id'] == 's3']
+    assert s3[['anomaly_type', 'previous_number', 'event_index']].values.tolist() == [['reset', 2, 2]]
+    events_s1 = store.session_events('u1', 's1')
+    assert events_s1['page_view_order_number'].tolist() == [1, 2, 3, 4, 6]
+
+
+@pytest.mark.parametrize('timeout, expired', [('30min', True), ('5h', False)])
+def test_tail_expiry(timeout, expired):
+    store = SessionStore(session_timeout=timeout)
+    store.add(DAY1)
+    user_ids, _ = store.split_key(store.tails.index.to_numpy())
+    assert ('u2' not in user_ids) == expired
+    anomalies = store.add(DAY2)
+    s2 = anomalies[anomalies['session_id'] == 's2']
+    # После session_timeout сессия считается новой: номер 5 не сравнивается с 2
+    assert s2.empty == expired
+    if not expired:
+        assert s2['anomaly_type'].tolist() == ['skip']
+
+
+def test_parts_keep_tails():
+    # Части одного файла не закрывают хвосты: итог как при добавлении файла целиком
+    whole = SessionStore()
+    whole.add(DAY1)
+    parts = SessionStore()
+    parts.add(DAY1.iloc[:3], final=False)
+    parts.add(DAY1.iloc[3:])
+    pd.testing.assert_frame_equal(parts.tails.sort_index(), whole.tails.sort_index())
+    pd.testing.assert_frame_equal(parts.add(DAY2), whole.add(DAY2))
+
+
+def test_checkpoint_round_trip(tmp_path):
+    path = str(tmp_path / 'data_2024-10-01.parquet')
+    DAY1.to_parquet(path, index=False)
+    expected_store = SessionStore()
+    expected_store.add(DAY1)
+    expected = expected_store.add(DAY2)
+
+    store = SessionStore()
+    store.add(DAY1)
+    Checkpoint(str(tmp_path / 'checkpoint'), 'sessions').commit(path, store.checkpoint_parts())
+    parts = Checkpoint(str(tmp_path / 'checkpoint'), 'sessions').restore([path])
+    # Ключи кодируются заново, хвосты - те же сессии с теми же значениями
+    restored = SessionStore().restore(parts)
+    pd.testing.assert_frame_equal(restored.checkpoint_parts()['tails'].sort_values('user_id', ignore_index=True),
+                                  store.checkpoint_parts()['tails'].sort_values('user_id', ignore_index=True))
+    pd.testing.assert_frame_equal(restored.add(DAY2), expected)
@@ -0,0 +1,74 @@
+"""
+Разбор времени (timestamps): пропущенный ts дает MISSING_MS во всех ветках
+parse_ts, а строки без ts и передачи без dur отбрасываются, а не попадают в
+агрегаты переполненным числом.
+"""
+import numpy as np
+import pandas as pd
+import pytest
+
+from data_loader import iter_data_files
+from epg import load_schedule, parse_schedule
+from timestamps import MISSING_MS, add_time_columns, parse_ts, to_datetime, tz_offset_ms
+
+MSK = tz_offset_ms('Europe/Moscow')
+T0 = int(pd.Timestamp('2024-10-01 12:00').value // 10**6)
+
+
+@pytest.mark.parametrize('values', [
+    ['2024-10-01 12:00:00', None, 'NaT'],
+    pd.to_datetime(['2024-10-01 12:00:00', None, None]),
+    pd.to_datetime(['2024-10-01 12:00:00', None, None]).tz_localize('Europe/Moscow'),
+])
+def test_missing_ts(values):
+    ts_ms = parse_ts(pd.Series(values))
+    np.testing.assert_array_equal(ts_ms, [T0 - MSK, MISSING_MS, MISSING_MS])
+
+
+@pytest.mark.parametrize('scale', [1, 1_000, 1_000_000])
+def test_missing_epoch(scale):
+    values = pd.Series([(T0 - MSK) / 1000 * scale, np.nan])
+    np.testing.assert_array_equal(parse_ts(values), [T0 - MSK, MISSING_MS])
+    nullable = pd.Series([int((T0 - MSK) / 1000 * scale), None], dtype='Int64')
+    np.testing.assert_array_equal(parse_ts(nullable), [T0 - MSK, MISSING_MS])
+
+
+def test_to_datetime_missing():
+    result = to_datetime(np.array([T0 - MSK, MISSING_MS]))
+    assert result[0] == pd.Timestamp('2024-10-01 12:00')
+    assert pd.isna(result[1])
+
+
+def test_add_time_columns_drops_missing(capsys):
+    df = pd.DataFrame({'ts': ['2024-10-01 12:00:00', None, '2024-10-01 13:30:00'], 'ip': ['a', 'b', 'c']})
+    result = add_time_columns(df)
+    assert result['ip'].tolist() == ['a', 'c']
+    assert result['hour'].tolist() == [12, 13]
+    assert result['date'].tolist() == [pd.Timestamp('2024-10-01')] * 2
+    assert "Пропущено строк без ts: 1" in capsys.readouterr().out
+
+
+def test_iter_data_files_drops_missing(dataset_files, tmp_path):
+    df = pd.read_parquet(dataset_files[0]).head(1000)
+    df.loc[[0, 500], 'ts'] = None
+    path = str(tmp_path / 'data_2024-10-01.parquet')
+    df.to_parquet(path, index=False)
+    # Второй проход читает ts_ms из кэша - пропуски отбрасываются и там
+    for _ in range(2):
+        [(_, loaded)] = list(iter_data_files([path], derive_time=True))
+        assert len(loaded) == 998
+        assert loaded['ts'].notna().all()
+        assert loaded['date'].nunique() == 1
+
+
+def test_schedule_drops_missing(epg_file, tmp_path, capsys):
+    raw = pd.read_csv(epg_file)
+    raw.loc[0, 'dur'] = np.nan
+    raw.loc[1, 'start_ts'] = None
+    path = str(tmp_path / 'epg.csv')
+    raw.to_csv(path, index=False)
+    schedule = parse_schedule(path)
+    assert len(schedule) == len(raw) - 2
+    assert "Пропущено передач без start_ts или dur: 2" in capsys.readouterr().out
+    assert (schedule['end_ms'] - schedule['start_ms']).eq(7_200_000).all()
+    pd.testing.assert_frame_equal(load_schedule(path), schedule)